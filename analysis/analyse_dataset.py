@@ -1,190 +1,305 @@
 #!/usr/bin/env python
 
+""" analyse_dataset.py: statistics and a naive baseline of the partitions of a dataset, computed on integer codes """
 __author__ = "Bogomil Gospodinov"
 __email__ = "s1312650@sms.ed.ac.uk"
 __status__ = "dev"
 
-if __name__ == "__main__":
-    import os
-    import sys
-    import pandas as pd
-    import numpy as np
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from data.preprocess_ud import preprocess_dataset_for_train, preprocess_dataset_for_eval
+from data.compile_ud import is_compiled, load_compiled
+
+cols = list(config["DATASET"]["COLUMNS"].values())
+WORD = config["DATASET"]["COLUMNS"]["WORD"]
+LEMMA = config["DATASET"]["COLUMNS"]["LEMMA"]
+TAG = config["DATASET"]["COLUMNS"]["TAG"]
+
+
+def read_partition_tokens(path, usecols):
+    """
+    :param path: file path of the partition (or of a partition compiled by compile_ud)
+    :param usecols: indices of the columns to read
+    :return: tuple(preprocessed dataframe without sentence boundaries, evaluation mask of its rows)
+    """
+    if is_compiled(path):
+        # compiled partitions are already preprocessed, only their sentence boundaries are dropped
+        df = load_compiled(path)
+        df = df[df["word"].notnull()]
+    else:
+        df = preprocess_dataset_for_train(pd.read_csv(path, sep='\s+', names=cols, usecols=usecols))
+    return df, df.index.isin(preprocess_dataset_for_eval(df).index)
+
+
+def encode_partitions(partition_dfs):
+    """
+    Replaces the strings of all columns of all partitions with codes into one table of strings, so that values are
+    compared across columns and partitions as integers
+    :param partition_dfs: dictionary of partition name and dataframe (columns: word, lemma, tag)
+    :return: tuple(dictionary of partition name and dictionary of column name and int64 array of codes, -1 for
+    missing values, array of strings)
+    """
+    values = [partition_df[col].values for partition_df in partition_dfs.values() for col in cols]
+    codes, types = pd.factorize(np.concatenate(values) if values else np.array([], dtype=object))
+    bounds = np.cumsum([0] + [len(value) for value in values])
+
+    partition_codes = OrderedDict()
+    chunks = iter(zip(bounds[:-1], bounds[1:]))
+    for partition in partition_dfs:
+        partition_codes[partition] = {col: codes[start:end].astype(np.int64) for col, (start, end) in zip(cols, chunks)}
+    return partition_codes, np.asarray(types, dtype=object)
+
+
+def distinct_values(group_codes, value_codes, type_count):
+    """
+    Counts the distinct values of a column within every group, as groupby(group)[value].nunique()
+    :param group_codes: codes of the column to group by
+    :param value_codes: codes of the column to count
+    :param type_count: number of strings in the table of codes
+    :return: tuple(codes of the groups, number of distinct non-missing values of every group)
+    """
+    groups = np.unique(group_codes[group_codes >= 0])
+    valid = (group_codes >= 0) & (value_codes >= 0)
+    pairs = np.unique(group_codes[valid] * type_count + value_codes[valid])
+    counts = np.bincount(pairs // type_count, minlength=type_count)
+    return groups, counts[groups]
+
+
+def most_frequent_values(group_codes, value_codes, types):
+    """
+    Finds the most frequent value of every group, ties going to the value that sorts first as in the original
+    groupby([group, value]).size() based baseline
+    :param group_codes: codes of the column to group by
+    :param value_codes: codes of the column whose values are counted
+    :param types: table of strings of the codes
+    :return: array of the code of the most frequent value of every code used as group, -1 for other codes
+    """
+    type_count = len(types)
+    ranks = np.empty(type_count, dtype=np.int64)
+    ranks[np.argsort(types.astype(str), kind='stable')] = np.arange(type_count)
+
+    valid = (group_codes >= 0) & (value_codes >= 0)
+    pairs, counts = np.unique(group_codes[valid] * type_count + value_codes[valid], return_counts=True)
+    pair_groups, pair_values = np.divmod(pairs, type_count)
+    order = np.lexsort((ranks[pair_values], -counts, pair_groups))
+    pair_groups, pair_values = pair_groups[order], pair_values[order]
+    first = np.ones(len(pair_groups), dtype=bool)
+    first[1:] = pair_groups[1:] != pair_groups[:-1]
+
+    best = np.full(type_count, -1, dtype=np.int64)
+    best[pair_groups[first]] = pair_values[first]
+    return best
+
+
+def main(argv):
+    import argparse
+    from analysis.evaluation_index import load_index, DEFAULT_INDEX_DIR
 
     pd.set_option('display.max_rows', 50)
     pd.set_option('display.max_columns', None)
 
-    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-    from data.preprocess_ud import preprocess_dataset_for_train, preprocess_dataset_for_eval
-    from config import config
-    import argparse
-    
-    cols = list(config["DATASET"]["COLUMNS"].values())
     # UD --folder ../data/UD_Bulgarian-BTB --cols 1 2 4 --training bg_btb-ud-train.conllu --dev bg_btb-ud-dev.conllu --test bg_btb-ud-test.conllu
     parser = argparse.ArgumentParser()
-    parser.add_argument("--folder", help="dataset folder path", type=str, 
-                            default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"]))
+    parser.add_argument("--folder", help="dataset folder path", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"]))
     parser.add_argument("--cols", help="list of column indices to read (order doesnt matter)", nargs='+', type=int, default=[0, 1, 2])
-    
+
     for partition in config["DATASET"]["PARTITIONS"]:
-        parser.add_argument("--{}".format(partition), 
-                            help="{} file name".format(partition), 
-                            type=str, 
+        parser.add_argument("--{}".format(partition),
+                            help="{} file name".format(partition),
+                            type=str,
                             default="{}.txt".format(partition))
     parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
     parser.add_argument('--unknown_tag', help="default tag to use in naive baseline if lemma is unknown", type=str, default=None)
+    parser.add_argument("--index_dir", help="directory of the stored evaluation indexes (see evaluation_index)",
+                        type=str, default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--no_index', dest='use_index', action='store_false',
+                        help="read the partitions without storing or reusing evaluation indexes")
+    args = parser.parse_args(argv)
 
-    args = parser.parse_args()
-    
-    partition_dfs = {}
-    partition_types = {}
+    partitions = config["DATASET"]["PARTITIONS"]
+    evaluated_partitions = [partition for partition in partitions if partition != "training"]
 
-    partition_dfs["pre_all_tokens"] = {}
-    partition_dfs["all_tokens"] = {}
+    # the evaluation index of every (training, partition) pair holds both preprocessed partitions and their masks
+    indexes = {}
+    if args.use_index:
+        for partition in evaluated_partitions:
+            indexes[partition] = load_index(os.path.join(args.folder, args.training),
+                                            os.path.join(args.folder, vars(args)[partition]), args.cols,
+                                            args.index_dir)
 
     # preprocessing and postprocessing
-    for partition in config["DATASET"]["PARTITIONS"]:
-        partition_df = pd.read_csv(os.path.join(args.folder, vars(args)[partition]), 
-                    sep='\s+', 
-                    names=cols,
-                    usecols=args.cols)
-        
-        partition_dfs["pre_all_tokens"][partition] = preprocess_dataset_for_train(partition_df)
+    partition_dfs = OrderedDict()
+    eval_masks = {}
+    for partition in partitions:
+        if indexes and partition == "training":
+            index = next(iter(indexes.values()))
+            partition_dfs[partition], eval_masks[partition] = index["training_df"][cols], index["training_eval_mask"]
+        elif partition in indexes:
+            partition_dfs[partition], eval_masks[partition] = indexes[partition]["ground_df"][cols], \
+                indexes[partition]["eval_mask"]
+        else:
+            partition_dfs[partition], eval_masks[partition] = read_partition_tokens(
+                os.path.join(args.folder, vars(args)[partition]), args.cols)
 
         if args.postprocess:
             print("Postprocessing on.")
-            partition_dfs["all_tokens"][partition] = preprocess_dataset_for_eval(partition_dfs["pre_all_tokens"][partition])
         else:
             print("Postprocessing off.")
-            partition_dfs["all_tokens"][partition] = partition_dfs["pre_all_tokens"][partition]
+            eval_masks[partition] = np.ones(partition_dfs[partition].shape[0], dtype=bool)
+    del indexes
 
-        
-        types = {}
-        for col in cols:
-            types[col] = set(partition_dfs["all_tokens"][partition][col].unique())
-        del col, partition_df
+    # every statistic below is computed on the codes of the tokens, subsets of tokens are boolean masks
+    partition_codes, types = encode_partitions(partition_dfs)
+    type_count = len(types)
+    del partition_dfs
 
-        partition_types[partition] = types
-    del types, partition
+    # distinct codes of every column among the evaluated tokens, missing values count as a type
+    partition_types = {partition: {col: np.unique(partition_codes[partition][col][eval_masks[partition]])
+                                   for col in cols} for partition in partitions}
 
-    tag_frequency = partition_dfs["all_tokens"]["training"].groupby(["tag"]).count()["word"].sort_values(ascending=False)
+    training_codes = partition_codes["training"]
+    tag_frequency = pd.Series(np.bincount(training_codes[TAG][eval_masks["training"] & (training_codes[TAG] >= 0)],
+                                          minlength=type_count), index=types)
+    tag_frequency = tag_frequency[tag_frequency > 0].sort_values(ascending=False)
 
     print(" Dataset statistics ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
     print(("{:<20}" * 5).format("", "Word tokens", *["{} types".format(c).capitalize() for c in cols]))
-    
-    for partition in config["DATASET"]["PARTITIONS"]:
-        pt = partition_types[partition]
-        print(("{:<20}" * 5).format("{} set".format(partition), "{}/{}".format(len(partition_dfs["pre_all_tokens"][partition].index),\
-                                                                               len(partition_dfs["all_tokens"][partition].index)), *[len(pt[c]) for c in cols]))
-    del partition, pt
+    for partition in partitions:
+        print(("{:<20}" * 5).format("{} set".format(partition), "{}/{}".format(len(eval_masks[partition]),
+                                                                               int(eval_masks[partition].sum())),
+                                    *[len(partition_types[partition][c]) for c in cols]))
     print("\n")
 
-    # cache a subset of the partition dataframe of ambiguous word tokens and tag tokens, unseen during training
-    partition_dfs["unseen_word_tokens"] = {}
-    partition_dfs["unseen_lemma_tokens"] = {}
-    partition_dfs["unseen_tag_tokens"] = {}
-    partition_dfs["ambiguous_word_tokens"] = {}
+    # masks of the tokens of every scope of the naive baseline, per evaluated partition
+    scopes = OrderedDict((scope, {}) for scope in ["pre_all_tokens", "all_tokens", "unseen_word_tokens",
+                                                   "unseen_lemma_tokens", "unseen_tag_tokens",
+                                                   "ambiguous_word_tokens"])
+    for partition in evaluated_partitions:
+        scopes["pre_all_tokens"][partition] = np.ones(len(eval_masks[partition]), dtype=bool)
+        scopes["all_tokens"][partition] = eval_masks[partition]
 
     print(" Types unseen during training ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
     print(("{:<20}" * 5).format("", "", *["{} types".format(c).capitalize() for c in cols]))
-    ptt = partition_types["training"]
-    for partition in config["DATASET"]["PARTITIONS"]:
-        if partition != "training":
-            pt = partition_types[partition]
-            print(("{:<20}" * 5).format("{} set".format(partition), "", *[len(pt[c] - ptt[c]) for c in cols]))
+    for partition in evaluated_partitions:
+        pt = partition_types[partition]
+        ptt = partition_types["training"]
+        print(("{:<20}" * 5).format("{} set".format(partition), "", *[len(np.setdiff1d(pt[c], ptt[c])) for c in cols]))
 
-            # creating dataframes of unseen words during training for each partition of the dataset (i.e. valid and test sets)
-            for c in cols:
-                partition_dfs["unseen_{}_tokens".format(c)][partition] = partition_dfs["all_tokens"][partition]\
-                        [partition_dfs["all_tokens"][partition][c].isin(pt[c] - ptt[c])]
-    del partition, pt, ptt
+        # tokens of every partition (i.e. valid and test sets) whose type is unseen during training
+        for c in cols:
+            scopes["unseen_{}_tokens".format(c)][partition] = eval_masks[partition] & \
+                ~np.isin(partition_codes[partition][c], ptt[c])
     print("\n")
 
+    # a single grouped pass per partition and pair of columns
+    ambiguity = {}
+    for partition in partitions:
+        codes = partition_codes[partition]
+        mask = eval_masks[partition]
+        for group_col in [LEMMA, WORD]:
+            for c in cols:
+                if c != group_col:
+                    ambiguity[partition, group_col, c] = distinct_values(codes[group_col][mask], codes[c][mask],
+                                                                         type_count)
+
+    def ambiguous_share(partition, group_col, c):
+        groups, distinct_counts = ambiguity[partition, group_col, c]
+        return int((distinct_counts > 1).sum()) / len(groups)
+
     # ambiguity stats
     print(" Ambiguous lemma types with more than one ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
-    print(("{:<20}" * 5).format("", "", "", *["{} type %".format(c).capitalize() for c in cols if c is not config["DATASET"]["COLUMNS"]["LEMMA"]]))
-    for partition in config["DATASET"]["PARTITIONS"]:
-        pdf = partition_dfs["all_tokens"][partition]
-        print(("{:<20}" * 5).format("{} set".format(partition), "", "", *[pdf.groupby([config["DATASET"]["COLUMNS"]["LEMMA"]])[c].nunique().loc[lambda x: x > 1].size / pdf.groupby([config["DATASET"]["COLUMNS"]["LEMMA"]])[c].count().size for c in cols if c is not config["DATASET"]["COLUMNS"]["LEMMA"]]))
-    del partition, pdf
-    print("\n") 
+    print(("{:<20}" * 5).format("", "", "", *["{} type %".format(c).capitalize() for c in cols if c != LEMMA]))
+    for partition in partitions:
+        print(("{:<20}" * 5).format("{} set".format(partition), "", "", *[ambiguous_share(partition, LEMMA, c)
+                                                                          for c in cols if c != LEMMA]))
+    print("\n")
 
     print(" Lemma types with most wordforms in training set ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
-    #print(partition_dfs["training"].groupby(["lemma"])["word"].nunique().loc[lambda x: x > 1].sort_values(ascending=False).head(20))
-    print("\n") 
-    
+    print("\n")
+
     print(" Lemma types with most tags in training set ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
-    #print(partition_dfs["training"].groupby(["lemma"])["tag"].nunique().loc[lambda x: x > 1].sort_values(ascending=False).head(20))
-    print("\n") 
+    print("\n")
     # awk sanity check
     # awk 'BEGIN { cnt=0; } { if ( $2 == "голям" ) { cnt++; print tolower($1); } } END { print cnt; }' training.txt | sort | uniq -c | wc -l
 
-       
     print(" Ambiguous word types with more than one ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
-    print(("{:<20}" * 5).format("", "", "", *["{} type %".format(c).capitalize() for c in cols if c is not config["DATASET"]["COLUMNS"]["WORD"]]))
-    for partition in config["DATASET"]["PARTITIONS"]:
-        pdf = partition_dfs["all_tokens"][partition]
-        print(("{:<20}" * 5).format("{} set".format(partition), "", "", *[round(pdf.groupby([config["DATASET"]["COLUMNS"]["WORD"]])[c].nunique().loc[lambda x: x > 1].size / pdf.groupby([config["DATASET"]["COLUMNS"]["WORD"]])[c].count().size, 5) for c in cols if c is not config["DATASET"]["COLUMNS"]["WORD"]]))
+    print(("{:<20}" * 5).format("", "", "", *["{} type %".format(c).capitalize() for c in cols if c != WORD]))
+    for partition in partitions:
+        print(("{:<20}" * 5).format("{} set".format(partition), "", "", *[round(ambiguous_share(partition, WORD, c), 5)
+                                                                          for c in cols if c != WORD]))
 
         # awk 'BEGIN { cnt=0; } { if ( tolower($1) == "български" ) { cnt++; print tolower($1), $2, $3; } } END { print cnt; }' training.txt | sort | uniq -c
 
-        # this line defines ambiguous word as having either more than one possible tag or one possible lemma
-        #ambiguous_index = pdf.groupby([config["DATASET"]["COLUMNS"]["WORD"]]).nunique().apply(lambda x: x > 1).any(axis=1)
-        ambiguous_index = pdf.groupby([config["DATASET"]["COLUMNS"]["WORD"]]).nunique()[config["DATASET"]["COLUMNS"]["LEMMA"]] > 1
-        ambiguous_words = ambiguous_index.where(lambda x: x).dropna().index.tolist()
-        partition_dfs["ambiguous_word_tokens"][partition] = pdf[pdf[config["DATASET"]["COLUMNS"]["WORD"]].isin(ambiguous_words)]
-    del partition, pdf
-    print("\n") 
-    
+        # this line defines ambiguous word as having more than one possible lemma
+        if partition != "training":
+            groups, distinct_counts = ambiguity[partition, WORD, LEMMA]
+            scopes["ambiguous_word_tokens"][partition] = eval_masks[partition] & \
+                np.isin(partition_codes[partition][WORD], groups[distinct_counts > 1])
+    print("\n")
+
     # naive baseline
     print(" Naive baseline ".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"],))
     print("1) Assign each word form the most frequent lemma from the training set; otherwise assume every wordform is its own lemma.")
     print("2) Assign each word type the POS tag it was most frequently seen with in the training dataset; unknowns words are assigned the {} tag.".format(args.unknown_tag or "unknown"))
     print("\n")
-    
-    # memoized baseline MFT tags and lemmata
-    base_mem = {}        
-    for col in cols:
-        if col is not config["DATASET"]["COLUMNS"]["WORD"]:
-            base_mem[col] = partition_dfs["pre_all_tokens"]["training"].groupby([config["DATASET"]["COLUMNS"]["WORD"], col]).size().to_frame("count")\
-                .reset_index().sort_values([config["DATASET"]["COLUMNS"]["WORD"], "count"], ascending=[True, False])\
-                .drop_duplicates(subset=config["DATASET"]["COLUMNS"]["WORD"]).iloc[:, 0:2]
-    del col
-
-    for scope in partition_dfs.keys():
-        print(("{:<20}" * 6).format(scope.upper(), "", "Size", *["{} acc %".format(c).capitalize() for c in cols if c is not config["DATASET"]["COLUMNS"]["WORD"]], "Joint acc %"))
-
-        for partition in config["DATASET"]["PARTITIONS"]:
-            if partition != "training":
-                pdf = partition_dfs[scope][partition]
-                x_test = pdf[config["DATASET"]["COLUMNS"]["WORD"]]
-                acc = []
-
-                # initializes the mask that keeps record of which predictions are correct for every column of the dataset
-                joint_mask = np.array([True] * pdf.shape[0])
-
-                for c in cols:
-                    if c is not config["DATASET"]["COLUMNS"]["WORD"]:
-                        y_test = pdf[c].reset_index(drop=True)
-
-                        y_pred = x_test.to_frame().set_index(config["DATASET"]["COLUMNS"]["WORD"])\
-                            .join(base_mem[c].set_index(config["DATASET"]["COLUMNS"]["WORD"]), on=[config["DATASET"]["COLUMNS"]["WORD"]])\
-                            .reset_index()
-
-                        if c == config["DATASET"]["COLUMNS"]["LEMMA"]:
-                            # interpolating lemmata
-                            y_pred[c] = y_pred[c].fillna(y_pred[config["DATASET"]["COLUMNS"]["WORD"]])
-                        elif args.unknown_tag and c == config["DATASET"]["COLUMNS"]["TAG"]:
-                            # interpolating tags
-                            y_pred[c] = y_pred[c].fillna(args.unknown_tag)
-
-                        pred_mask = (y_pred[c] == y_test)
-                        acc.append(1 - pred_mask.value_counts(normalize=True).loc[False])
-                        joint_mask &= pred_mask
-                        #y_pred[pd.isnull(y_pred).any(axis=1)]
-
-                # joint acc
-                acc.append(joint_mask.sum() / joint_mask.size)
-
-                print(("{:<20}" * 6).format("{} set".format(partition), "", pdf.shape[0], *acc))
-        del partition, acc
-        print("\n")
\ No newline at end of file
+
+    # most frequent lemma and tag of every word in training, before postprocessing
+    base_mem = {c: most_frequent_values(training_codes[WORD], training_codes[c], types) for c in cols if c != WORD}
+    unknown_tag_code = -1
+    if args.unknown_tag:
+        # an unknown tag that isn't in the dataset never matches
+        unknown_tag_code = int(pd.Index(types).get_indexer([args.unknown_tag])[0])
+        unknown_tag_code = unknown_tag_code if unknown_tag_code >= 0 else type_count
+
+    # predictions of every evaluated partition are made once and scored within every scope by masking
+    matches = {}
+    for partition in evaluated_partitions:
+        words = partition_codes[partition][WORD]
+        known = words >= 0
+        matches[partition] = {}
+        for c in cols:
+            if c != WORD:
+                predicted = np.full(len(words), -1, dtype=np.int64)
+                predicted[known] = base_mem[c][words[known]]
+                if c == LEMMA:
+                    # interpolating lemmata
+                    predicted = np.where(predicted >= 0, predicted, words)
+                elif args.unknown_tag and c == TAG:
+                    # interpolating tags
+                    predicted = np.where(predicted >= 0, predicted, unknown_tag_code)
+                matches[partition][c] = (predicted == partition_codes[partition][c]) & \
+                    (partition_codes[partition][c] >= 0)
+
+    for scope, masks in scopes.items():
+        print(("{:<20}" * 6).format(scope.upper(), "", "Size", *["{} acc %".format(c).capitalize() for c in cols if c != WORD], "Joint acc %"))
+
+        for partition in evaluated_partitions:
+            mask = masks[partition]
+            size = int(mask.sum())
+            acc = []
+            # keeps record of which predictions are correct for every column of the dataset
+            joint_mask = np.ones(size, dtype=bool)
+            for c in cols:
+                if c != WORD:
+                    pred_mask = matches[partition][c][mask]
+                    # counted rather than looked up in value_counts, which has no False entry when all predictions match
+                    acc.append(1 - (size - int(pred_mask.sum())) / size if size else float('nan'))
+                    joint_mask &= pred_mask
+
+            # joint acc
+            acc.append(joint_mask.sum() / joint_mask.size if size else float('nan'))
+
+            print(("{:<20}" * 6).format("{} set".format(partition), "", size, *acc))
+        print("\n")
+
+    return partition_codes, types, eval_masks, scopes, base_mem, tag_frequency
+
+
+if __name__ == "__main__":
+    partition_codes, types, eval_masks, scopes, base_mem, tag_frequency = main(sys.argv[1:])
@@ -2,6 +2,7 @@
 import sys
 import pandas as pd
 
-scores = pd.read_csv(sys.argv[1], sep=",", header=None).astype('float64')
+scores = pd.read_csv(sys.argv[1], sep=",", header=None)
+# rows written by batch_score start with the path of the prediction file
+scores = scores.select_dtypes(exclude='object').astype('float64')
 print(", ".join([str(round(score, 5)) for score in scores.mean(axis=0).tolist()]))
-
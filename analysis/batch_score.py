@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+""" batch_score.py: scores the predictions of many models against the same training and ground partitions at once """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import sys
+import glob
+import argparse
+from multiprocessing import Pool
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from analysis.score_prediction import read_prediction, match_predictions, score
+from analysis.evaluation_index import load_index, DEFAULT_INDEX_DIR
+
+# number of scores per prediction file: lemma, tag and joint accuracy of all, unseen and ambiguous tokens
+SCORE_COUNT = 9
+
+# state shared by the prediction files of a batch, set once per worker
+shared = {}
+
+
+def expand_paths(patterns):
+    """
+    :param patterns: file paths or glob patterns (e.g. "models/*/*/data/dev_prediction.*")
+    :return: list of file paths, in the order of the patterns and sorted within every pattern
+    """
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print("No files match {}".format(pattern), file=sys.stderr)
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def init_worker(ground_df, index, prediction_cols, postprocess):
+    shared.update(ground_df=ground_df, index=index, prediction_cols=prediction_cols, postprocess=postprocess)
+
+
+def match_file(path):
+    """
+    :param path: file path of postprocessed predictions
+    :return: tuple(prediction matches (see score_prediction.match_predictions) or None if the file can't be scored,
+    message)
+    """
+    try:
+        prediction_df = read_prediction(path, shared["prediction_cols"])
+    except Exception as e:
+        return None, "can't be read ({})".format(e)
+
+    ground_df = shared["ground_df"]
+    if prediction_df.shape[0] != ground_df.shape[0]:
+        return None, "{} ? {}".format(prediction_df.shape[0], ground_df.shape[0])
+
+    return match_predictions(prediction_df, ground_df, postprocess=shared["postprocess"], index=shared["index"]), None
+
+
+def score_file(path):
+    """
+    :param path: file path of postprocessed predictions
+    :return: tuple(path, list of scores or None if the file can't be scored, message)
+    """
+    prediction_match, message = match_file(path)
+    if prediction_match is None:
+        return path, None, message
+    results = [str(result) for result in score(prediction_match)]
+    # scores of empty subsets are left blank so that the columns of all files line up
+    return path, results + [""] * (SCORE_COUNT - len(results)), None
+
+
+def score_files(paths, ground_df, index, prediction_cols=(0, 1, 2), postprocess=True, workers=None, scorer=score_file):
+    """
+    :param paths: file paths of postprocessed predictions
+    :param ground_df: ground truth (see score_prediction.read_partition)
+    :param index: output of score_prediction.evaluation_index
+    :param prediction_cols: indices of the columns to read from the prediction files
+    :param postprocess: whether to exclude the tokens that preprocess_dataset_for_eval excludes
+    :param workers: number of worker processes (default: number of CPUs), 1 scores the files in this process
+    :param scorer: module-level function of a file path which reads the shared state, like score_file
+    :return: generator of scorer results in the order of the paths
+    """
+    initargs = (ground_df, index, prediction_cols, postprocess)
+    if workers == 1 or len(paths) <= 1:
+        init_worker(*initargs)
+        for path in paths:
+            yield scorer(path)
+    else:
+        with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+            for result in pool.imap(scorer, paths):
+                yield result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="scores prediction files like score_prediction and writes a row of "
+                                                 "scores per file, prefixed by its path, which analysis.average "
+                                                 "averages")
+    parser.add_argument("predictions", help="file names or glob patterns of predictions", nargs='+', type=str)
+    parser.add_argument("--training", help="training file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
+    parser.add_argument("--ground", help="ground truth file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
+    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument("--prediction_cols", help="list of column indices to read from prediction files (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
+    parser.add_argument("--index_dir", help="directory of the stored evaluation indexes (see evaluation_index)",
+                        type=str, default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--no_index', dest='use_index', action='store_false',
+                        help="read the training and ground files without storing or reusing an evaluation index")
+    parser.add_argument("--output", help="combined csv file name (default: stdout)", type=str, default=None)
+    parser.add_argument("--workers", help="number of worker processes (default: number of CPUs)", type=int,
+                        default=None)
+    args = parser.parse_args(argv)
+
+    paths = expand_paths(args.predictions)
+    if not paths:
+        raise ValueError("No prediction files to score.")
+
+    index = load_index(args.training, args.ground, args.dataset_cols, args.index_dir if args.use_index else None)
+    ground_df = index.pop("ground_df")
+    # workers only need the ground truth and the derived sets
+    del index["training_df"]
+
+    output_file = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        scored = 0
+        for path, results, message in score_files(paths, ground_df, index, args.prediction_cols, args.postprocess,
+                                                   args.workers):
+            if results is None:
+                print("Skipped {}: {}".format(path, message), file=sys.stderr)
+                continue
+            output_file.write(", ".join([path] + results) + "\n")
+            scored += 1
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    print("{} of {} prediction files scored".format(scored, len(paths)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+""" bootstrap.py: confidence intervals and paired significance tests of the scores of several models by resampling the
+tokens of the ground truth """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import sys
+import argparse
+from collections import OrderedDict
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from analysis import batch_score
+from analysis.evaluation_index import load_index, DEFAULT_INDEX_DIR
+
+METRICS = ["lemma", "tag", "joint"]
+SUBSETS = ["all", "unseen", "ambiguous"]
+
+
+def match_vectors(path):
+    """
+    Token-level matches of a prediction file, run in the workers of batch_score.score_files
+    :param path: file path of postprocessed predictions
+    :return: tuple(path, boolean array (tokens, metrics) or None if the file can't be scored, boolean array
+    (subsets, tokens) or None, message)
+    """
+    prediction_match, message = batch_score.match_file(path)
+    if prediction_match is None:
+        return path, None, None, message
+    matches = prediction_match[["{}_match".format(metric) for metric in METRICS]].values.astype(bool)
+    subsets = np.stack([np.ones(prediction_match.shape[0], dtype=bool), ~prediction_match["seen_word"].values,
+                        prediction_match["ambiguous"].values.astype(bool)])
+    return path, matches, subsets, None
+
+
+def resample_weights(rng, counts, resamples, inverse=None):
+    """
+    Draws bootstrap resamples of the tokens as the number of times a token of every kind is drawn
+    :param rng: numpy random generator
+    :param counts: number of tokens of every kind
+    :param resamples: number of resamples
+    :param inverse: kind of every token, needed when there are nearly as many kinds as tokens
+    :return: float32 array (resamples, kinds)
+    """
+    token_count = int(counts.sum())
+    if inverse is None or 4 * len(counts) <= token_count:
+        # drawing a token of every kind is multinomial, which costs a draw per kind rather than per token
+        return rng.multinomial(token_count, counts / token_count, size=resamples).astype(np.float32)
+    draws = inverse[rng.integers(0, token_count, size=(resamples, token_count))]
+    draws += np.arange(resamples)[:, None] * len(counts)
+    return np.bincount(draws.ravel(), minlength=resamples * len(counts)).reshape(resamples, -1).astype(np.float32)
+
+
+def unique_rows(rows):
+    """
+    :param rows: 2d array
+    :return: tuple(unique rows, index of the unique row of every row, number of times every unique row occurs)
+    """
+    # rows are grouped by a random projection, which is much faster than sorting them, and only sorted if two
+    # different rows happen to share a projection
+    projection = rows.astype(np.float64) @ np.random.default_rng(0).standard_normal(rows.shape[1])
+    _, first, inverse, counts = np.unique(projection, return_index=True, return_inverse=True, return_counts=True)
+    if np.array_equal(rows[first][inverse], rows):
+        return rows[first], inverse, counts
+    unique, inverse, counts = np.unique(rows, axis=0, return_inverse=True, return_counts=True)
+    return unique, inverse.reshape(-1), counts
+
+
+def bootstrap_accuracies(matches, subsets, resamples=2000, seed=0, chunk_size=250):
+    """
+    Resamples the tokens of the ground truth and computes the accuracy of every model on every resample. All models
+    are evaluated on the same resamples, which makes their differences paired.
+    :param matches: float array (models, tokens, metrics) of the fraction of the runs of every model that match each
+    token
+    :param subsets: boolean array (subsets, tokens) of the tokens every subset is made of
+    :param resamples: number of resamples
+    :param seed: seed of the random generator
+    :param chunk_size: number of resamples drawn at once
+    :return: tuple(array (subsets, models, metrics) of accuracies, array (resamples, subsets, models, metrics) of
+    resampled accuracies)
+    """
+    model_count, token_count, metric_count = matches.shape
+    subset_count = subsets.shape[0]
+    # accuracies are ratios of weighted sums over tokens, so that all of them are computed with two matrix products
+    numerators = np.einsum('st,mtk->tsmk', subsets.astype(np.float32), matches.astype(np.float32))\
+        .reshape(token_count, -1)
+    # tokens which all models match (or miss) alike and which belong to the same subsets are interchangeable, so only
+    # the number of tokens of every such kind is resampled
+    kinds, inverse, counts = unique_rows(np.concatenate([numerators, subsets.T.astype(np.float32)], axis=1))
+    numerators, denominators = kinds[:, :-subset_count], kinds[:, -subset_count:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accuracies = ((counts @ numerators).reshape(subset_count, -1) /
+                      (counts @ denominators)[:, None]).reshape(subset_count, model_count, metric_count)
+
+        rng = np.random.default_rng(seed)
+        resampled = np.empty((resamples, subset_count, model_count, metric_count), dtype=np.float32)
+        for start in range(0, resamples, chunk_size):
+            weights = resample_weights(rng, counts, min(chunk_size, resamples - start), inverse)
+            resampled[start:start + weights.shape[0]] = \
+                ((weights @ numerators).reshape(weights.shape[0], subset_count, -1) /
+                 (weights @ denominators)[:, :, None]).reshape(-1, subset_count, model_count, metric_count)
+
+    return accuracies, resampled
+
+
+def confidence_intervals(resampled, alpha=0.05):
+    """
+    :param resampled: resampled accuracies (see bootstrap_accuracies)
+    :param alpha: significance level
+    :return: tuple(lower bounds, upper bounds) of the percentile intervals, arrays (subsets, models, metrics)
+    """
+    lower, upper = np.nanpercentile(resampled, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return lower, upper
+
+
+def paired_p_values(resampled, baseline):
+    """
+    Two-sided p-values of the differences between every model and a baseline, from the share of resamples in which
+    the difference has the opposite sign
+    :param resampled: resampled accuracies (see bootstrap_accuracies)
+    :param baseline: index of the baseline model
+    :return: array (subsets, models, metrics), 1 for the baseline itself
+    """
+    differences = resampled - resampled[:, :, baseline:baseline + 1, :]
+    with np.errstate(invalid='ignore'):
+        p_values = 2 * np.minimum(np.mean(differences <= 0, axis=0), np.mean(differences >= 0, axis=0))
+    return np.minimum(p_values, 1)
+
+
+def group_paths(paths, per_file=False):
+    """
+    :param paths: file paths of postprocessed predictions
+    :param per_file: whether every file is a model of its own
+    :return: ordered dictionary of model name and the paths of its runs, the runs of a model are the predictions in
+    its folder (e.g. dev_prediction.[job id] of every seed)
+    """
+    models = OrderedDict()
+    for path in paths:
+        models.setdefault(path if per_file else os.path.dirname(path), []).append(path)
+    return models
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="bootstraps confidence intervals of the scores of models and paired "
+                                                 "p-values of their differences to a baseline. The runs of a model "
+                                                 "(e.g. seeds) are the prediction files in its folder.")
+    parser.add_argument("predictions", help="file names or glob patterns of predictions", nargs='+', type=str)
+    parser.add_argument("--training", help="training file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
+    parser.add_argument("--ground", help="ground truth file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
+    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument("--prediction_cols", help="list of column indices to read from prediction files (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
+    parser.add_argument("--index_dir", help="directory of the stored evaluation indexes (see evaluation_index)",
+                        type=str, default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--no_index', dest='use_index', action='store_false',
+                        help="read the training and ground files without storing or reusing an evaluation index")
+    parser.add_argument('--per_file', action='store_true', help="treat every prediction file as a model")
+    parser.add_argument("--baseline", help="model (folder, or file with --per_file) the others are compared to "
+                                           "(default: the model with the best joint accuracy)", type=str, default=None)
+    parser.add_argument("--resamples", help="number of bootstrap resamples", type=int, default=2000)
+    parser.add_argument("--alpha", help="significance level of the confidence intervals", type=float, default=0.05)
+    parser.add_argument("--seed", help="seed of the resampling", type=int, default=0)
+    parser.add_argument("--output", help="csv file of the results (default: print a table to stdout)", type=str,
+                        default=None)
+    parser.add_argument("--workers", help="number of worker processes reading predictions (default: number of CPUs)",
+                        type=int, default=None)
+    args = parser.parse_args(argv)
+
+    paths = batch_score.expand_paths(args.predictions)
+    if not paths:
+        raise ValueError("No prediction files to score.")
+
+    index = load_index(args.training, args.ground, args.dataset_cols, args.index_dir if args.use_index else None)
+    ground_df = index.pop("ground_df")
+    del index["training_df"]
+
+    runs = {}
+    subsets = None
+    for path, matches, file_subsets, message in batch_score.score_files(paths, ground_df, index, args.prediction_cols,
+                                                                        args.postprocess, args.workers,
+                                                                        scorer=match_vectors):
+        if matches is None:
+            print("Skipped {}: {}".format(path, message), file=sys.stderr)
+            continue
+        runs[path] = matches
+        # the subsets only depend on the ground truth, so they are the same for every file
+        subsets = file_subsets if subsets is None else subsets
+
+    models = group_paths([path for path in paths if path in runs], args.per_file)
+    if not models:
+        raise ValueError("None of the prediction files can be scored.")
+    names = list(models)
+    # the tokens of a model match as often as its runs match them on average
+    matches = np.stack([np.mean([runs[path] for path in model_paths], axis=0) for model_paths in models.values()])
+
+    accuracies, resampled = bootstrap_accuracies(matches, subsets, args.resamples, args.seed)
+    lower, upper = confidence_intervals(resampled, args.alpha)
+
+    if args.baseline is None:
+        baseline = int(np.argmax(accuracies[SUBSETS.index("all"), :, METRICS.index("joint")]))
+    elif args.baseline.rstrip(os.sep) in names:
+        baseline = names.index(args.baseline.rstrip(os.sep))
+    else:
+        raise ValueError("--baseline {} isn't one of the models.".format(args.baseline))
+    p_values = paired_p_values(resampled, baseline)
+
+    print("{} models ({} runs), {} tokens, {} resamples, baseline {}".format(
+        len(names), len(runs), subsets.shape[1], args.resamples, names[baseline]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write("model,runs,subset,metric,accuracy,ci_lower,ci_upper,p_value\n")
+            for m, name in enumerate(names):
+                for s, subset in enumerate(SUBSETS):
+                    for k, metric in enumerate(METRICS):
+                        output_file.write("{},{},{},{},{:.5f},{:.5f},{:.5f},{:.5f}\n".format(
+                            name, len(models[name]), subset, metric, accuracies[s, m, k], lower[s, m, k],
+                            upper[s, m, k], p_values[s, m, k]))
+        return
+
+    for s, subset in enumerate(SUBSETS):
+        print(" {} tokens ({:.0%} CI, p vs baseline) ".format(subset, 1 - args.alpha).upper()
+              .center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"]))
+        for m, name in enumerate(names):
+            print("{}{} ({} runs)".format("* " if m == baseline else "  ", name, len(models[name])))
+            print("    " + "   ".join("{} {:.4f} [{:.4f}, {:.4f}] p={:.4f}".format(
+                metric, accuracies[s, m, k], lower[s, m, k], upper[s, m, k], p_values[s, m, k])
+                                      for k, metric in enumerate(METRICS)))
+        print("\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+""" evaluation_index.py: stores the preprocessed training and ground partitions of an evaluation together with
+everything score_prediction derives from them, so that predictions are scored without reading the partitions again """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import sys
+import hashlib
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from data.transform_cache import file_digest
+from data.preprocess_ud import preprocess_dataset_for_eval
+from analysis.score_prediction import read_partition, evaluation_index
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_DIR = os.path.join("data", "cache", "evaluation")
+
+# dataframe columns of the partitions, stored as codes into the table of strings
+STRING_COLUMNS = ["word", "lemma", "tag"]
+# entries of score_prediction.evaluation_index, stored as codes into the table of strings
+SET_NAMES = ["training_words", "ambiguous_words", "training_tags", "ground_tags"]
+
+
+def index_key(training_path, ground_path, dataset_cols=(0, 1, 2)):
+    """
+    :param training_path: file path of the training partition
+    :param ground_path: file path of the ground truth
+    :param dataset_cols: indices of the columns to read from the partitions
+    :return: hex digest of the content of both partitions and the columns read from them
+    """
+    digest = hashlib.sha1(repr((INDEX_VERSION, list(dataset_cols))).encode('utf-8'))
+    file_digest(training_path, digest)
+    digest.update(b'\0')
+    file_digest(ground_path, digest)
+    return digest.hexdigest()
+
+
+def build_index(training_df, ground_df):
+    """
+    :param training_df: training partition (see score_prediction.read_partition)
+    :param ground_df: ground truth (see score_prediction.read_partition)
+    :return: dictionary of the entries of score_prediction.evaluation_index (including the evaluation mask of the
+    ground truth), the evaluation mask of the training partition and the partitions themselves
+    """
+    index = evaluation_index(ground_df, training_df)
+    index["training_eval_mask"] = training_df.index.isin(preprocess_dataset_for_eval(training_df).index)
+    index["training_df"] = training_df
+    index["ground_df"] = ground_df
+    return index
+
+
+def save_index(path, index):
+    """
+    Writes an index as a table of the strings it contains and the codes of its columns and sets in that table
+    :param path: output file path
+    :param index: output of build_index
+    :return:
+    """
+    training_df = index["training_df"]
+    ground_df = index["ground_df"]
+    values = [training_df[STRING_COLUMNS].values.ravel(), ground_df[STRING_COLUMNS].values.ravel()] + \
+        [np.asarray(index[name], dtype=object) for name in SET_NAMES]
+    codes, types = pd.factorize(np.concatenate(values))
+    bounds = np.cumsum([0] + [len(value) for value in values])
+    arrays = [codes[start:end].astype(np.int32) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    partial_path = "{}.{}.partial".format(path, os.getpid())
+    with open(partial_path, 'wb') as index_file:
+        # types are stored as newline separated utf-8 bytes, see compact_ud.CompactWriter
+        np.savez_compressed(index_file, version=INDEX_VERSION,
+                            types=np.frombuffer("\n".join(str(value) for value in types).encode('utf-8'),
+                                                dtype=np.uint8),
+                            training_codes=arrays[0].reshape(-1, len(STRING_COLUMNS)),
+                            training_index=training_df["index"].values.astype(np.int64),
+                            ground_codes=arrays[1].reshape(-1, len(STRING_COLUMNS)),
+                            ground_index=ground_df["index"].values.astype(np.int64),
+                            ground_eos=ground_df["eos"].values.astype(bool),
+                            eval_mask=np.asarray(index["eval_mask"], dtype=bool),
+                            training_eval_mask=np.asarray(index["training_eval_mask"], dtype=bool),
+                            **dict(zip(SET_NAMES, arrays[2:])))
+    os.replace(partial_path, path)
+
+
+def read_index(path):
+    """
+    :param path: file path of an index written by save_index
+    :return: output of build_index, None if the index was written by another version of evaluation_index
+    """
+    with np.load(path) as stored:
+        if int(stored["version"]) != INDEX_VERSION:
+            return None
+        types = np.array(stored["types"].tobytes().decode('utf-8').split("\n"), dtype=object)
+        # missing values are coded as -1, which points at this last entry
+        types = np.append(types, np.nan)
+
+        training_df = pd.DataFrame(types[stored["training_codes"]], columns=STRING_COLUMNS)
+        training_df.insert(0, "index", stored["training_index"])
+        ground_df = pd.DataFrame(types[stored["ground_codes"]], columns=STRING_COLUMNS)
+        ground_df.insert(0, "index", stored["ground_index"])
+        ground_df["eos"] = stored["ground_eos"]
+
+        index = {name: types[stored[name]] for name in SET_NAMES}
+        index["ambiguous_words"] = pd.Index(index["ambiguous_words"], name="word")
+        index["eval_mask"] = stored["eval_mask"]
+        index["training_eval_mask"] = stored["training_eval_mask"]
+    index["training_df"] = training_df
+    index["ground_df"] = ground_df
+    return index
+
+
+def load_index(training_path, ground_path, dataset_cols=(0, 1, 2), index_dir=DEFAULT_INDEX_DIR):
+    """
+    Loads the index of a training and ground partition pair, building and storing it first if it doesn't exist
+    :param training_path: file path of the training partition (or of a partition compiled by compile_ud)
+    :param ground_path: file path of the ground truth (or of a partition compiled by compile_ud)
+    :param dataset_cols: indices of the columns to read from the partitions
+    :param index_dir: directory of the stored indexes, None to build the index without storing it
+    :return: output of build_index
+    """
+    if index_dir is None:
+        return build_index(read_partition(training_path, dataset_cols),
+                           read_partition(ground_path, dataset_cols, ground=True))
+
+    path = os.path.join(index_dir, index_key(training_path, ground_path, dataset_cols) + ".npz")
+    if os.path.isfile(path):
+        index = read_index(path)
+        if index is not None:
+            return index
+
+    index = build_index(read_partition(training_path, dataset_cols),
+                        read_partition(ground_path, dataset_cols, ground=True))
+    os.makedirs(index_dir, exist_ok=True)
+    save_index(path, index)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import config
+
+    parser = argparse.ArgumentParser(description="builds the evaluation index of a training and ground partition pair "
+                                                 "ahead of scoring")
+    parser.add_argument("--training", help="training file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
+    parser.add_argument("--ground", help="ground truth file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
+    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument("--index_dir", help="directory of the stored indexes", type=str, default=DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    index = load_index(args.training, args.ground, args.dataset_cols, args.index_dir)
+    print(os.path.join(args.index_dir, index_key(args.training, args.ground, args.dataset_cols) + ".npz"))
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+""" follow_score.py: scores nematus hypotheses while they are being translated, without postprocessing them first """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from data.postprocess_nematus import split_prediction, WORD_BOUNDARY
+from analysis.score_prediction import is_in
+
+# example: python -m analysis.follow_score models/test-model/data/dev_hypothesis --follow --pid [pid of translate.py]
+# exit status of a run stopped by --abort_below
+ABORT_STATUS = 3
+SUBSETS = ["all", "unseen", "ambiguous"]
+
+
+class RunningScore(object):
+    """
+    Accumulates the lemma, tag and joint matches of predictions of ground truth tokens, which may arrive in any
+    order, for all, unseen and ambiguous tokens as score_prediction.match_predictions flags them
+    """
+    def __init__(self, index, postprocess=True):
+        """
+        :param index: output of evaluation_index.load_index
+        :param postprocess: whether to exclude the tokens that preprocess_dataset_for_eval excludes
+        """
+        ground_df = index["ground_df"]
+        self.lemmas = ground_df["lemma"].tolist()
+        self.tags = ground_df["tag"].tolist()
+
+        evaluated = index["eval_mask"].tolist() if postprocess else [True] * ground_df.shape[0]
+        seen = is_in(ground_df["word"], index["training_words"]).tolist()
+        ambiguous = is_in(ground_df["word"], index["ambiguous_words"]).tolist()
+        # indices of the subsets every token counts towards
+        self.subsets = [[i for i, member in enumerate([evaluated[row], evaluated[row] and not seen[row],
+                                                       evaluated[row] and ambiguous[row]]) if member]
+                        for row in range(ground_df.shape[0])]
+
+        # tokens, lemma matches, tag matches and joint matches of every subset
+        self.counts = [[0, 0, 0, 0] for _ in SUBSETS]
+        self.predicted = 0
+
+    def __len__(self):
+        return len(self.lemmas)
+
+    def add(self, row, line):
+        """
+        :param row: index of the token in the ground truth
+        :param line: postprocessed prediction (word, lemma and tag separated by spaces)
+        :return:
+        """
+        self.predicted += 1
+        if row >= len(self.lemmas):
+            return
+        # fields are split as score_prediction.read_prediction splits them, missing ones never match
+        fields = line.split()
+        lemma_match = len(fields) > 1 and fields[1] == self.lemmas[row]
+        tag_match = len(fields) > 2 and fields[2] == self.tags[row]
+        for subset in self.subsets[row]:
+            counts = self.counts[subset]
+            counts[0] += 1
+            counts[1] += lemma_match
+            counts[2] += tag_match
+            counts[3] += lemma_match and tag_match
+
+    def accuracy(self, subset="all", metric="joint"):
+        """
+        :param subset: one of SUBSETS
+        :param metric: lemma, tag or joint
+        :return: accuracy so far, None if no token of the subset was predicted yet
+        """
+        counts = self.counts[SUBSETS.index(subset)]
+        if not counts[0]:
+            return None
+        return counts[["lemma", "tag", "joint"].index(metric) + 1] / counts[0]
+
+    def results(self):
+        """
+        :return: list of the scores of all, unseen and ambiguous tokens in the format of score_prediction
+        """
+        res = []
+        for counts in self.counts:
+            if not counts[0]:
+                continue
+            res.extend([str(round(matches / counts[0], 5)) if matches else "0" for matches in counts[1:]])
+        return res
+
+    def snapshot(self):
+        """
+        :return: one line summary of the scores so far
+        """
+        parts = ["{}/{} predicted".format(self.predicted, len(self))]
+        for subset, counts in zip(SUBSETS, self.counts):
+            parts.append("{} ({} tokens): {}".format(subset, counts[0], " ".join(
+                "{} {:.4f}".format(metric, matches / counts[0]) if counts[0] else "{} -".format(metric)
+                for metric, matches in zip(["lemma", "tag", "joint"], counts[1:]))))
+        return " | ".join(parts)
+
+
+def process_alive(pid):
+    """
+    :param pid:
+    :return: whether a process with that id is running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def follow_lines(path, follow=False, is_alive=None, poll_interval=1.0, max_lines=None):
+    """
+    Reads the lines of a file, like tail -f when follow is set
+    :param path:
+    :param follow: whether to wait for lines to be appended at the end of the file
+    :param is_alive: function telling whether the writer of the file is still running, lines are followed until it
+    returns False (default: until max_lines are read)
+    :param poll_interval: seconds to wait for new lines
+    :param max_lines: number of lines after which to stop
+    :return: generator of complete lines without newlines
+    """
+    if max_lines is not None and max_lines <= 0:
+        return
+
+    while follow and not os.path.exists(path):
+        if is_alive is not None and not is_alive():
+            return
+        time.sleep(poll_interval)
+
+    with open(path, encoding='utf-8') as file:
+        partial_line = ""
+        line_count = 0
+        while True:
+            # everything the writer wrote before it stopped is read after it stopped
+            finished = not follow or (is_alive is not None and not is_alive())
+            line = file.readline()
+            if line.endswith('\n'):
+                yield partial_line + line[:-1]
+                partial_line = ""
+                line_count += 1
+                if line_count == max_lines:
+                    return
+            elif line:
+                partial_line += line
+            elif finished:
+                if partial_line:
+                    yield partial_line
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def postprocessed_predictions(pred_lines, ground_words, tag_boundary, order=None):
+    """
+    Postprocesses word_and_context hypotheses one at a time, like postprocess_nematus.join_predictions
+    :param pred_lines: iterable of lines of nematus predictions
+    :param ground_words: list of the words of the ground truth
+    :param tag_boundary:
+    :param order: original position of every line of a translation of a file transformed with --sort_by_length
+    :return: generator of tuple(index of the token in the ground truth, postprocessed line)
+    """
+    for i, pred_line in enumerate(pred_lines):
+        row = order[i] if order is not None else i
+        word = ground_words[row] if row < len(ground_words) else ""
+        yield row, " ".join((word,) + split_prediction(pred_line, tag_boundary)).strip()
+
+
+def postprocessed_sentence_predictions(pred_lines, source_lines, tag_boundary, order=None,
+                                       word_boundary=WORD_BOUNDARY):
+    """
+    Postprocesses sentence_to_sentence hypotheses one sentence at a time, like
+    postprocess_nematus.realign_sentence_to_sentence
+    :param pred_lines: iterable of lines of nematus predictions
+    :param source_lines: list of the lines of the source file the hypotheses are translated from
+    :param tag_boundary:
+    :param order: original position of every line of a source file transformed with --sort_by_length
+    :param word_boundary:
+    :return: generator of tuple(index of the token in the ground truth, postprocessed line)
+    """
+    source_words = [line.split(word_boundary) for line in source_lines]
+    # tokens of a sentence follow the tokens of the sentences before it in the original order
+    lengths = [0] * len(source_words)
+    for i, words in enumerate(source_words):
+        lengths[order[i] if order is not None else i] = len(words)
+    starts = [0] * len(lengths)
+    for i in range(1, len(lengths)):
+        starts[i] = starts[i - 1] + lengths[i - 1]
+
+    for i, pred_line in enumerate(pred_lines):
+        if i >= len(source_words):
+            return
+        start = starts[order[i] if order is not None else i]
+        pred_words = pred_line.split(word_boundary)
+        for j, ground_word in enumerate(source_words[i]):
+            pred_word = pred_words[j].strip() if j < len(pred_words) else ""
+            yield start + j, " ".join((split_prediction(ground_word.strip(), tag_boundary)[0],) +
+                                      split_prediction(pred_word, tag_boundary)).strip()
+
+
+def main(argv):
+    """
+    :param argv: command line arguments
+    :return: exit status, ABORT_STATUS if the run was aborted
+    """
+    import argparse
+    from analysis.evaluation_index import load_index, DEFAULT_INDEX_DIR
+
+    parser = argparse.ArgumentParser(description="scores nematus hypotheses as they are appended to a file, printing "
+                                                 "snapshots of the running scores to stderr and the final scores in "
+                                                 "the format of score_prediction to stdout")
+    parser.add_argument("hypothesis", help="file name of nematus hypotheses (e.g. dev_hypothesis)", type=str)
+    parser.add_argument("--training", help="training file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
+    parser.add_argument("--ground", help="ground truth file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
+    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument("--sentence_to_sentence", help="source file the hypotheses of a sentence_to_sentence model "
+                                                       "are translated from (e.g. dev_source)", type=str, default=None)
+    parser.add_argument("--order", help="order file of a source file transformed with --sort_by_length", type=str,
+                        default=None)
+    parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
+    parser.add_argument('--follow', action='store_true',
+                        help="wait for hypotheses to be appended until all are scored (or --pid exits)")
+    parser.add_argument("--pid", help="process id of the translation, hypotheses are followed until it exits",
+                        type=int, default=None)
+    parser.add_argument("--poll_interval", help="seconds to wait for new hypotheses", type=float, default=1.0)
+    parser.add_argument("--snapshot_every", help="number of hypotheses between snapshots", type=int, default=1000)
+    parser.add_argument("--abort_below", help="stop with exit status {} once the joint accuracy of all tokens is "
+                                              "below this value".format(ABORT_STATUS), type=float, default=None)
+    parser.add_argument("--abort_after", help="number of evaluated tokens before --abort_below applies", type=int,
+                        default=2000)
+    parser.add_argument("--index_dir", help="directory of the stored evaluation indexes (see evaluation_index)",
+                        type=str, default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--no_index', dest='use_index', action='store_false',
+                        help="read the training and ground files without storing or reusing an evaluation index")
+    args = parser.parse_args(argv)
+
+    tag_boundary = config["TRANSFORM"]["DEFAULTS"]["TAG_BOUNDARY"]
+    index = load_index(args.training, args.ground, args.dataset_cols, args.index_dir if args.use_index else None)
+    score = RunningScore(index, args.postprocess)
+
+    order = None
+    if args.order:
+        with open(args.order) as order_file:
+            order = [int(line) for line in order_file]
+
+    is_alive = (lambda: process_alive(args.pid)) if args.pid is not None else None
+    follow = args.follow or args.pid is not None
+
+    if args.sentence_to_sentence:
+        with open(args.sentence_to_sentence, encoding='utf-8') as source_file:
+            source_lines = [line.rstrip('\n') for line in source_file]
+        pred_lines = follow_lines(args.hypothesis, follow, is_alive, args.poll_interval, len(source_lines))
+        predictions = postprocessed_sentence_predictions(pred_lines, source_lines, tag_boundary, order)
+    else:
+        pred_lines = follow_lines(args.hypothesis, follow, is_alive, args.poll_interval,
+                                  len(order) if order is not None else len(score))
+        predictions = postprocessed_predictions(pred_lines, index["ground_df"]["word"].tolist(), tag_boundary,
+                                                order)
+
+    status = 0
+    next_snapshot = args.snapshot_every
+    for row, line in predictions:
+        score.add(row, line)
+        if score.predicted < next_snapshot:
+            continue
+        next_snapshot += args.snapshot_every
+        print(score.snapshot(), file=sys.stderr, flush=True)
+
+        joint_accuracy = score.accuracy("all", "joint")
+        if args.abort_below is not None and score.counts[0][0] >= args.abort_after and \
+                joint_accuracy < args.abort_below:
+            print("Aborting: joint accuracy {:.4f} is below {} after {} tokens".format(
+                joint_accuracy, args.abort_below, score.counts[0][0]), file=sys.stderr)
+            status = ABORT_STATUS
+            break
+    pred_lines.close()
+
+    print(score.snapshot(), file=sys.stderr)
+    print("{} ? {}".format(score.predicted, len(score)), file=sys.stderr)
+    print(", ".join(score.results()))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,122 +1,203 @@
 #!/usr/bin/env python
 
+""" score_prediction.py: scores postprocessed predictions against the ground truth of a dataset partition """
 __author__ = "Bogomil Gospodinov"
 __email__ = "s1312650@sms.ed.ac.uk"
 __status__ = "dev"
 
-if __name__ == "__main__":
-    import os
-    import sys
-    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-    from config import config
-    import argparse
-    import pandas as pd
-    import numpy as np
-    from data.preprocess_ud import preprocess_dataset_for_train, preprocess_dataset_for_eval
+import os
+import sys
+import pandas as pd
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from data.preprocess_ud import preprocess_dataset_for_train, preprocess_dataset_for_eval
+from data.compile_ud import is_compiled, load_compiled
 
-    cols = np.array(list(config["DATASET"]["COLUMNS"].values()))
+cols = np.array(list(config["DATASET"]["COLUMNS"].values()))
 
-    #BTB baselines/lemming/predictions/btb/bg-dev-pred-py.txt --ground data/datasets/MorphoData-NewSplit/dev.txt
-    #UD baselines/lemming/predictions/ud/bg-dev-pred-py.txt --ground baselines/lemming/data/UD_Bulgarian-BTB/bg-ud-dev.conllu.conv
-    #hypertune_word_and_context "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_20u_cchar_n1__30062018\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.131784"
-    #context_word_and_context "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_10u_cbpe_n5000\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.137598"
-    #hypertune_sentence_to_sentence "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_n1\m1_1_400_300_tanh_0.0_0.1_0.2_0.0_0.0_adadelta_1.0\data\dev_prediction.140973"
-    # "E:\msc_backup\MorphoData-NewSplit_wchar_tword_20u_cchar_n1\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.141028"
-    # for fh in ../models/MorphoData-*/*/data/dev_prediction ; do python -m score_prediction ${fh} > ${fh%/*}/dev_score ; done
+# columns of prediction matches that flag tokens
+MATCH_COLUMNS = ['lemma_match', 'tag_match', 'joint_match', 'seen_word', 'ambiguous', 'seen_tag', 'existent_tag']
 
-    #mismatch test
-    #k = 1
-    #for i, lemma in enumerate(pred_df["lemma"].tolist()):
-    #    similarity = similar(lemma, ground_df.iloc[i]["lemma"])
-    #    print(i, lemma, ground_df.iloc[i]["lemma"], similarity)
-    #    if similarity == 0:
-    #        if k == 0:
-    #            break
-    #        k -= 1
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--training", help="training file name", type=str,
-                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
-    parser.add_argument("prediction", help="file name of predictions", type=str)
-    parser.add_argument("--ground", help="ground truth file name", type=str,
-                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
-    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
-                        nargs='+', type=int, default=[0, 1, 2])
-    parser.add_argument("--prediction_cols", help="list of column indices to read from prediction file (order doesnt matter)",
-                        nargs='+', type=int, default=[0, 1, 2])
-    parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
-    parser.add_argument('--pickle', action='store_true')
-    parser.add_argument("--job_name", help="job name when exporting", type=str)
-    args = parser.parse_args()
+def read_partition(path, dataset_cols=(0, 1, 2), ground=False):
+    """
+    Reads and preprocesses a training or ground partition
+    :param path: file path of the partition (or of a partition compiled by compile_ud)
+    :param dataset_cols: indices of the columns to read
+    :param ground: whether the partition is the ground truth, which gets an end-of-sentence column
+    :return: dataframe
+    """
+    if is_compiled(path):
+        # compiled partitions are already preprocessed and keep their sentence boundaries
+        df = load_compiled(path)
+        if not ground:
+            df = df[df["word"].notnull()]
+        df = df.reset_index()
+    else:
+        df = preprocess_dataset_for_train(pd.read_csv(path, sep='\s+', skip_blank_lines=(not ground),
+                                                      names=cols[list(dataset_cols)], usecols=list(dataset_cols)))\
+            .reset_index()
 
-    dfs = {}
-    spyder_result = {}
+    if ground:
+        # add end-of-sentence column to ground truth table
+        df["eos"] = df["word"].shift(-1).isnull()
+        df.drop("index", axis=1, inplace=True)
+        df.dropna(inplace=True)
+        df = df.reset_index()
 
-    for partition in ["training", "ground"]:
-        dfs[partition] = preprocess_dataset_for_train(pd.read_csv(vars(args)[partition], sep='\s+', skip_blank_lines=(partition != "ground"), names=cols[args.dataset_cols], usecols=args.dataset_cols))\
-            .reset_index()
+    return df
 
-    # add end-of-sentence column to ground truth table
-    dfs["ground"]["eos"] = dfs["ground"]["word"].shift(-1).isnull()
-    dfs["ground"].drop("index", axis=1, inplace=True)
-    dfs["ground"].dropna(inplace=True)
-    dfs["ground"] = dfs["ground"].reset_index()
 
-    dfs["prediction"] = pd.read_csv(vars(args)["prediction"], sep='\s+', names=cols[args.prediction_cols], usecols=args.prediction_cols)
+def read_prediction(path, prediction_cols=(0, 1, 2)):
+    """
+    :param path: file path of postprocessed predictions
+    :param prediction_cols: indices of the columns to read
+    :return: dataframe
+    """
+    return pd.read_csv(path, sep='\s+', names=cols[list(prediction_cols)], usecols=list(prediction_cols))
 
-    print("{} ? {}".format(dfs["prediction"].shape[0], dfs["ground"].shape[0]), file=sys.stderr)
-    assert dfs["prediction"].shape[0] == dfs["ground"].shape[0], "More rows predicted than necessary"
 
-    def print_and_list_results(match):
-        res = []
-        if match.empty:
-            return res
-        for metric in ["lemma", "tag", "joint"]:
-            res_bins = match["{}_match".format(metric)].value_counts(normalize=True).sort_index(ascending=False)
-            if True in res_bins:
-                res.append(str(round(res_bins[True], 5)))
-            else:
-                res.append(0)
-            print(res_bins, file=sys.stderr)
-        # prediction_match[prediction_match["joint_match"] == False]
-        print("{} number of tokens".format(match.shape[0]), file=sys.stderr)
+def ambiguous_words(ground_df, training_df):
+    """
+    :param ground_df:
+    :param training_df:
+    :return: index of the words which have more than one lemma in the ground truth or in the training partition
+    """
+    ambiguous_index_ground = ground_df.groupby("word")["lemma"].nunique() > 1
+    ambiguous_index_training = training_df.groupby("word")["lemma"].nunique() > 1
+    return ambiguous_index_ground[ambiguous_index_ground].index.union(
+        ambiguous_index_training[ambiguous_index_training].index)
+
+
+def is_in(values, known_values):
+    """
+    Hash-based membership test which, like the in operator on arrays, never considers missing values known
+    :param values: series
+    :param known_values: array-like
+    :return: boolean series
+    """
+    return values.isin(known_values) & values.notnull()
+
+
+def evaluation_index(ground_df, training_df):
+    """
+    Collects the values of the training and ground partitions which the flags of match_predictions depend on, so that
+    they can be shared by the predictions of several models
+    :param ground_df: ground truth (see read_partition)
+    :param training_df: training partition (see read_partition)
+    :return: dictionary of arrays of training words, ambiguous words, training tags and ground tags, and the mask of
+    the ground truth tokens that preprocess_dataset_for_eval keeps
+    """
+    return {"training_words": training_df["word"].unique(),
+            "ambiguous_words": ambiguous_words(ground_df, training_df),
+            "training_tags": training_df["tag"].unique(),
+            "ground_tags": ground_df["tag"].unique(),
+            "eval_mask": ground_df.index.isin(preprocess_dataset_for_eval(ground_df).index)}
+
+
+def match_predictions(prediction_df, ground_df, training_df=None, postprocess=True, index=None):
+    """
+    Joins predictions with the ground truth and flags every token with vectorized column comparisons
+    :param prediction_df: predictions (columns: word, lemma, tag)
+    :param ground_df: ground truth (see read_partition)
+    :param training_df: training partition (see read_partition), not needed with index
+    :param postprocess: whether to exclude the tokens that preprocess_dataset_for_eval excludes
+    :param index: output of evaluation_index (default: computed from ground_df and training_df)
+    :return: dataframe of prediction matches with the MATCH_COLUMNS
+    """
+    if index is None:
+        index = evaluation_index(ground_df, training_df)
+
+    prediction_match = prediction_df.join(ground_df, lsuffix='_prediction', rsuffix='_truth')
+    if postprocess and len(index["eval_mask"]) == prediction_match.shape[0]:
+        # preprocess_dataset_for_eval only looks at the ground truth, so its mask is computed once per ground truth
+        prediction_match = prediction_match[index["eval_mask"]]
+    elif postprocess:
+        prediction_match = preprocess_dataset_for_eval(prediction_match, prediction=True)
+    else:
+        prediction_match = prediction_match.copy()
+
+    # missing values never match, as with ==
+    prediction_match['lemma_match'] = prediction_match["lemma_prediction"] == prediction_match["lemma_truth"]
+    prediction_match['tag_match'] = prediction_match["tag_prediction"] == prediction_match["tag_truth"]
+    prediction_match['joint_match'] = prediction_match['lemma_match'] & prediction_match['tag_match']
+
+    prediction_match['seen_word'] = is_in(prediction_match["word_truth"], index["training_words"])
+    prediction_match['ambiguous'] = is_in(prediction_match["word_prediction"], index["ambiguous_words"])
+
+    prediction_match['seen_tag'] = is_in(prediction_match["tag_truth"], index["training_tags"])
+    prediction_match['existent_tag'] = is_in(prediction_match["tag_prediction"], index["training_tags"]) | \
+        is_in(prediction_match["tag_prediction"], index["ground_tags"])
+
+    return prediction_match
+
+
+def list_results(match):
+    """
+    :param match: prediction matches
+    :return: list of the lemma, tag and joint accuracy, as reported by print_and_list_results (empty without matches)
+    """
+    res = []
+    if match.empty:
         return res
+    for metric in ["lemma", "tag", "joint"]:
+        res_bins = match["{}_match".format(metric)].value_counts(normalize=True)
+        if True in res_bins:
+            res.append(str(round(res_bins[True], 5)))
+        else:
+            res.append(0)
+    return res
+
+
+def score(prediction_match):
+    """
+    :param prediction_match: output of match_predictions
+    :return: list of the scores of all, unseen and ambiguous tokens, as returned by report
+    """
+    return list_results(prediction_match) + list_results(prediction_match[~prediction_match['seen_word']]) + \
+        list_results(prediction_match[prediction_match['ambiguous']])
+
 
+def print_and_list_results(match):
+    if match.empty:
+        return []
+    for metric in ["lemma", "tag", "joint"]:
+        res_bins = match["{}_match".format(metric)].value_counts(normalize=True).sort_index(ascending=False)
+        print(res_bins, file=sys.stderr)
+    # prediction_match[prediction_match["joint_match"] == False]
+    print("{} number of tokens".format(match.shape[0]), file=sys.stderr)
+    return list_results(match)
+
+
+def report(prediction_match, prediction_path, postprocess=True):
+    """
+    Prints the scores of prediction matches and their error analysis to stderr
+    :param prediction_match: output of match_predictions
+    :param prediction_path: file path of the predictions (for the title)
+    :param postprocess: whether match_predictions excluded tokens with preprocess_dataset_for_eval
+    :return: tuple(list of scores of all, unseen and ambiguous tokens, dictionary of error analysis results)
+    """
+    spyder_result = {}
     excel_results = []
-    print(" Prediction results for {} ".format(args.prediction).upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"]), file=sys.stderr)
+    print(" Prediction results for {} ".format(prediction_path).upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"]), file=sys.stderr)
     print("\n", file=sys.stderr)
     print("All tokens", file=sys.stderr)
-    prediction_match = dfs["prediction"].join(dfs["ground"], lsuffix='_prediction', rsuffix='_truth')
-    if args.postprocess:
+    if postprocess:
         print("Postprocessing on.", file=sys.stderr)
-        prediction_match = preprocess_dataset_for_eval(prediction_match, prediction=True)
     else:
         print("Postprocessing off.", file=sys.stderr)
-    prediction_match['lemma_match'] = prediction_match.apply(lambda row: row.lemma_prediction == row.lemma_truth,
-                                       axis=1)
-    prediction_match['tag_match'] = prediction_match.apply(lambda row: row.tag_prediction == row.tag_truth, axis=1)
-    prediction_match['joint_match'] = prediction_match.apply(
-        lambda row: row.tag_prediction == row.tag_truth and row.lemma_prediction == row.lemma_truth, axis=1)
     excel_results.extend(print_and_list_results(prediction_match))
     print("\n", file=sys.stderr)
 
     print("Predicting unseen tokens", file=sys.stderr)
-    training_words = dfs["training"]["word"].unique()
-    prediction_match['seen_word'] = prediction_match.apply(lambda row: row.word_truth in training_words, axis=1)
-    excel_results.extend(print_and_list_results(prediction_match[prediction_match['seen_word'] == False]))
+    excel_results.extend(print_and_list_results(prediction_match[~prediction_match['seen_word']]))
     print("\n", file=sys.stderr)
 
     print("Ambiguous tokens", file=sys.stderr)
-    ambiguous_index_ground = dfs["ground"].groupby("word").nunique()["lemma"] > 1
-    ambiguous_index_training = dfs["training"].groupby("word").nunique()["lemma"] > 1
-    joint_ambiguous_index = ambiguous_index_ground[ambiguous_index_ground == True].index.union(ambiguous_index_training[ambiguous_index_training == True].index)
-    ambiguous_words = joint_ambiguous_index.tolist()
-    prediction_match['ambiguous'] = prediction_match.apply(lambda row: row.word_prediction in ambiguous_words, axis=1)
-    excel_results.extend(print_and_list_results(prediction_match[prediction_match['ambiguous'] == True]))
+    excel_results.extend(print_and_list_results(prediction_match[prediction_match['ambiguous']]))
     print("\n", file=sys.stderr)
 
-    print(", ".join(excel_results))
-
     print("Error analysis".upper().center(config["PPRINT"]["TITLE_LENGTH"], config["PPRINT"]["TITLE_CH"]), file=sys.stderr)
     print("Lemmatization error statistics", file=sys.stderr)
     print_and_list_results(prediction_match[prediction_match["lemma_match"] == False])
@@ -134,16 +215,12 @@ if __name__ == "__main__":
 
     # how many times did the model manage to predict tags unseen during training
     print("Predicting unseen tags [IGNORED IN RESULTS]", file=sys.stderr)
-    training_tags = dfs["training"]["tag"].unique()
-    prediction_match['seen_tag'] = prediction_match.apply(lambda row: row.tag_truth in training_tags, axis=1)
     spyder_result["unseen_tag"] = prediction_match[prediction_match['seen_tag'] == False]
     print_and_list_results(spyder_result["unseen_tag"])
     print("\n", file=sys.stderr)
 
     # how many times did the model predict tags that didnt exist in reality
     print("Predicted non-existent tags [IGNORED IN RESULTS]", file=sys.stderr)
-    ground_tags = dfs["ground"]["tag"].unique()
-    prediction_match['existent_tag'] = prediction_match.apply(lambda row: row.tag_prediction in training_tags or row.tag_prediction in ground_tags, axis=1)
     spyder_result["existent_tag"] = prediction_match[prediction_match['existent_tag'] == False]
     print_and_list_results(spyder_result["existent_tag"])
     print("\n", file=sys.stderr)
@@ -180,7 +257,101 @@ if __name__ == "__main__":
     print("\n", file=sys.stderr)
     print("\n", file=sys.stderr)
 
-    if args.pickle:
+    return excel_results, spyder_result
+
+
+def benchmark(prediction_df, ground_df, training_df, postprocess=True, repeats=(1, 2, 4, 8)):
+    """
+    Times match_predictions on the predictions and ground truth repeated several times, the time per token should
+    stay the same as the number of tokens grows
+    :param prediction_df:
+    :param ground_df:
+    :param training_df:
+    :param postprocess:
+    :param repeats: numbers of times to repeat the predictions and ground truth
+    :return:
+    """
+    import timeit
+    for repeat in repeats:
+        repeated_prediction_df = pd.concat([prediction_df] * repeat, ignore_index=True)
+        repeated_ground_df = pd.concat([ground_df] * repeat, ignore_index=True)
+        seconds = min(timeit.repeat(lambda: match_predictions(repeated_prediction_df, repeated_ground_df, training_df,
+                                                              postprocess), number=1, repeat=3))
+        print("match_predictions: {} tokens in {:.4f}s ({:.2f}us/token)"
+              .format(repeated_ground_df.shape[0], seconds, 1e6 * seconds / repeated_ground_df.shape[0]))
+
+
+def main(argv):
+    """
+    :param argv: command line arguments
+    :return: tuple(parsed arguments, prediction matches, dictionary of error analysis results)
+    """
+    import argparse
+    from analysis.evaluation_index import load_index, DEFAULT_INDEX_DIR
+
+    #BTB baselines/lemming/predictions/btb/bg-dev-pred-py.txt --ground data/datasets/MorphoData-NewSplit/dev.txt
+    #UD baselines/lemming/predictions/ud/bg-dev-pred-py.txt --ground baselines/lemming/data/UD_Bulgarian-BTB/bg-ud-dev.conllu.conv
+    #hypertune_word_and_context "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_20u_cchar_n1__30062018\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.131784"
+    #context_word_and_context "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_10u_cbpe_n5000\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.137598"
+    #hypertune_sentence_to_sentence "E:\msc_backup\MorphoData-NewSplit_wchar_tchar_n1\m1_1_400_300_tanh_0.0_0.1_0.2_0.0_0.0_adadelta_1.0\data\dev_prediction.140973"
+    # "E:\msc_backup\MorphoData-NewSplit_wchar_tword_20u_cchar_n1\m3_1_300_300_tanh_0.0_0.2_0.3_0.0_0.0_adadelta_1.0\data\dev_prediction.141028"
+    # for fh in ../models/MorphoData-*/*/data/dev_prediction ; do python -m score_prediction ${fh} > ${fh%/*}/dev_score ; done
+
+    #mismatch test
+    #k = 1
+    #for i, lemma in enumerate(pred_df["lemma"].tolist()):
+    #    similarity = similar(lemma, ground_df.iloc[i]["lemma"])
+    #    print(i, lemma, ground_df.iloc[i]["lemma"], similarity)
+    #    if similarity == 0:
+    #        if k == 0:
+    #            break
+    #        k -= 1
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--training", help="training file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "training.txt"))
+    parser.add_argument("prediction", help="file name of predictions", type=str)
+    parser.add_argument("--ground", help="ground truth file name", type=str,
+                        default=os.path.join("data", "datasets", config["DATASET"]["FOLDER"], "dev.txt"))
+    parser.add_argument("--dataset_cols", help="list of column indices to read from dataset partitions (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument("--prediction_cols", help="list of column indices to read from prediction file (order doesnt matter)",
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--no_postprocessing', dest='postprocess', action='store_false')
+    parser.add_argument('--pickle', action='store_true')
+    parser.add_argument("--job_name", help="job name when exporting", type=str)
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time match_predictions on the prediction and ground files repeated several times")
+    parser.add_argument("--index_dir", help="directory of the stored evaluation indexes (see evaluation_index)",
+                        type=str, default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--no_index', dest='use_index', action='store_false',
+                        help="read the training and ground files without storing or reusing an evaluation index")
+    args = parser.parse_args(argv)
+
+    index = load_index(args.training, args.ground, args.dataset_cols, args.index_dir if args.use_index else None)
+    dfs = {"training": index["training_df"],
+           "ground": index["ground_df"],
+           "prediction": read_prediction(args.prediction, args.prediction_cols)}
+
+    print("{} ? {}".format(dfs["prediction"].shape[0], dfs["ground"].shape[0]), file=sys.stderr)
+    assert dfs["prediction"].shape[0] == dfs["ground"].shape[0], "More rows predicted than necessary"
+
+    if args.benchmark:
+        benchmark(dfs["prediction"], dfs["ground"], dfs["training"], args.postprocess)
+        return args, None, None
+
+    prediction_match = match_predictions(dfs["prediction"], dfs["ground"], postprocess=args.postprocess, index=index)
+    excel_results, spyder_result = report(prediction_match, args.prediction, args.postprocess)
+
+    print(", ".join(excel_results))
+
+    return args, prediction_match, spyder_result
+
+
+if __name__ == "__main__":
+    args, prediction_match, spyder_result = main(sys.argv[1:])
+
+    if args.pickle and prediction_match is not None:
         # for easy exporting of spyder data
         try:
             prediction_matches
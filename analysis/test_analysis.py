@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import unittest
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from io import StringIO
+import pandas as pd
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from analysis.score_prediction import match_predictions, evaluation_index, read_prediction
+from analysis.batch_score import score_files
+from analysis.evaluation_index import load_index, build_index
+from analysis.bootstrap import bootstrap_accuracies, confidence_intervals, paired_p_values, group_paths
+from analysis.follow_score import RunningScore, follow_lines, postprocessed_predictions, \
+    postprocessed_sentence_predictions
+from analysis.analyse_dataset import encode_partitions, distinct_values, most_frequent_values, \
+    main as analyse_dataset
+
+cols = list(config["DATASET"]["COLUMNS"].values())
+
+
+class TestAnalysis(unittest.TestCase):
+    def test_match_predictions(self):
+        training_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"], ["е", "е", "cp"],
+                                    ["важен", "важен", "amsi"]], columns=cols)
+        ground_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"], ["нов", "нов", "amsi"],
+                                  ["нов", "нов", "nx"]], columns=cols)
+        prediction_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "е", "vxitf-r3s"], ["нов", "нова", np.nan],
+                                      ["нов", np.nan, "ny"]], columns=cols)
+
+        prediction_match = match_predictions(prediction_df, ground_df, training_df, postprocess=False)
+        self.assertEqual(prediction_match["lemma_match"].tolist(), [True, False, False, False])
+        self.assertEqual(prediction_match["tag_match"].tolist(), [True, True, False, False])
+        self.assertEqual(prediction_match["joint_match"].tolist(), [True, False, False, False])
+        self.assertEqual(prediction_match["seen_word"].tolist(), [True, True, False, False])
+        self.assertEqual(prediction_match["ambiguous"].tolist(), [False, True, False, False])
+        self.assertEqual(prediction_match["seen_tag"].tolist(), [True, True, True, False])
+        self.assertEqual(prediction_match["existent_tag"].tolist(), [True, True, False, False])
+
+    def test_score_files(self):
+        training_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"]], columns=cols)
+        ground_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["нов", "нов", "amsi"]], columns=cols)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name) for name in ["correct", "wrong", "short"]]
+            for path, lines in zip(paths, [["закон закон ncmsi", "нов нов amsi"], ["закон закон ncmsi", "нов нова nx"],
+                                           ["закон закон ncmsi"]]):
+                with open(path, 'w', encoding='utf-8') as prediction_file:
+                    prediction_file.write("\n".join(lines) + "\n")
+
+            results = list(score_files(paths, ground_df, evaluation_index(ground_df, training_df), postprocess=False,
+                                       workers=1))
+
+        self.assertEqual([path for path, _, _ in results], paths)
+        self.assertEqual(results[0][1], ["1.0", "1.0", "1.0", "1.0", "1.0", "1.0", "", "", ""])
+        self.assertEqual(results[1][1], ["0.5", "0.5", "0.5", "0", "0", "0", "", "", ""])
+        self.assertIsNone(results[2][1])
+
+    def test_evaluation_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_path = os.path.join(tmp_dir, "training.txt")
+            ground_path = os.path.join(tmp_dir, "dev.txt")
+            prediction_path = os.path.join(tmp_dir, "prediction")
+            with open(training_path, 'w', encoding='utf-8') as training_file:
+                # the tag of "важен" is missing
+                training_file.write("Закон закон Ncmsi\nе съм Vxitf-r3s\nе е Cp\n. . punct\nважен важен\n\n"
+                                    "София софия Npfsi\n")
+            with open(ground_path, 'w', encoding='utf-8') as ground_file:
+                ground_file.write("Закон закон Ncmsi\nе съм Vxitf-r3s\n\nНов нов Amsi\n2000 2000 Mcf\n")
+            with open(prediction_path, 'w', encoding='utf-8') as prediction_file:
+                prediction_file.write("закон закон ncmsi\nе е vxitf-r3s\nнов нов amsi\n2000 2000 x\n")
+
+            index_dir = os.path.join(tmp_dir, "index")
+            built_index = load_index(training_path, ground_path, index_dir=index_dir)
+            self.assertEqual(len(os.listdir(index_dir)), 1)
+            stored_index = load_index(training_path, ground_path, index_dir=index_dir)
+            fresh_index = load_index(training_path, ground_path, index_dir=None)
+
+            for index in [built_index, stored_index]:
+                pd.testing.assert_frame_equal(index["training_df"], fresh_index["training_df"])
+                pd.testing.assert_frame_equal(index["ground_df"], fresh_index["ground_df"])
+                self.assertEqual(index["eval_mask"].tolist(), [True, True, True, False])
+                self.assertEqual(sorted(index["ambiguous_words"]), ["е"])
+                for name in ["training_words", "training_tags", "ground_tags"]:
+                    self.assertTrue(pd.Index(index[name]).equals(pd.Index(fresh_index[name])), name)
+                np.testing.assert_array_equal(index["training_eval_mask"], fresh_index["training_eval_mask"])
+            self.assertTrue(stored_index["training_df"]["tag"].isnull().any())
+
+            prediction_df = read_prediction(prediction_path)
+            expected_match = match_predictions(prediction_df, fresh_index["ground_df"], fresh_index["training_df"])
+            for index in [fresh_index, stored_index]:
+                prediction_match = match_predictions(prediction_df, index["ground_df"], index=index)
+                pd.testing.assert_frame_equal(prediction_match, expected_match)
+
+    def test_running_score(self):
+        training_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"], ["е", "е", "cp"]],
+                                   columns=cols)
+        ground_df = pd.DataFrame([["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"], ["нов", "нов", "amsi"],
+                                  ["нов", "нов", "amsi"]], columns=cols)
+        index = build_index(training_df, ground_df)
+        hypotheses = ["<w> з а к о н + n c m s i </w>", "<w> е + v x i t f - r 3 s </w>", "<w> н о в + n c </w>",
+                      "<w> н о в а </w>"]
+        sentence_hypotheses = ["<w> з а к о н + n c m s i <s> е + v x i t f - r 3 s </w>",
+                               "<w> н о в + n c <s> н о в а </w>"]
+        sources = ["<w> з а к о н <s> е </w>", "<w> н о в <s> н о в </w>"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            hypothesis_path = os.path.join(tmp_dir, "dev_hypothesis")
+            with open(hypothesis_path, 'w', encoding='utf-8') as hypothesis_file:
+                hypothesis_file.write("\n".join(hypotheses))
+            self.assertEqual(list(follow_lines(hypothesis_path)), hypotheses)
+            self.assertEqual(list(follow_lines(hypothesis_path, follow=True, max_lines=2)), hypotheses[:2])
+
+        predictions = {
+            "word_and_context": list(postprocessed_predictions(hypotheses, ground_df["word"].tolist(), "+")),
+            "reordered": list(postprocessed_predictions(hypotheses[::-1], ground_df["word"].tolist(), "+",
+                                                        order=[3, 2, 1, 0])),
+            "sentence_to_sentence": list(postprocessed_sentence_predictions(sentence_hypotheses, sources, "+")),
+            "reordered_sentence_to_sentence": list(postprocessed_sentence_predictions(
+                sentence_hypotheses[::-1], sources[::-1], "+", order=[1, 0]))}
+        for name, rows_and_lines in predictions.items():
+            with self.subTest(name=name):
+                self.assertEqual(sorted(rows_and_lines), [(0, "закон закон ncmsi"), (1, "е е vxitf-r3s"),
+                                                          (2, "нов нов nc"), (3, "нов нова")])
+                score = RunningScore(index, postprocess=False)
+                for row, line in rows_and_lines:
+                    score.add(row, line)
+                self.assertEqual(score.results(), ["0.5", "0.5", "0.25", "0.5", "0", "0", "0", "1.0", "0"])
+
+                prediction_df = pd.DataFrame([line.split() + [np.nan] * (3 - len(line.split()))
+                                              for _, line in sorted(rows_and_lines)], columns=cols)
+                expected = match_predictions(prediction_df, ground_df, training_df, postprocess=False)
+                self.assertEqual(score.accuracy("all", "joint"), expected["joint_match"].mean())
+
+    def test_bootstrap(self):
+        rng = np.random.RandomState(0)
+        token_count = 2000
+        baseline = rng.rand(token_count, 3) < 0.8
+        # the second model also matches a tenth of the tokens the baseline misses, the third one is the baseline
+        better = baseline | ((rng.rand(token_count, 3) < 0.1) & ~baseline)
+        matches = np.stack([baseline, better, baseline]).astype(np.float32)
+        subsets = np.stack([np.ones(token_count, dtype=bool), rng.rand(token_count) < 0.3])
+
+        for resamples in [1, 100]:
+            accuracies, resampled = bootstrap_accuracies(matches, subsets, resamples=resamples, seed=1, chunk_size=30)
+            self.assertEqual(resampled.shape, (resamples, 2, 3, 3))
+            np.testing.assert_allclose(accuracies[0], matches.mean(axis=1), rtol=1e-6)
+            np.testing.assert_allclose(accuracies[1], matches[:, subsets[1]].mean(axis=1), rtol=1e-6)
+
+        lower, upper = confidence_intervals(resampled)
+        self.assertTrue(np.all(lower <= accuracies + 1e-6) and np.all(accuracies - 1e-6 <= upper))
+        p_values = paired_p_values(resampled, 0)
+        self.assertTrue(np.all(p_values[:, 0] == 1) and np.all(p_values[:, 2] == 1))
+        self.assertTrue(np.all(p_values[:, 1] < 0.05))
+
+        self.assertEqual(list(group_paths(["a/dev_prediction.1", "b/dev_prediction.1", "a/dev_prediction.2"]).items()),
+                         [("a", ["a/dev_prediction.1", "a/dev_prediction.2"]), ("b", ["b/dev_prediction.1"])])
+
+    def test_analyse_dataset(self):
+        df = pd.DataFrame({"word": ["а", "а", "а", "б", "б", "в", np.nan, "г"],
+                           "lemma": ["x", "y", "y", "б", "z", "в", np.nan, np.nan],
+                           "tag": ["N", "V", "N", "N", "A", "N", np.nan, "N"]})
+        partition_codes, types = encode_partitions(OrderedDict([("training", df), ("dev", df.iloc[::-1])]))
+        codes = partition_codes["training"]
+        self.assertEqual(types[codes["lemma"][3]], "б")
+        self.assertEqual(types[partition_codes["dev"]["word"][0]], "г")
+
+        groups, distinct_counts = distinct_values(codes["word"], codes["lemma"], len(types))
+        self.assertEqual(dict(zip(types[groups], distinct_counts)),
+                         df.groupby("word")["lemma"].nunique().to_dict())
+
+        # ties go to the value that sorts first
+        best = most_frequent_values(codes["word"], codes["tag"], types)
+        self.assertEqual({types[word]: types[best[word]] for word in np.unique(codes["word"][codes["word"] >= 0])},
+                         {"а": "N", "б": "A", "в": "N", "г": "N"})
+        self.assertEqual(best[codes["lemma"][0]], -1)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for partition in ["training", "dev", "test"]:
+                with open(os.path.join(tmp_dir, "{}.txt".format(partition)), 'w', encoding='utf-8') as partition_file:
+                    partition_file.write("котка котка Ncfsi\nкуче куче Ncnsi\n\nям ям Vpitf-r1s\n")
+            saved_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                analyse_dataset(["--folder", tmp_dir, "--no_index"])
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = saved_stdout
+        # every prediction matches when the partitions are the same
+        self.assertIn(("{:<20}" * 6).format("dev set", "", 3, 1.0, 1.0, 1.0), output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+""" compact_ud.py: stores word_and_context examples with the units of every sentence only once and expands them lazily """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import sys
+import os
+import json
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+cols = list(config["DATASET"]["COLUMNS"].values())
+
+COMPACT_VERSION = 1
+
+
+class CompactWriter(object):
+    """
+    Collects the (subword-segmented) sentences of a transformation and writes them as a table of the interned strings
+    they contain, the codes of their words in that table and one (sentence, word, window start, window end) record
+    per example, where the window is the range of sentences the context of the word is drawn from.
+    """
+    def __init__(self, path, transformer_arguments, context_span):
+        """
+        :param path: output file path (see file_io.compact_path)
+        :param transformer_arguments: keyword arguments of the Transformer that expands the examples
+        :param context_span: maximum number of sentences on each side of a sentence to draw context from
+        """
+        self.path = path
+        self.transformer_arguments = transformer_arguments
+        self.context_span = context_span
+        self.sentence_dfs = []
+
+    def write(self, sentence_df):
+        """
+        :param sentence_df: sentence dataframe (columns: word, lemma, tag), sentences are written in document order
+        :return:
+        """
+        self.sentence_dfs.append(sentence_df[cols])
+
+    def close(self):
+        sentence_lengths = np.array([sentence_df.shape[0] for sentence_df in self.sentence_dfs], dtype=np.int64)
+        # the k-th sentence spans document positions [sentence_bounds[k], sentence_bounds[k + 1])
+        sentence_bounds = np.concatenate([[0], np.cumsum(sentence_lengths)])
+
+        document_df = pd.concat(self.sentence_dfs) if self.sentence_dfs else pd.DataFrame(columns=cols)
+        codes, types = pd.factorize(document_df.values.ravel())
+
+        # same windows as transform_document, the last sentence of the document is never used as right-hand side context
+        sentence_idx = np.arange(len(self.sentence_dfs))
+        window_start = np.maximum(sentence_idx - self.context_span, 0)
+        window_end = np.maximum(np.minimum(sentence_idx + 1 + self.context_span, len(self.sentence_dfs) - 1),
+                                sentence_idx + 1)
+
+        example_sentence = np.repeat(sentence_idx, sentence_lengths)
+        example_word = np.arange(sentence_bounds[-1]) - sentence_bounds[example_sentence]
+        examples = np.stack([example_sentence, example_word, window_start[example_sentence],
+                             window_end[example_sentence]], axis=1)
+
+        # types are stored as newline separated utf-8 bytes because segmented types make fixed-width unicode arrays
+        # several times larger, and the records are regular enough to shrink well with compression
+        with open(self.path, 'wb') as compact_file:
+            np.savez_compressed(compact_file, version=COMPACT_VERSION,
+                                transformer=json.dumps(self.transformer_arguments),
+                                types=np.frombuffer("\n".join(str(value) for value in types).encode('utf-8'),
+                                                    dtype=np.uint8),
+                                codes=codes.astype(np.int32).reshape(-1, len(cols)),
+                                sentence_bounds=sentence_bounds, examples=examples.astype(np.int32))
+        self.sentence_dfs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompactReader(object):
+    """
+    Expands the examples of a file written by CompactWriter into the source and target lines that
+    Transformer.process_sentence produces for them, one example at a time.
+    """
+    def __init__(self, path):
+        from data.transform_ud import Transformer
+
+        with np.load(path) as compact:
+            if int(compact["version"]) != COMPACT_VERSION:
+                raise ValueError("{} was written by another version of compact_ud. Transform it again.".format(path))
+            self.transformer = Transformer(**json.loads(str(compact["transformer"])))
+            types = np.array(compact["types"].tobytes().decode('utf-8').split("\n"), dtype=object)
+            # missing values are coded as -1, which points at this last entry
+            types = np.append(types, np.nan)
+            codes = compact["codes"]
+            self.sentence_bounds = compact["sentence_bounds"].tolist()
+            self.examples = compact["examples"]
+
+        self.words = types[codes[:, 0]].tolist()
+        self.lemmas = types[codes[:, 1]].tolist()
+        self.tags = types[codes[:, 2]].tolist()
+        # units are indexed once for the whole document and shared by the contexts of all examples
+        self.unit_indices = self.transformer.index_document(self.words)
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __getitem__(self, i):
+        """
+        :param i: index of the example
+        :return: tuple(source_line, target_line)
+        """
+        sentence, word, window_start, window_end = self.examples[i].tolist()
+        pos = self.sentence_bounds[sentence] + word
+        source_lines, target_lines = self.transformer.process_span(self.words, self.lemmas, self.tags,
+                                                                   self.unit_indices, pos, pos + 1,
+                                                                   self.sentence_bounds[window_start],
+                                                                   self.sentence_bounds[window_end])
+        return source_lines[0], target_lines[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+if __name__ == "__main__":
+    import argparse
+    from data.file_io import OutputSink, compressed_path, COMPRESSION_SUFFIXES, DEFAULT_BUFFER_SIZE
+
+    parser = argparse.ArgumentParser(description="expands examples written by transform_ud --compact into source "
+                                                 "and target lines")
+    parser.add_argument("input", help="compact file (e.g. training_source.compact.npz)", type=str)
+    parser.add_argument("--output", help="output source and target files (default: print --print_file to stdout)",
+                        nargs=2, type=str, default=None)
+    parser.add_argument("--print_file", help="which file to print (source/target) without --output",
+                        choices=['source', 'target'], type=str, default='source')
+    parser.add_argument("--compression", help="compression of the output files", choices=list(COMPRESSION_SUFFIXES),
+                        type=str, default=None)
+    parser.add_argument("--buffer_size", help="size in bytes of the output buffers", type=int,
+                        default=DEFAULT_BUFFER_SIZE)
+    args = parser.parse_args()
+
+    reader = CompactReader(args.input)
+
+    if args.output:
+        with OutputSink(compressed_path(args.output[0], args.compression),
+                        compressed_path(args.output[1], args.compression), mode='w', compression=args.compression,
+                        buffer_size=args.buffer_size) as sink:
+            for source_line, target_line in reader:
+                sink.write([source_line], [target_line])
+    else:
+        for source_line, target_line in reader:
+            print(source_line if args.print_file == 'source' else target_line)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+""" compile_ud.py: compiles a preprocessed UD dataset partition into a binary file that loads without parsing """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import sys
+import os
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+from data.preprocess_ud import preprocess_dataset_for_train
+cols = list(config["DATASET"]["COLUMNS"].values())
+
+COMPILED_SUFFIX = ".npz"
+COMPILED_VERSION = 1
+
+
+def is_compiled(path):
+    return isinstance(path, str) and path.endswith(COMPILED_SUFFIX)
+
+
+def read_text_partition(path, usecols=(0, 1, 2)):
+    """
+    Reads and preprocesses a whitespace separated dataset partition, keeping the blank rows that separate its sentences
+    :param path: file path or stream
+    :param usecols: indices of the word, lemma and tag columns in the partition
+    :return: dataframe (columns: word, lemma, tag)
+    """
+    df = pd.read_csv(path, sep='\s+', names=cols, usecols=list(usecols), skip_blank_lines=False, comment='#', quoting=3)
+    return preprocess_dataset_for_train(df[cols])
+
+
+def compile_dataset(df, path):
+    """
+    Writes a preprocessed partition as a table of the interned strings it contains and the codes of its cells in
+    that table. Sentence boundaries are rows of -1 codes.
+    :param df: preprocessed dataframe (columns: word, lemma, tag)
+    :param path: output file path
+    :return:
+    """
+    codes, types = pd.factorize(df[cols].values.ravel())
+    # numpy unicode arrays don't need pickling to be loaded
+    np.savez(path, version=COMPILED_VERSION, columns=np.array(cols), types=np.array(types, dtype=str),
+             codes=codes.astype(np.int32).reshape(-1, len(cols)))
+
+
+def load_compiled(path):
+    """
+    Loads a compiled partition
+    :param path: file path
+    :return: preprocessed dataframe (columns: word, lemma, tag) with NaN rows as sentence boundaries
+    """
+    with np.load(path) as compiled:
+        if int(compiled["version"]) != COMPILED_VERSION:
+            raise ValueError("{} was compiled with another version of compile_ud. Compile it again.".format(path))
+        # code -1 of the boundaries and other missing cells points to the NaN at the end of the table
+        types = np.append(compiled["types"].astype(object), np.nan)
+        return pd.DataFrame(types[compiled["codes"]], columns=compiled["columns"].tolist())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="compiles UD dataset partitions to be read by transform_ud, "
+                                                 "postprocess_nematus, score_prediction and analyse_dataset")
+    parser.add_argument("input", help="partition files to be compiled", nargs='+', type=str)
+    parser.add_argument("--output_folder", help="folder of the compiled files (default: folder of each partition)",
+                        type=str, default=None)
+    parser.add_argument("--cols", help="indices of the word, lemma and tag columns (zero-indexed)", nargs=3, type=int,
+                        default=[0, 1, 2])
+    args = parser.parse_args()
+
+    for input_path in args.input:
+        output_path = input_path + COMPILED_SUFFIX
+        if args.output_folder:
+            os.makedirs(args.output_folder, exist_ok=True)
+            output_path = os.path.join(args.output_folder, os.path.basename(output_path))
+        compile_dataset(read_text_partition(input_path, args.cols), output_path)
+        print(output_path)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+""" file_io.py: opening (optionally compressed) text files of transformed datasets and predictions """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import io
+import os
+import gzip
+import shutil
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def compressed_path(path, compression=None):
+    """
+    Appends the suffix of a compression format to a file path (unless it is already there)
+    :param path:
+    :param compression: None, 'gzip' or 'zstd'
+    :return: file path
+    """
+    if compression is None:
+        return path
+    suffix = COMPRESSION_SUFFIXES[compression]
+    return path if path.endswith(suffix) else path + suffix
+
+
+def infer_compression(path):
+    """
+    Infers the compression format of a file from its suffix
+    :param path:
+    :return: None, 'gzip' or 'zstd'
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def open_text(path, mode='r', compression='infer', buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Opens a utf-8 text file which may be compressed with gzip or zstd.
+    zstd needs the zstandard package.
+    :param path: file path
+    :param mode: 'r', 'w' or 'a'
+    :param compression: None, 'gzip', 'zstd' or 'infer' (from the file suffix)
+    :param buffer_size: size of the write buffer in bytes, it is flushed whenever it is full
+    :return: text stream
+    """
+    if compression == 'infer':
+        compression = infer_compression(path)
+
+    if compression is None:
+        return open(path, mode, encoding='utf-8', buffering=buffer_size)
+
+    if compression == 'gzip':
+        binary_stream = gzip.open(path, mode + 'b')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package (pip install zstandard).")
+        if mode == 'r':
+            binary_stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        else:
+            # appending adds a new zstd frame, which readers decompress as if it was part of the previous one
+            binary_stream = zstandard.ZstdCompressor().stream_writer(open(path, mode + 'b'))
+    else:
+        raise ValueError("Unknown compression {}.".format(compression))
+
+    if mode == 'r':
+        binary_stream = io.BufferedReader(binary_stream, buffer_size)
+    else:
+        binary_stream = io.BufferedWriter(binary_stream, buffer_size)
+
+    return io.TextIOWrapper(binary_stream, encoding='utf-8')
+
+
+def link_file(source_path, destination_path, symlink=True):
+    """
+    Hard links a file, falling back to a symbolic link or a copy if the paths are on different file systems
+    :param source_path:
+    :param destination_path: replaced if it exists
+    :param symlink: whether to fall back to a symbolic link (True) or to a copy (False)
+    :return:
+    """
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        if symlink:
+            os.symlink(os.path.abspath(source_path), destination_path)
+        else:
+            shutil.copyfile(source_path, destination_path)
+
+
+def uncompressed_path(path):
+    """
+    Removes the suffix of a compression format from a file path
+    :param path:
+    :return: file path
+    """
+    compression = infer_compression(path)
+    if compression is not None:
+        return path[:-len(COMPRESSION_SUFFIXES[compression])]
+    return path
+
+
+def order_path(source_path):
+    """
+    Path of the file that records the original position of every line of a source file sorted by length
+    :param source_path: path of the (optionally compressed) source file
+    :return: file path
+    """
+    return uncompressed_path(source_path) + ".order"
+
+
+def dictionary_path(path):
+    """
+    Path of the Nematus dictionary of a source or target file (as named by nematus/data/build_dictionary.py)
+    :param path: path of the (optionally compressed) source or target file
+    :return: file path
+    """
+    return uncompressed_path(path) + ".json"
+
+
+def compact_path(source_path):
+    """
+    Path of the file that holds the examples of a transformation in the compact format of compact_ud
+    :param source_path: path of the (optionally compressed) source file the examples would be written to
+    :return: file path
+    """
+    return uncompressed_path(source_path) + ".compact.npz"
+
+
+def manifest_path(source_path):
+    """
+    Path of the file that records the content digest and the output lines of every sentence of a transformation
+    :param source_path: path of the (optionally compressed) source file
+    :return: file path
+    """
+    return uncompressed_path(source_path) + ".manifest"
+
+
+def offsets_path(path):
+    """
+    Path of the index of the byte offsets of the lines of a file
+    :param path: path of the (uncompressed) file
+    :return: file path
+    """
+    return path + ".offsets.npy"
+
+
+class OutputSink(object):
+    """
+    Keeps the source and target files of a transformation open for the whole run and writes lines to both of them.
+    """
+    def __init__(self, source_path, target_path, mode='a', compression=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 dictionaries=False):
+        """
+        :param dictionaries: whether to count the units of the lines and write the Nematus dictionaries of the source
+        and target files when the sink is closed (see dictionary_path)
+        """
+        self.source_file = open_text(source_path, mode, compression, buffer_size)
+        self.target_file = open_text(target_path, mode, compression, buffer_size)
+        self.dictionaries = None
+        if dictionaries:
+            from data.nematus_dictionary import Dictionary
+            self.dictionaries = [(Dictionary(), dictionary_path(source_path)),
+                                 (Dictionary(), dictionary_path(target_path))]
+
+    def write(self, source_lines, target_lines):
+        """
+        Writes lines to the source and target files
+        :param source_lines: list of source lines without newlines
+        :param target_lines: list of target lines without newlines
+        :return:
+        """
+        self.source_file.write("\n".join(source_lines) + "\n")
+        self.target_file.write("\n".join(target_lines) + "\n")
+        if self.dictionaries:
+            self.dictionaries[0][0].update(source_lines)
+            self.dictionaries[1][0].update(target_lines)
+
+    def close(self):
+        self.source_file.close()
+        self.target_file.close()
+        if self.dictionaries:
+            for dictionary, path in self.dictionaries:
+                dictionary.save(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SortedOutputSink(OutputSink):
+    """
+    Holds the lines written to it and writes them ordered by the number of source units when it is closed, so that
+    batches of similar length can be made from them. The original position of every line is written to a file
+    next to the source file (see order_path).
+    """
+    def __init__(self, source_path, target_path, mode='a', compression=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 dictionaries=False, bucket_width=1):
+        """
+        :param bucket_width: lines whose lengths are in the same bucket of that many units keep their original order
+        """
+        super(SortedOutputSink, self).__init__(source_path, target_path, mode, compression, buffer_size, dictionaries)
+        self.order_path = order_path(source_path)
+        self.bucket_width = bucket_width
+        self.source_lines = []
+        self.target_lines = []
+
+    def write(self, source_lines, target_lines):
+        self.source_lines.extend(source_lines)
+        self.target_lines.extend(target_lines)
+
+    def close(self):
+        # sorting is stable, so lines of the same bucket stay in their original order
+        order = sorted(range(len(self.source_lines)),
+                       key=lambda i: len(self.source_lines[i].split()) // self.bucket_width)
+        if order:
+            super(SortedOutputSink, self).write([self.source_lines[i] for i in order],
+                                                [self.target_lines[i] for i in order])
+        with open(self.order_path, 'w') as order_file:
+            order_file.writelines("{}\n".format(i) for i in order)
+        super(SortedOutputSink, self).close()
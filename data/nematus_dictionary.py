@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+""" nematus_dictionary.py: counts the units of transformed files and writes them as Nematus dictionaries """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import json
+from collections import Counter, OrderedDict
+import numpy as np
+
+# symbols that nematus/data/build_dictionary.py puts before the units of a file
+SPECIAL_SYMBOLS = ['eos', 'UNK']
+
+
+class Dictionary(object):
+    """
+    Counts the units of the lines of a file in the order they are first seen, as nematus/data/build_dictionary.py does
+    """
+    def __init__(self):
+        self.frequencies = Counter()
+
+    def update(self, lines):
+        """
+        :param lines: list of lines without newlines
+        :return:
+        """
+        for line in lines:
+            self.frequencies.update(line.strip().split(' '))
+
+    def save(self, path):
+        """
+        Writes the dictionary in the same format and order as nematus/data/build_dictionary.py
+        :param path: path of the json file
+        :return:
+        """
+        words = list(self.frequencies.keys())
+        # argsort of the frequencies in the order the units were first seen breaks ties the same way as nematus
+        sorted_idx = np.argsort(list(self.frequencies.values()))
+
+        worddict = OrderedDict((symbol, i) for i, symbol in enumerate(SPECIAL_SYMBOLS))
+        for i, idx in enumerate(sorted_idx[::-1]):
+            worddict[words[idx]] = i + len(SPECIAL_SYMBOLS)
+
+        with open(path, 'w', encoding='utf-8') as dictionary_file:
+            json.dump(worddict, dictionary_file, indent=2, ensure_ascii=False)
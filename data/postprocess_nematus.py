@@ -5,11 +5,39 @@ __author__ = "Bogomil Gospodinov"
 __email__ = "s1312650@sms.ed.ac.uk"
 __status__ = "dev"
 
+import sys
+import os
 import pandas as pd
 from io import StringIO
 import re
+from itertools import zip_longest
+from array import array
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import config
+cols = list(config["DATASET"]["COLUMNS"].values())
+WORD_BOUNDARY = config["TRANSFORM"]["DEFAULTS"]["WORD_BOUNDARY"]
 
 # example: python -m data.postprocess_nematus models/test-model/data/dev_hypothesis data/datasets/MorphoData-NewSplit/dev.txt > models/test-model/data/dev_prediction
+# add --order models/test-model/data/dev_source.order if the model's data was transformed with --sort_by_length
+# pass - instead of the hypothesis file to read it from a pipe, e.g. while nematus/translate.py is still running
+
+# boundary tags of a single character (e.g. <w>, </w>, <s>) and whitespace between units
+UNIT_SEPARATOR_PATTERN = re.compile(r"</?[^>]>|\s*")
+
+
+def split_prediction(line, tag_boundary):
+    """
+    Joins the units of a line of nematus predictions and splits it into lemma and tag
+    :param line:
+    :param tag_boundary:
+    :return: tuple(lemma, tag), the tag is empty if the line has no tag boundary
+    """
+    line = UNIT_SEPARATOR_PATTERN.sub("", line)
+    lemma_like, boundary, tag_like = line.rpartition(tag_boundary)
+    if not boundary:
+        return line, ""
+    return lemma_like, tag_like
+
 
 def postprocess_nematus(stream, tag_boundary):
     """
@@ -18,23 +46,101 @@ def postprocess_nematus(stream, tag_boundary):
     :param tag_boundary:
     :return: dataframe with two columns: for lemmas and tags
     """
-    stream.seek(0)
+    if stream.seekable():
+        stream.seek(0)
     buffer = StringIO()
     for line in stream:
-        line = re.sub(r"</?[^>]>|\s*", "", line)
-        if tag_boundary not in line:
-            buffer.write(line.rstrip() + '\t' + '\n')
+        buffer.write("\t".join(split_prediction(line, tag_boundary)) + '\n')
+    buffer.seek(0)
+    return buffer
+
+
+def read_ground_words(ground_path, chunk_size=100000):
+    """
+    Streams the words of a dataset partition that are kept by preprocessing, i.e. the words that were transformed
+    into examples
+    :param ground_path: file path of the partition (or of a partition compiled by compile_ud)
+    :param chunk_size: number of rows to read at once
+    :return: generator of words
+    """
+    from data.preprocess_ud import preprocess_dataset_for_train
+    from data.compile_ud import is_compiled, load_compiled
+
+    if is_compiled(ground_path):
+        ground_df = load_compiled(ground_path)
+        yield from ground_df.loc[ground_df["word"].notnull(), "word"].tolist()
+        return
+
+    # strings are kept as they are, as when the whole partition is read at once
+    for chunk_df in pd.read_csv(ground_path, sep='\s+', names=cols, comment='#', dtype=str, chunksize=chunk_size):
+        yield from preprocess_dataset_for_train(chunk_df)["word"].tolist()
+
+
+def join_predictions(ground_words, pred_lines, tag_boundary, counts=None):
+    """
+    Pairs every ground word with the lemma and tag predicted for it, one line at a time
+    :param ground_words: iterable of words
+    :param pred_lines: iterable of lines of nematus predictions (e.g. a text stream)
+    :param tag_boundary:
+    :param counts: optional list, the number of ground words and predictions are appended to it when both are exhausted
+    :return: generator of output lines (word, lemma and tag separated by spaces, without newlines)
+    """
+    ground_count = pred_count = 0
+    for word, pred_line in zip_longest(ground_words, pred_lines):
+        ground_count += word is not None
+        pred_count += pred_line is not None
+        if word is None or pred_line is None:
             continue
-        lemma_like, _, tag_like = line.rpartition(tag_boundary)
-        buffer.write(lemma_like + '\t' + tag_like + '\n')
+        yield " ".join((word,) + split_prediction(pred_line, tag_boundary)).strip()
+
+    if counts is not None:
+        counts.extend([ground_count, pred_count])
+    assert ground_count == pred_count, "Number of predicted rows doesn't match ground truth"
+
+
+def write_when_complete(lines, output_stream):
+    """
+    Writes lines only once all of them are produced, so that nothing is written if producing them fails (e.g. the
+    counts of join_predictions don't match). Lines are held in a temporary file rather than in memory.
+    :param lines: iterable of lines without newlines
+    :param output_stream: text stream (e.g. stdout)
+    :return:
+    """
+    import shutil
+    import tempfile
+
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as buffer_file:
+        for line in lines:
+            buffer_file.write(line + '\n')
+        buffer_file.seek(0)
+        shutil.copyfileobj(buffer_file, output_stream)
+
+
+def restore_order(stream, order_stream):
+    """
+    Restores the original order of the lines of a file transformed (or translated from a file transformed)
+    with transform_ud --sort_by_length
+    :param stream: text stream of sorted lines
+    :param order_stream: text stream (or list) of the original position of every line
+    :return: text stream of the lines in their original order
+    """
+    order = [int(line) for line in order_stream]
+    lines = [None] * len(order)
+    for position, line in zip(order, stream):
+        lines[position] = line if line.endswith('\n') else line + '\n'
+    assert None not in lines, "Number of lines doesn't match with the number of positions in the order file."
+    buffer = StringIO()
+    buffer.writelines(lines)
     buffer.seek(0)
     return buffer
 
 
 def postprocess_sentence_to_sentence_with_missing_words(ground_stream, pred_stream):
     # expects original dev.txt file from before transformation
-    ground_stream.seek(0)
-    pred_stream.seek(0)
+    if ground_stream.seekable():
+        ground_stream.seek(0)
+    if pred_stream.seekable():
+        pred_stream.seek(0)
     ground_buffer = StringIO()
     pred_buffer = StringIO()
 
@@ -61,44 +167,101 @@ def postprocess_sentence_to_sentence_with_missing_words(ground_stream, pred_stre
     return ground_buffer, pred_buffer
 
 
+def realign_sentence_to_sentence(ground_lines, pred_lines, word_boundary=WORD_BOUNDARY, counts=None):
+    """
+    Pairs the words of every line of a sentence_to_sentence source file with the words predicted on the same line
+    of the hypotheses in a single pass. Missing predictions are empty and extraneous ones are dropped.
+    :param ground_lines: iterable of lines of the source file the hypotheses were translated from
+    :param pred_lines: iterable of lines of nematus predictions
+    :param word_boundary:
+    :param counts: optional list, the number of ground and prediction lines are appended to it when both are exhausted
+    :return: generator of tuple(ground_word, predicted_word), both still made of units
+    """
+    ground_count = pred_count = 0
+    for ground_line, pred_line in zip_longest(ground_lines, pred_lines):
+        ground_count += ground_line is not None
+        pred_count += pred_line is not None
+        if ground_line is None or pred_line is None:
+            continue
+        pred_words = pred_line.split(word_boundary)
+        for i, ground_word in enumerate(ground_line.split(word_boundary)):
+            yield ground_word.strip(), pred_words[i].strip() if i < len(pred_words) else ""
+
+    if counts is not None:
+        counts.extend([ground_count, pred_count])
+    assert ground_count == pred_count, "Number of predictions lines don't match with those in the ground file."
+
+
 def postprocess_sentence_to_sentence(ground_stream, pred_stream):
     # expects dev_source file created for that model
-    pred_stream.seek(0)
-    ground_stream.seek(0)
+    if pred_stream.seekable():
+        pred_stream.seek(0)
+    if ground_stream.seekable():
+        ground_stream.seek(0)
     pred_buffer = StringIO()
     ground_buffer = StringIO()
-    sent_sz = 0
 
-    for ground_line in ground_stream:
-        for word in ground_line.split("<s>"):
-            word = word.strip()
-            ground_buffer.write(word + '\n')
-            sent_sz += 1
+    for ground_word, pred_word in realign_sentence_to_sentence(ground_stream, pred_stream):
+        ground_buffer.write(ground_word + '\n')
+        pred_buffer.write(pred_word + '\n')
 
-        pred_line = next(pred_stream)
+    return ground_buffer, pred_buffer
 
-        for word in pred_line.split("<s>"):
-            if sent_sz == 0:
-                break
-            word = word.strip()
-            pred_buffer.write(word + '\n')
-            sent_sz -= 1
 
-        while sent_sz > 0:
-            sent_sz -= 1
-            pred_buffer.write('\n')
+def line_offsets(path):
+    """
+    Indexes the lines of an uncompressed file by their byte offsets. The index is kept next to the file (see
+    file_io.offsets_path) and reused until the file changes.
+    :param path:
+    :return: numpy array of the offset of every line
+    """
+    import numpy as np
+    from data.file_io import offsets_path
+
+    index_path = offsets_path(path)
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        return np.load(index_path)
+
+    offsets = array('q')
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            offsets.append(offset)
+            offset += len(line)
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+
+    try:
+        with open(index_path, 'wb') as index_file:
+            np.save(index_file, offsets)
+    except OSError:
+        # e.g. the folder of the file is read-only
+        pass
+    return offsets
+
+
+def read_lines_in_order(path, order, offsets):
+    """
+    Reads the lines of an uncompressed file transformed with transform_ud --sort_by_length in their original order
+    by seeking to them, instead of holding them all in memory like restore_order
+    :param path:
+    :param order: original position of every line
+    :param offsets: byte offset of every line (see line_offsets)
+    :return: generator of lines
+    """
+    assert len(order) == len(offsets), "Number of lines doesn't match with the number of positions in the order file."
+    sorted_positions = [0] * len(order)
+    for sorted_position, position in enumerate(order):
+        sorted_positions[position] = sorted_position
 
-    return ground_buffer, pred_buffer
+    with open(path, 'rb') as file:
+        for sorted_position in sorted_positions:
+            file.seek(offsets[sorted_position])
+            yield file.readline().decode('utf-8')
 
 
 if __name__ == "__main__":
-    import sys
-    import os
-    from data.preprocess_ud import preprocess_dataset_for_train
-    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-    from config import config
+    from data.file_io import open_text, infer_compression
     import logging
-    cols = list(config["DATASET"]["COLUMNS"].values())
 
     level = logging.DEBUG
     logging.basicConfig(level=level, format='%(asctime)s %(levelname)s: %(message)s')
@@ -106,50 +269,37 @@ if __name__ == "__main__":
     pred_path = sys.argv[1]
     ground_path = sys.argv[2]
     sentence_to_sentence_mode = "--sentence_to_sentence" in sys.argv
+    # original positions of the lines of files transformed with --sort_by_length
+    order_path = sys.argv[sys.argv.index("--order") + 1] if "--order" in sys.argv else None
 
-    pred_f = open(pred_path, mode="r", encoding='utf-8')
+    tag_boundary = config["TRANSFORM"]["DEFAULTS"]["TAG_BOUNDARY"]
 
-    if sentence_to_sentence_mode:
-        pred_f_lc = 0
-        ground_f_lc = 0
-
-        for _ in pred_f:
-            pred_f_lc += 1
-        pred_f.seek(0)
-
-        ground_f = open(ground_path, mode="r", encoding='utf-8')
-
-        for _ in ground_f:
-            ground_f_lc += 1
-        ground_f.seek(0)
-
-        print("{} ? {}".format(pred_f_lc, ground_f_lc), file=sys.stderr)
-        assert pred_f_lc == ground_f_lc, "Number of predictions lines don't match with those in the ground file."
-        ground_f, pred_f = postprocess_sentence_to_sentence(ground_f, pred_f)
-        pred_f.seek(0)
-        ground_f.seek(0)
-        ground_f = postprocess_nematus(ground_f, config["TRANSFORM"]["DEFAULTS"]["TAG_BOUNDARY"])
-        ground_df = pd.read_table(ground_f, header=None, names=['word'], usecols=[0])
-    else:
-        ground_df = pd.read_csv(ground_path, sep='\s+', names=cols, comment='#',
-                                skip_blank_lines=(not sentence_to_sentence_mode))
-        ground_df = preprocess_dataset_for_train(ground_df).reset_index()
-
-    pred_f = postprocess_nematus(pred_f, config["TRANSFORM"]["DEFAULTS"]["TAG_BOUNDARY"])
-    pred_df = pd.read_table(pred_f, header=None, names=['lemma', 'tag'])
-
-    print("{} ? {}".format(ground_df.shape[0], pred_df.shape[0]), file=sys.stderr)
-    assert ground_df.shape[0] == pred_df.shape[0], "Number of predicted rows doesn't match ground truth"
+    pred_f = sys.stdin if pred_path == '-' else open_text(pred_path)
 
-    joint_df = pd.concat([ground_df["word"], pred_df], axis=1, ignore_index=True)
+    order = None
+    if order_path:
+        with open(order_path) as order_f:
+            order = [int(line) for line in order_f]
+        pred_f = restore_order(pred_f, order)
 
-    print("{} ? {}".format(ground_df.shape[0], joint_df.shape[0]), file=sys.stderr)
-    assert ground_df.shape[0] == joint_df.shape[0], "More rows joined than necessary"
-
-    output_buffer = StringIO()
+    counts = []
+    if sentence_to_sentence_mode:
+        if order is None:
+            ground_f = open_text(ground_path)
+        elif infer_compression(ground_path) is None:
+            # the ground file is the sorted source file, which is read in the original order by seeking to its lines
+            ground_f = read_lines_in_order(ground_path, order, line_offsets(ground_path))
+        else:
+            ground_f = restore_order(open_text(ground_path), order)
+
+        # words are realigned in the same pass over both files
+        lines = (" ".join((split_prediction(ground_word, tag_boundary)[0],) +
+                          split_prediction(pred_word, tag_boundary)).strip()
+                 for ground_word, pred_word in realign_sentence_to_sentence(ground_f, pred_f, counts=counts))
+    else:
+        lines = join_predictions(read_ground_words(ground_path), pred_f, tag_boundary, counts)
 
-    joint_df.to_string(output_buffer, index=False, header=False, na_rep=' ')
+    # output lines are produced as soon as their prediction is read, but only written once the counts match
+    write_when_complete(lines, sys.stdout)
 
-    output_buffer.seek(0)
-    for line in output_buffer:
-        print(line.strip())
+    print("{} ? {}".format(*counts), file=sys.stderr)
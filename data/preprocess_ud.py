@@ -8,6 +8,13 @@ __status__ = "dev"
 import pandas as pd
 import re
 
+# Bulgarian BTB-UD specific tag suffixes
+TAG_SUFFIX_PATTERN = re.compile(r"(?:\+[0-9]+|\".*|;.*)+$")
+PUNCTUATION_PATTERN = re.compile(r"^(?:\"|!|'|,|\.|\?|:|;|\||\-|\+|\(|\)|\[|\]|\{|\}|%|\*|/|&|=|>|<|_|\s)")
+CYRILLIC_WORD_PATTERN = re.compile(r'[\u0400-\u04FF]+[\u0400-\u04FF\-()]*')
+EXCLUDED_TAG_PATTERN = re.compile("^(?:Np|H|punct).*$", re.IGNORECASE)
+
+
 def preprocess_dataset_for_train(df):
     """
     Exludes punctuation (except parenthesis and hyphens), lowercases every entity,
@@ -19,15 +26,19 @@ def preprocess_dataset_for_train(df):
     """
     # sanity check
     # awk -F "[[:space:]]+" 'BEGIN{ cnt=0; } $1 ~ /[[:alpha:]]+/ { cnt+=1; } END{ print cnt; }' training.txt
-    df = df.apply(lambda x: x.astype(str).str.lower() if not pd.isna(x).any() else x, axis=1)
+    # only rows without missing values are lowercased
+    complete = df.notnull().all(axis=1)
+    df = pd.DataFrame({col: df[col].where(~complete, df.loc[complete, col].astype(str).str.lower()).astype(object)
+                       for col in df.columns}, index=df.index)
     # Bulgarian BTB-UD specific preprocessing
-    df["tag"] = df["tag"].apply(lambda x: re.sub(r"(?:\+[0-9]+|\".*|;.*)+$", "", x) if not pd.isna(x) else x)
+    df["tag"] = df["tag"].str.replace(TAG_SUFFIX_PATTERN, "", regex=True)
+    word_missing = df["word"].isnull()
     # ignore corrupted entries where only the word is null but not the tag
-    df = df.loc[~(pd.isna(df["word"]) & ~pd.isna(df["tag"]))]
+    mask = ~(word_missing & df["tag"].notnull())
     # ignore punctuation by tag and by string but keep nans that represent new lines
-    df = df[~df["word"].str.contains(r"^(?:\"|!|'|,|\.|\?|:|;|\||\-|\+|\(|\)|\[|\]|\{|\}|%|\*|/|&|=|>|<|_|\s)", na=False)]
-    df = df[((df["tag"] != "punct") & (df["lemma"] != "punct")) | pd.isna(df["word"])]
-    return df
+    mask &= ~df["word"].str.contains(PUNCTUATION_PATTERN, na=False)
+    mask &= ((df["tag"] != "punct") & (df["lemma"] != "punct")) | word_missing
+    return df[mask]
 
 
 def preprocess_dataset_for_eval(df, prediction=False):
@@ -43,8 +54,8 @@ def preprocess_dataset_for_eval(df, prediction=False):
     else:
         word_col = "word"
         tag_col = "tag"
-    return df[(df[word_col].str.match(r'[\u0400-\u04FF]+[\u0400-\u04FF\-()]*')) &\
-              (~(df[tag_col].str.contains("^(?:Np|H|punct).*$", case=False).fillna(False)))]
+    return df[df[word_col].str.match(CYRILLIC_WORD_PATTERN, na=False) &
+              ~df[tag_col].str.contains(EXCLUDED_TAG_PATTERN, na=False)]
 
 
 if __name__ == "__main__":
@@ -56,6 +67,20 @@ if __name__ == "__main__":
     cols = list(config["DATASET"]["COLUMNS"].values())
     dataset_path = sys.argv[1]
     df = pd.read_csv(dataset_path, sep='\s+', names=cols, skip_blank_lines=False, comment='#')
+
+    if "--benchmark" in sys.argv:
+        # python -m data.preprocess_ud data/datasets/MorphoData-NewSplit/dev.txt --benchmark
+        import timeit
+        repeats = 5
+        train_seconds = min(timeit.repeat(lambda: preprocess_dataset_for_train(df), number=1, repeat=repeats))
+        train_df = preprocess_dataset_for_train(df)
+        eval_seconds = min(timeit.repeat(lambda: preprocess_dataset_for_eval(train_df), number=1, repeat=repeats))
+        print("preprocess_dataset_for_train: {} rows in {:.4f}s ({:.0f} rows/s)"
+              .format(df.shape[0], train_seconds, df.shape[0] / train_seconds))
+        print("preprocess_dataset_for_eval: {} rows in {:.4f}s ({:.0f} rows/s)"
+              .format(train_df.shape[0], eval_seconds, train_df.shape[0] / eval_seconds))
+        sys.exit()
+
     df = preprocess_dataset_for_train(df)
     buffer = StringIO()
     df.to_string(buffer, index=False, header=False, na_rep=' ')
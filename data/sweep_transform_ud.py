@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+""" sweep_transform_ud.py: transforms an UD dataset with a grid of configurations, reading and segmenting it only once """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import sys
+import os
+import argparse
+import logging
+import shutil
+from itertools import product
+
+from data.transform_ud import build_parser, read_dataset, split_sentences, resolve_output, transform_folder_path, \
+    subword_unit, build_subword_preprocessor, cached_artifacts, write_transformation
+from data.transform_cache import restore, store
+
+# arguments of transform_ud which can take several values in a sweep
+SWEEP_ARGUMENTS = [("context_size", int), ("context_unit", str), ("char_n_gram_mode", int), ("context_tags", str)]
+# arguments of transform_ud about reading the input, which a sweep reads once and at once for all configurations.
+# All other arguments are applied to every configuration by transform_ud.cached_artifacts and write_transformation.
+UNSUPPORTED_ARGUMENTS = ["streaming", "chunk_size"]
+
+
+def build_sweep_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="transforms an UD dataset with every combination of the given values, all other arguments "
+                    "are passed to transform_ud")
+    for name, type in SWEEP_ARGUMENTS:
+        parser.add_argument("--" + name, help="one or more values of --{} of transform_ud".format(name), nargs='+',
+                            type=type, default=None)
+    return parser
+
+
+def expand_grid(argv):
+    """
+    Parses the arguments of every configuration of a sweep
+    :param argv: command line arguments
+    :return: list of parsed arguments of transform_ud, configurations which lead to the same transform folder
+    are only included once
+    """
+    sweep_args, transform_argv = build_sweep_parser().parse_known_args(argv)
+    parser = build_parser()
+
+    grid = [[("--" + name, str(value)) for value in values] for name, values in vars(sweep_args).items() if values]
+
+    configurations = []
+    folder_paths = set()
+    for combination in product(*grid):
+        args = parser.parse_args(transform_argv + [token for option in combination for token in option])
+
+        if args.input is None:
+            raise ValueError("A sweep can't read from stdin. Use --input to specify path.")
+
+        unsupported = ["--" + name for name in UNSUPPORTED_ARGUMENTS if getattr(args, name) != parser.get_default(name)]
+        if unsupported:
+            raise ValueError("A sweep reads its input once for all configurations, {} can't be used in a sweep."
+                             .format(", ".join(unsupported)))
+
+        if not args.debug:
+            if args.output is not None and len(args.output) > 1:
+                raise ValueError("A sweep writes to a transform folder per configuration. "
+                                 "Use --output to specify the parent folder only.")
+            # e.g. --char_n_gram_mode is irrelevant unless the context is made of chars
+            folder_path = transform_folder_path(args)
+            if folder_path in folder_paths:
+                continue
+            folder_paths.add(folder_path)
+
+        configurations.append(args)
+
+    return configurations
+
+
+def segmentation_key(args):
+    """
+    :param args: parsed arguments of transform_ud
+    :return: key which is shared by configurations that segment their input the same way
+    """
+    unit = subword_unit(args)
+    if unit == 'char':
+        return unit, args.char_n_gram_mode
+    elif unit == 'bpe':
+        return unit, args.bpe_operations, args.bpe_codes_path
+    else:
+        return unit,
+
+
+def main(argv):
+    configurations = expand_grid(argv)
+    outputs = [resolve_output(args) for args in configurations]
+
+    print("{} configurations".format(len(configurations)), file=sys.stderr)
+
+    # all configurations share the input and its columns
+    args = configurations[0]
+    usecols = [args.word_column_index, args.lemma_column_index, args.tag_column_index]
+    dataset_df = next(read_dataset(args.input, usecols))
+
+    groups = {}
+    for args, output in zip(configurations, outputs):
+        groups.setdefault(segmentation_key(args), []).append((args, output))
+
+    for key, group in groups.items():
+        # configurations restored from the cache are neither segmented nor transformed
+        pending = []
+        for args, output in group:
+            cache_path, artifact_paths = cached_artifacts(args, *output)
+            if cache_path is not None and restore(cache_path, artifact_paths):
+                logging.info("Transformation restored from {}".format(cache_path))
+                continue
+            pending.append((args, output, cache_path, artifact_paths))
+        if not pending:
+            continue
+
+        logging.info("Segmenting for {}".format(key))
+
+        args, (first_transform_folder_path, _, _), _, _ = pending[0]
+        subword_preprocess = build_subword_preprocessor(args, first_transform_folder_path, dataset_df)
+        sentence_dfs = list(split_sentences([subword_preprocess(dataset_df.copy())]))
+
+        for args, (full_transform_folder_path, output_source_path, output_target_path), cache_path, artifact_paths \
+                in pending:
+            print(args, file=sys.stderr)
+
+            # BPE codes learned for the first configuration of the group are shared by the others
+            if key[0] == 'bpe' and not args.bpe_codes_path and full_transform_folder_path != first_transform_folder_path:
+                shutil.copyfile(os.path.join(first_transform_folder_path, "bpe_codes"),
+                                os.path.join(full_transform_folder_path, "bpe_codes"))
+
+            write_transformation(args, sentence_dfs, output_source_path, output_target_path)
+
+            if cache_path is not None:
+                store(cache_path, artifact_paths)
+
+
+if __name__ == "__main__":
+    level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s: %(message)s')
+    main(sys.argv[1:])
@@ -8,8 +8,18 @@ import unittest
 import logging
 import os
 import sys
+import tempfile
+import json
+from collections import OrderedDict
 from io import StringIO
 import data.transform_ud as t
+from data.sweep_transform_ud import expand_grid, segmentation_key, main as sweep
+from data.preprocess_ud import preprocess_dataset_for_train, preprocess_dataset_for_eval
+from data.postprocess_nematus import restore_order, join_predictions, read_ground_words, realign_sentence_to_sentence, \
+    line_offsets, read_lines_in_order, write_when_complete
+from data.compact_ud import CompactWriter, CompactReader
+from data.compile_ud import compile_dataset, load_compiled, read_text_partition
+from data.file_io import OutputSink, SortedOutputSink, open_text, compressed_path
 import pandas as pd
 import numpy as np
 from functools import reduce
@@ -108,6 +118,408 @@ class TestTransformUD(unittest.TestCase):
         del units[0]
         return res
 
+    def make_sentence_df(self, rows, start):
+        """
+        Builds a sentence dataframe from (word, lemma, tag) rows, indexed from start as in a preprocessed dataset
+        :param rows:
+        :param start:
+        :return:
+        """
+        return pd.DataFrame(rows, columns=cols, index=range(start, start + len(rows)))
+
+    def test_process_sentence(self):
+        lc_df = self.make_sentence_df([["пр@@ ед@@ и", "пр@@ ед@@ и", "R"], ["то@@ ва", "то@@ ва", "Pd"]], 0)
+        sentence_df = self.make_sentence_df([["за@@ ко@@ н", "за@@ ко@@ н", "Nc"], ["е", "съм", "Vx"],
+                                             ["ва@@ же@@ н", "ва@@ же@@ н", "A"]], 3)
+        rc_df = self.make_sentence_df([["по@@ сле", "по@@ сле", "D"], ["до@@ бре", "до@@ бре", "D"]], 7)
+
+        transformer = t.Transformer(context_char_size=6, context_tags="left")
+        source_lines, target_lines = transformer.process_sentence(sentence_df, lc_df, rc_df)
+
+        self.assertEqual(source_lines, ["<w> и + R <s> то ва + P d <lc> з а к о н <rc> е <s> ва же н </w>",
+                                        "<w> за ко н + N c <lc> е <rc> ва же н </w>",
+                                        "<w> за ко н + N c <s> е + V x <lc> в а ж е н <rc> по сле </w>"])
+        self.assertEqual(target_lines, ["<w> з а к о н + N c </w>", "<w> с ъ м + V x </w>",
+                                        "<w> в а ж е н + A </w>"])
+
+    def test_context_engine(self):
+        """
+        Checks that contexts sliced from unit arrays are identical to those of the reference compute_context
+        :return:
+        """
+        words = list(self.wordlist[:200])
+        spans = [words, [(defaults["SUBWORD_SEPARATOR"] + " ").join(word) for word in words]]
+
+        for transformer_args in [{'context_size': 5}, {'context_size': 0}, {'context_char_size': 25},
+                                 {'context_char_size': 0}]:
+            transformer = t.Transformer(**transformer_args)
+            for span in spans:
+                span_df = pd.DataFrame({"word": span})
+                transformer.subword_mode_flag = span_df["word"].str.contains(transformer.subword_separator).any()
+                left_units = transformer.index_units(span)
+                right_units = transformer.index_units(span[::-1], reverse=True)
+                reversed_df = span_df.applymap(lambda x: x[::-1]) if transformer.subword_mode_flag else span_df
+
+                for pos in range(0, len(span), 17):
+                    with self.subTest(args=transformer_args, pos=pos):
+                        self.assertEqual(transformer.slice_context(left_units, pos),
+                                         transformer.compute_context(span_df.iloc[:pos]))
+                        self.assertEqual(transformer.slice_context(left_units, pos, pos // 3),
+                                         transformer.compute_context(span_df.iloc[pos // 3:pos]))
+
+                        right_context = transformer.compute_context(reversed_df.iloc[:pos:-1])[::-1]
+                        if transformer.subword_mode_flag:
+                            right_context = [w[::-1] if w is not transformer.word_boundary else w
+                                             for w in right_context]
+                        self.assertEqual(transformer.slice_context(right_units, len(span) - 1 - pos)[::-1],
+                                         right_context)
+
+    def test_transform_stream_and_shards(self):
+        sentences = [["за@@ ко@@ н", "е", "ва@@ же@@ н"], [], ["пр@@ ед@@ и", "то@@ ва"], ["по@@ сле"], ["до@@ бре", "е"]]
+        sentence_dfs = [self.make_sentence_df([[word, word, "Nc"] for word in sentence], 0) for sentence in sentences]
+        transformer = t.Transformer(context_size=4)
+
+        for context_span in [0, 1, 2, 5]:
+            with self.subTest(context_span=context_span):
+                serial_output = list(t.transform_document(transformer, sentence_dfs, context_span))
+                self.assertEqual(list(t.transform_stream(transformer, iter(sentence_dfs), context_span)), serial_output)
+
+                for shard_size in [1, 2, 3]:
+                    sharded_output = [output_lines for shard in t.shard_sentences(iter(sentence_dfs), context_span, shard_size)
+                                      for output_lines in t.transform_shard((transformer, context_span) + shard)]
+                    self.assertEqual(sharded_output, serial_output)
+
+    def test_read_dataset_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset_path = os.path.join(tmp_dir, "dev.txt")
+            with open(dataset_path, "w", encoding="utf-8") as dataset_file:
+                dataset_file.write("# sent_id = 1\nЗакон закон Ncmsi\nе съм Vxitf-r3s\n\n# sent_id = 2\n19.30 19.30 Mc-pi\n"
+                                   "\n\n\nважен важен Amsi\n\n")
+            expected = [sentence_df.values.tolist() for sentence_df in
+                        t.split_sentences(t.read_dataset(dataset_path, [0, 1, 2]))]
+            self.assertEqual(expected, [[["закон", "закон", "ncmsi"], ["е", "съм", "vxitf-r3s"]],
+                                        [["19.30", "19.30", "mc-pi"]], [], [], [["важен", "важен", "amsi"]]])
+
+            # chunks made only of blank lines or comments are read as well
+            for chunk_size in [1, 2, 3]:
+                with self.subTest(chunk_size=chunk_size):
+                    self.assertEqual([sentence_df.values.tolist() for sentence_df in
+                                      t.split_sentences(t.read_dataset(dataset_path, [0, 1, 2], chunk_size))],
+                                     expected)
+
+    def test_compact_examples(self):
+        sentences = [["за@@ ко@@ н", "е", "ва@@ же@@ н"], [], ["пр@@ ед@@ и", "то@@ ва"], ["по@@ сле"], ["до@@ бре", "е"]]
+        sentence_dfs = [self.make_sentence_df([[word, word, "Nc"] for word in sentence], 0) for sentence in sentences]
+        transformer_arguments = {'context_size': 4, 'context_tags': 'left'}
+        transformer = t.Transformer(**transformer_arguments)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            compact_path = os.path.join(tmp_dir, "dev_source.compact.npz")
+            for context_span in [0, 1, 2]:
+                with self.subTest(context_span=context_span):
+                    with CompactWriter(compact_path, transformer_arguments, context_span) as writer:
+                        for sentence_df in sentence_dfs:
+                            writer.write(sentence_df)
+
+                    source_lines, target_lines = [], []
+                    for output_source_lines, output_target_lines in t.transform_document(transformer, sentence_dfs,
+                                                                                         context_span):
+                        source_lines.extend(output_source_lines)
+                        target_lines.extend(output_target_lines)
+
+                    reader = CompactReader(compact_path)
+                    self.assertEqual(len(reader), 8)
+                    self.assertEqual(list(reader), list(zip(source_lines, target_lines)))
+                    self.assertEqual(reader[5], (source_lines[5], target_lines[5]))
+
+            # missing cells are read back as missing rather than as another type
+            with CompactWriter(compact_path, transformer_arguments, 0) as writer:
+                writer.write(self.make_sentence_df([["за@@ ко@@ н", np.nan, "Nc"], ["е", "съм", np.nan]], 0))
+            reader = CompactReader(compact_path)
+            self.assertEqual(reader.words, ["за@@ ко@@ н", "е"])
+            self.assertEqual([lemma if pd.notnull(lemma) else None for lemma in reader.lemmas], [None, "съм"])
+            self.assertEqual([tag if pd.notnull(tag) else None for tag in reader.tags], ["Nc", None])
+
+    def test_output_sink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for compression in [None, "gzip"]:
+                with self.subTest(compression=compression):
+                    source_path = compressed_path(os.path.join(tmp_dir, "source"), compression)
+                    target_path = compressed_path(os.path.join(tmp_dir, "target"), compression)
+                    with OutputSink(source_path, target_path, mode='w', compression=compression, buffer_size=16) as sink:
+                        sink.write(["<w> а <lc> б <rc> в </w>", "<w> г <lc> д <rc> </w>"], ["<w> а + N </w>", "<w> г + V </w>"])
+                        sink.write(["<w> <lc> е <rc> </w>"], ["<w> е + A </w>"])
+
+                    with open_text(source_path) as source_file, open_text(target_path) as target_file:
+                        self.assertEqual(source_file.read(), "<w> а <lc> б <rc> в </w>\n<w> г <lc> д <rc> </w>\n"
+                                                             "<w> <lc> е <rc> </w>\n")
+                        self.assertEqual(target_file.read(), "<w> а + N </w>\n<w> г + V </w>\n<w> е + A </w>\n")
+
+    def test_sweep_grid(self):
+        configurations = expand_grid(["--input", "datasets/dataset/dev.txt", "--output", "sweep", "--context_size", "5", "10",
+                                      "--context_unit", "word", "char", "--char_n_gram_mode", "1", "2"])
+        # --char_n_gram_mode doesn't change word contexts
+        self.assertEqual(len(configurations), 6)
+        self.assertEqual(len(set(t.transform_folder_path(args) for args in configurations)), 6)
+        self.assertEqual(sorted(set(segmentation_key(args) for args in configurations), key=str),
+                         [('char', 1), ('char', 2), (None,)])
+        with self.assertRaises(ValueError):
+            expand_grid(["--input", "datasets/dataset/dev.txt", "--context_size", "5", "10", "--streaming"])
+
+    def test_sweep_output(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "dataset", "dev.txt")
+            os.makedirs(os.path.dirname(input_path))
+            with open(input_path, "w", encoding="utf-8") as input_file:
+                input_file.write("Закон закон Ncmsi\nе съм Vxitf-r3s\n\nважен важен Amsi\n\n")
+
+            saved_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                # a second incremental sweep replaces the output files of the first one instead of appending to them
+                for appendix, io_argv in [("1", ["--incremental"]), ("1", ["--incremental"]),
+                                          ("2", ["--cache_dir", os.path.join(tmp_dir, "cache")]),
+                                          ("3", ["--cache_dir", os.path.join(tmp_dir, "cache")])]:
+                    argv = ["--input", input_path, "--output", os.path.join(tmp_dir, "input"), "--context_unit", "word",
+                            "--transform_appendix", appendix] + io_argv
+                    sweep(argv + ["--context_size", "1", "2"])
+            finally:
+                sys.stdout = saved_stdout
+
+            for context_size in ["1", "2"]:
+                folder_paths = [t.transform_folder_path(t.build_parser().parse_args(
+                    ["--input", input_path, "--output", os.path.join(tmp_dir, "input"), "--context_unit", "word",
+                     "--context_size", context_size, "--transform_appendix", appendix]))
+                    for appendix in ["1", "2", "3"]]
+                for folder_path in folder_paths:
+                    with open(os.path.join(folder_path, "dev_target"), encoding="utf-8") as target_file:
+                        self.assertEqual(len(target_file.readlines()), 3)
+                # the last sweep links the files of the one before
+                self.assertTrue(os.path.samefile(os.path.join(folder_paths[1], "dev_source"),
+                                                 os.path.join(folder_paths[2], "dev_source")))
+
+    def test_transform_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "dataset", "dev.txt")
+            os.makedirs(os.path.dirname(input_path))
+            with open(input_path, "w", encoding="utf-8") as input_file:
+                input_file.write("Закон закон Ncmsi\nе съм Vxitf-r3s\n\nважен важен Amsi\n\n")
+
+            folder_paths = []
+            for appendix in ["1", "2"]:
+                argv = ["--input", input_path, "--output", os.path.join(tmp_dir, "input"), "--context_unit", "word",
+                        "--transform_appendix", appendix, "--cache_dir", os.path.join(tmp_dir, "cache")]
+                saved_stdout = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    t.main(argv)
+                finally:
+                    sys.stdout = saved_stdout
+                folder_paths.append(t.transform_folder_path(t.build_parser().parse_args(argv)))
+
+            # the second job links the files of the first one
+            for file_name in ["dev_source", "dev_target"]:
+                self.assertTrue(os.path.samefile(os.path.join(folder_paths[0], file_name),
+                                                 os.path.join(folder_paths[1], file_name)))
+            with open(os.path.join(folder_paths[1], "dev_target"), encoding="utf-8") as target_file:
+                self.assertEqual(len(target_file.readlines()), 3)
+
+    def test_iterate_examples(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "dataset", "dev.txt")
+            os.makedirs(os.path.dirname(input_path))
+            with open(input_path, "w", encoding="utf-8") as input_file:
+                input_file.write("Закон закон Ncmsi\nе съм Vxitf-r3s\n\nважен важен Amsi\n\nДобре добре Dm\n\n")
+
+            for mode, mode_argv in [("word_and_context", ["--context_unit", "word", "--context_span", "1"]),
+                                    ("sentence_to_sentence", ["--mode", "sentence_to_sentence", "--word_unit", "char",
+                                                              "--sentence_size", "12"])]:
+                with self.subTest(mode=mode):
+                    argv = ["--input", input_path] + mode_argv
+                    output_paths = [os.path.join(tmp_dir, mode + "_source"), os.path.join(tmp_dir, mode + "_target")]
+                    t.main(argv + ["--output"] + output_paths)
+                    output_lines = []
+                    for output_path in output_paths:
+                        with open(output_path, encoding="utf-8") as output_file:
+                            output_lines.append(output_file.read().splitlines())
+
+                    examples = list(t.iterate_examples(argv))
+                    self.assertEqual([(" ".join(source_units), " ".join(target_units))
+                                      for source_units, target_units in examples], list(zip(*output_lines)))
+
+                    batches = list(t.iterate_examples(argv, batch_size=2))
+                    self.assertEqual([len(examples_batch) for examples_batch in batches],
+                                     [2] * (len(examples) // 2) + [1] * (len(examples) % 2))
+                    self.assertEqual([example for examples_batch in batches for example in examples_batch], examples)
+
+    def test_incremental_transform(self):
+        sentences = ["Закон закон Ncmsi\nе съм Vxitf-r3s\n", "важен важен Amsi\n", "Добре добре Dm\n",
+                     "Днес днес Dt\nвали валя Vpiif-r3s\n", "Да да Ta\n"]
+        edits = [sentences, sentences[:2] + ["Зле зле Dm\n"] + sentences[3:], sentences[1:] + sentences[:1]]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "dataset", "dev.txt")
+            os.makedirs(os.path.dirname(input_path))
+            for i, edit in enumerate(edits):
+                with self.subTest(i=i):
+                    with open(input_path, "w", encoding="utf-8") as input_file:
+                        input_file.write("\n".join(edit) + "\n")
+
+                    argv = ["--input", input_path, "--context_unit", "word", "--context_span", "1"]
+                    incremental_paths = [os.path.join(tmp_dir, "incremental_source"),
+                                         os.path.join(tmp_dir, "incremental_target")]
+                    expected_paths = [os.path.join(tmp_dir, "{}_source".format(i)), os.path.join(tmp_dir, "{}_target".format(i))]
+                    t.main(argv + ["--output"] + incremental_paths + ["--incremental"])
+                    t.main(argv + ["--output"] + expected_paths)
+
+                    for incremental_path, expected_path in zip(incremental_paths, expected_paths):
+                        with open(incremental_path, encoding="utf-8") as incremental_file, \
+                                open(expected_path, encoding="utf-8") as expected_file:
+                            self.assertEqual(incremental_file.read(), expected_file.read())
+
+                    with open(incremental_paths[0] + ".manifest", encoding="utf-8") as manifest_file:
+                        self.assertEqual([line.split()[1:] for line in manifest_file.readlines()[1:]],
+                                         [["0", "2"], ["2", "1"], ["3", "1"], ["4", "2"], ["6", "1"]] if i < 2 else
+                                         [["0", "1"], ["1", "1"], ["2", "2"], ["4", "1"], ["5", "2"]])
+
+    def test_compiled_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "dev.txt")
+            with open(input_path, "w", encoding="utf-8") as input_file:
+                input_file.write("Закон закон Ncmsi\n, , punct\nе съм Vxitf-r3s\n\nважен важен Amsi\n\n")
+
+            dataset_df = read_text_partition(input_path)
+            compile_dataset(dataset_df, input_path + ".npz")
+            compiled_df = load_compiled(input_path + ".npz")
+
+            pd.testing.assert_frame_equal(compiled_df, dataset_df.reset_index(drop=True))
+            self.assertEqual(compiled_df["word"].isnull().tolist(), [False, False, True, False, True])
+            self.assertEqual([sentence_df["word"].tolist() for sentence_df in
+                              t.split_sentences(t.read_dataset(input_path + ".npz", [0, 1, 2], chunk_size=2))],
+                             [["закон", "е"], ["важен"]])
+
+    def test_preprocess_dataset(self):
+        df = pd.DataFrame([["Закон", "закон", "Ncmsi+1"], [",", ",", "punct"], ["Ние", "ние", "Ppe-op1\"x"],
+                           [np.nan, np.nan, np.nan], [np.nan, "x", "Vx"], ["Иван", "Иван", np.nan],
+                           ["(", "(", "H"], ["София", "софия", "Npfsi;x"], ["5", "5", "Mc"]], columns=cols)
+        train_df = preprocess_dataset_for_train(df)
+        # rows with missing values aren't lowercased, sentence boundaries are kept
+        self.assertEqual(train_df.index.tolist(), [0, 2, 3, 5, 7, 8])
+        self.assertEqual(train_df.fillna("").values.tolist(),
+                         [["закон", "закон", "ncmsi"], ["ние", "ние", "ppe-op1"], ["", "", ""], ["Иван", "Иван", ""],
+                          ["софия", "софия", "npfsi"], ["5", "5", "mc"]])
+        self.assertEqual(preprocess_dataset_for_eval(train_df).index.tolist(), [0, 2, 5])
+
+    def test_segment_types(self):
+        df = pd.DataFrame([["закон", "закон", "Ncmsi"], [np.nan, np.nan, np.nan], ["законът", "закон", "Ncmsf"]],
+                          columns=cols)
+        calls = []
+
+        def segment(words):
+            calls.extend(words)
+            return [" ".join(word) for word in words]
+
+        memo = {"закон": "за@@ кон"}
+        t.segment_types(df, ["word", "lemma"], segment, memo)
+        self.assertEqual(calls, ["законът"])
+        self.assertEqual(df.fillna("").values.tolist(), [["за@@ кон", "за@@ кон", "Ncmsi"], ["", "", ""],
+                                                         ["з а к о н ъ т", "за@@ кон", "Ncmsf"]])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            memo_path = os.path.join(tmp_dir, "bpe_codes.memo")
+            t.save_memo(memo_path, "codes", memo)
+            self.assertEqual(t.load_memo(memo_path, "codes"), memo)
+            self.assertEqual(t.load_memo(memo_path, "other codes"), {})
+
+    def test_split_sentence_to_sentence(self):
+        # a word which doesn't fit in a line on its own gets a line of its own
+        self.assertEqual(t.split_points([12, 3, 3, 3, 3, 3], 10), [0, 1, 4])
+        self.assertEqual(t.split_points([3, 3, 3, 3, 3], 13), [0, 4])
+        self.assertEqual(t.balanced_split_points([3, 3, 3, 3, 3], 13), [0, 3])
+        self.assertEqual(t.split_points([3, 3, 3], 10), [0])
+
+        sentence_df = self.make_sentence_df([["и", "и", "R"], ["за@@ кон", "за@@ кон", "N"], ["е", "съм", "V"]], 0)
+        args = t.build_parser().parse_args(["--mode", "sentence_to_sentence", "--sentence_size", "10"])
+        self.assertEqual([(" ".join(source), " ".join(target))
+                          for source, target in t.split_sentence_to_sentence(sentence_df, args)],
+                         [("<w> и <s> за кон </w>", "<w> и + R <s> за кон + N </w>"),
+                          ("<w> е </w>", "<w> съм + V </w>")])
+
+    def test_sorted_output_sink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_path = compressed_path(os.path.join(tmp_dir, "source"), "gzip")
+            target_path = compressed_path(os.path.join(tmp_dir, "target"), "gzip")
+            with SortedOutputSink(source_path, target_path, compression="gzip", bucket_width=2) as sink:
+                sink.write(["<w> а б в г </w>", "<w> а </w>"], ["1", "2"])
+                sink.write(["<w> а б </w>", "<w> а б в </w>"], ["3", "4"])
+
+            with open_text(source_path) as source_file, open_text(target_path) as target_file:
+                self.assertEqual(target_file.read(), "2\n3\n4\n1\n")
+                with open(os.path.join(tmp_dir, "source.order")) as order_file:
+                    self.assertEqual(restore_order(source_file, order_file).read(),
+                                     "<w> а б в г </w>\n<w> а </w>\n<w> а б </w>\n<w> а б в </w>\n")
+
+    def test_join_predictions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ground_path = os.path.join(tmp_dir, "dev.txt")
+            with open(ground_path, "w", encoding="utf-8") as ground_file:
+                ground_file.write("Закон закон Ncmsi\n, , punct\nе съм Vxitf-r3s\n\nважен важен Amsi\n")
+            ground_words = list(read_ground_words(ground_path, chunk_size=2))
+            self.assertEqual(ground_words, ["закон", "е", "важен"])
+
+            pred_lines = ["<w> з а к о н + n c m s i </w>\n", "<w> </w>\n", "<w> в а ж е н </w>\n"]
+            counts = []
+            self.assertEqual(list(join_predictions(ground_words, pred_lines, "+", counts)),
+                             ["закон закон ncmsi", "е", "важен важен"])
+            self.assertEqual(counts, [3, 3])
+
+            with self.assertRaises(AssertionError):
+                list(join_predictions(ground_words, pred_lines[:2], "+"))
+
+            # nothing is written when the counts don't match
+            for lines, expected in [(pred_lines, "закон закон ncmsi\nе\nважен важен\n"), (pred_lines[:2], "")]:
+                output = StringIO()
+                try:
+                    write_when_complete(join_predictions(ground_words, lines, "+"), output)
+                except AssertionError:
+                    pass
+                self.assertEqual(output.getvalue(), expected)
+
+    def test_realign_sentence_to_sentence(self):
+        ground_lines = ["<w> з а к о н <s> е </w>\n", "<w> в а ж е н </w>\n"]
+        pred_lines = ["<w> з а к о н + n </w>\n", "<w> в а ж е н + a <s> е + v </w>\n"]
+        counts = []
+        self.assertEqual(list(realign_sentence_to_sentence(ground_lines, pred_lines, "<s>", counts)),
+                         [("<w> з а к о н", "<w> з а к о н + n </w>"), ("е </w>", ""),
+                          ("<w> в а ж е н </w>", "<w> в а ж е н + a")])
+        self.assertEqual(counts, [2, 2])
+        with self.assertRaises(AssertionError):
+            list(realign_sentence_to_sentence(ground_lines, pred_lines[:1], "<s>"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sorted_path = os.path.join(tmp_dir, "dev_source")
+            with open(sorted_path, "w", encoding="utf-8") as sorted_file:
+                sorted_file.write("<w> е </w>\n<w> в а ж е н </w>\n<w> з а к о н </w>\n")
+            offsets = line_offsets(sorted_path)
+            self.assertEqual(offsets.tolist(), [0, 12, 36])
+            self.assertTrue(os.path.isfile(sorted_path + ".offsets.npy"))
+            self.assertEqual(list(read_lines_in_order(sorted_path, [2, 1, 0], line_offsets(sorted_path))),
+                             ["<w> з а к о н </w>\n", "<w> в а ж е н </w>\n", "<w> е </w>\n"])
+
+    def test_dictionaries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_path = os.path.join(tmp_dir, "training_source")
+            target_path = os.path.join(tmp_dir, "training_target")
+            with OutputSink(source_path, target_path, mode='w', dictionaries=True) as sink:
+                sink.write(["<w> б <lc> а <rc> </w>", "<w> а <lc> <rc> б </w>"], ["<w> б + N </w>", "<w> а + N </w>"])
+
+            with open(source_path + ".json", encoding="utf-8") as dictionary_file:
+                source_dictionary = json.load(dictionary_file, object_pairs_hook=OrderedDict)
+            self.assertEqual(list(source_dictionary.values()), list(range(len(source_dictionary))))
+            self.assertEqual(list(source_dictionary)[:2], ["eos", "UNK"])
+            self.assertEqual(sorted(source_dictionary), sorted(["eos", "UNK", "<w>", "</w>", "<lc>", "<rc>", "а", "б"]))
+            self.assertTrue(os.path.isfile(target_path + ".json"))
+
     def test_main(self):
             for i, args in enumerate(args_run):
                 saved_stdout = sys.stdout
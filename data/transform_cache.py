@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+""" transform_cache.py: content-addressed cache of transformed partitions shared across jobs """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import shutil
+import hashlib
+
+from data.file_io import link_file
+
+# arguments of transform_ud which don't change the content of the transformed files
+IGNORED_ARGUMENTS = {'input', 'output', 'transform_appendix', 'debug', 'overwrite', 'print_file', 'buffer_size',
+                     'streaming', 'workers', 'shard_size', 'chunk_size', 'bpe_codes_path', 'bpe_memo', 'cache_dir'}
+
+
+def file_digest(path, digest=None):
+    """
+    Hashes the content of a file
+    :param path:
+    :param digest: hashlib object to update (a new sha1 object if None)
+    :return: hashlib object
+    """
+    if digest is None:
+        digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+
+def arguments_digest(args, digest=None):
+    """
+    Hashes the arguments of a transformation that change the content of the transformed files
+    :param args: parsed arguments of transform_ud
+    :param digest: hashlib object to update (a new sha1 object if None)
+    :return: hashlib object
+    """
+    if digest is None:
+        digest = hashlib.sha1()
+    effective_args = sorted((name, value) for name, value in vars(args).items() if name not in IGNORED_ARGUMENTS)
+    digest.update(repr(effective_args).encode('utf-8'))
+    return digest
+
+
+def cache_key(args, bpe_codes_file_path=None):
+    """
+    Computes the key of a transformation from the content of its input and its effective arguments
+    :param args: parsed arguments of transform_ud (with a file path as input)
+    :param bpe_codes_file_path: BPE codes the transformation reads, if any
+    :return: hex digest
+    """
+    digest = arguments_digest(args, file_digest(args.input))
+    if bpe_codes_file_path is not None:
+        file_digest(bpe_codes_file_path, digest)
+    return digest.hexdigest()
+
+
+def restore(cache_path, artifact_paths):
+    """
+    Links the cached artifacts of a transformation to their output paths
+    :param cache_path: directory of the cache entry
+    :param artifact_paths: dictionary of artifact name (e.g. source, target, bpe_codes) and output path
+    :return: True on a cache hit, False otherwise
+    """
+    if not os.path.isdir(cache_path):
+        return False
+
+    for name, path in artifact_paths.items():
+        link_file(os.path.join(cache_path, name), path)
+    return True
+
+
+def store(cache_path, artifact_paths):
+    """
+    Adds the artifacts of a transformation to the cache. The entry only becomes visible once it is complete, so jobs
+    running concurrently never read a partial one.
+    :param cache_path: directory of the cache entry
+    :param artifact_paths: dictionary of artifact name (e.g. source, target, bpe_codes) and output path
+    :return:
+    """
+    partial_cache_path = "{}.{}.partial".format(cache_path, os.getpid())
+    os.makedirs(partial_cache_path, exist_ok=True)
+    for name, path in artifact_paths.items():
+        # a copy is made if the output is on another file system (e.g. a job's TMPDIR), which may be deleted
+        link_file(path, os.path.join(partial_cache_path, name), symlink=False)
+
+    try:
+        os.rename(partial_cache_path, cache_path)
+    except OSError:
+        # another job stored the same entry in the meantime
+        shutil.rmtree(partial_cache_path)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+""" transform_manifest.py: records which output lines every sentence of a transformation produced, so that an edited
+partition can be transformed again by reusing the lines of its unchanged sentences """
+__author__ = "Bogomil Gospodinov"
+__email__ = "s1312650@sms.ed.ac.uk"
+__status__ = "dev"
+
+import os
+import hashlib
+
+from data.file_io import open_text
+
+
+def sentence_digest(sentence_df):
+    """
+    :param sentence_df: sentence dataframe (columns: word, lemma, tag, in that order)
+    :return: hex digest of the content of the sentence
+    """
+    rows = "\n".join("\t".join(map(str, row)) for row in sentence_df.values.tolist())
+    return hashlib.sha1(rows.encode('utf-8')).hexdigest()
+
+
+def window_signatures(digests, context_span):
+    """
+    Computes the signature of every sentence from the sentences its output depends on, i.e. those it draws context
+    from (the same windows as transform_ud.transform_document) and its position among them
+    :param digests: sentence digests in document order
+    :param context_span: maximum number of sentences on each side of a sentence to draw context from
+    :return: list of hex digests, sentences with the same signature produce the same lines
+    """
+    signatures = []
+    for sentence_idx in range(len(digests)):
+        window_start = max(sentence_idx - context_span, 0)
+        # the last sentence of the document is never used as right-hand side context
+        window_end = max(min(sentence_idx + 1 + context_span, len(digests) - 1), sentence_idx + 1)
+        window = "{} {}".format(sentence_idx - window_start, " ".join(digests[window_start:window_end]))
+        signatures.append(hashlib.sha1(window.encode('utf-8')).hexdigest())
+    return signatures
+
+
+def load_manifest(path, key):
+    """
+    :param path:
+    :param key: identifies the arguments of the transformation, manifests of other transformations are ignored
+    :return: list of tuple(sentence digest, first output line, number of output lines), None if there is no manifest
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as manifest_file:
+        if manifest_file.readline().rstrip('\n') != key:
+            return None
+        entries = []
+        for line in manifest_file:
+            digest, start, count = line.split()
+            entries.append((digest, int(start), int(count)))
+        return entries
+
+
+def save_manifest(path, key, entries):
+    """
+    :param path:
+    :param key: identifies the arguments of the transformation
+    :param entries: list of tuple(sentence digest, first output line, number of output lines) in document order
+    :return:
+    """
+    partial_path = "{}.{}.partial".format(path, os.getpid())
+    with open(partial_path, 'w', encoding='utf-8') as manifest_file:
+        manifest_file.write(key + '\n')
+        manifest_file.writelines("{} {} {}\n".format(*entry) for entry in entries)
+    os.replace(partial_path, path)
+
+
+class LineReader(object):
+    """
+    Reads ranges of lines of an (optionally compressed) text file. Ranges are read by streaming through the file,
+    which is only opened again when a range starts before the previous one.
+    """
+    def __init__(self, path, compression='infer'):
+        """
+        :param path:
+        :param compression: None, 'gzip', 'zstd' or 'infer' (from the file suffix)
+        """
+        self.path = path
+        self.compression = compression
+        self.file = None
+        self.position = 0
+
+    def read(self, start, count):
+        """
+        :param start: index of the first line
+        :param count: number of lines
+        :return: list of lines without newlines
+        """
+        if self.file is None or start < self.position:
+            self.close()
+            self.file = open_text(self.path, compression=self.compression)
+            self.position = 0
+        for _ in range(start - self.position):
+            self.file.readline()
+        lines = [self.file.readline().rstrip('\n') for _ in range(count)]
+        self.position = start + count
+        return lines
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
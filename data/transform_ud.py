@@ -7,14 +7,23 @@ __status__ = "dev"
 
 import sys
 import os
+import argparse
 import pandas as pd
+import numpy as np
 import re
 import logging
-from itertools import accumulate
-from bisect import bisect
+from io import StringIO
+from itertools import accumulate, islice
+from bisect import bisect, bisect_left
+from array import array
+from collections import deque
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from config import config
 from data.preprocess_ud import preprocess_dataset_for_train
+from data.compile_ud import is_compiled, load_compiled
+from data.transform_cache import cache_key, restore, store, file_digest, arguments_digest
+from data.transform_manifest import sentence_digest, window_signatures, load_manifest, save_manifest, LineReader
+from data.file_io import OutputSink, SortedOutputSink, order_path, dictionary_path, compact_path, manifest_path, compressed_path, COMPRESSION_SUFFIXES, DEFAULT_BUFFER_SIZE
 defaults = config["TRANSFORM"]["DEFAULTS"]
 cols = list(config["DATASET"]["COLUMNS"].values())
 
@@ -65,23 +74,71 @@ class Transformer(object):
         # merges the sentence to be processed with its left and right context sentences (if any)
         sentence_with_context_df = pd.concat([lc_df, sentence_df, rc_df], copy=False)
 
-        # check if subword units are present in the sentence and update flag accordingly
-        self.subword_mode_flag = sentence_with_context_df["word"].str.contains(self.subword_separator).any()
+        words = sentence_with_context_df["word"].tolist()
+        lemmas = sentence_with_context_df["lemma"].tolist()
+        tags = sentence_with_context_df["tag"].tolist()
 
         # remember the bounds of the sentence we want to process so that we are able to distinguish it from the
         # additional context
-        sentence_start_idx = sentence_df.index[0]
-        sentence_end_idx = sentence_df.index[-1]
+        sentence_start_pos = lc_df.shape[0]
+        sentence_end_pos = sentence_start_pos + sentence_df.shape[0]
+
+        return self.process_span(words, lemmas, tags, self.index_document(words), sentence_start_pos, sentence_end_pos)
+
+    def index_document(self, words):
+        """
+        Flattens all words of a document (or of a sentence with its context) into unit indices for left- and
+        right-hand side context, so that the context of every word is a slice of them.
+        :param words: list of (possibly subword-separated) words
+        :return: tuple(left_unit_index, right_unit_index)
+        """
+        # check if subword units are present in the document and update flag accordingly
+        self.subword_mode_flag = any(re.search(self.subword_separator, word) for word in words)
+
+        return self.index_units(words), self.index_units(words[::-1], reverse=True)
+
+    def examples(self, sentence_dfs, context_span=defaults["CONTEXT_SPAN"], batch_size=None):
+        """
+        Transforms a stream of sentences into examples on demand, without writing them to files
+        :param sentence_dfs: iterable of sentence dataframes in document order (e.g. split_sentences(read_dataset(...)))
+        :param context_span: maximum number of sentences on each side of a sentence to draw context from
+        :param batch_size: if set, examples are yielded in lists of that many examples (the last one may be shorter)
+        :return: generator of tuple(source_units, target_units) (or of lists of them if batch_size is set)
+        """
+        examples = (example for output_units in transform_stream(self, sentence_dfs, context_span, join=False)
+                    for example in zip(*output_units))
+        return batch(examples, batch_size) if batch_size else examples
+
+    def process_span(self, words, lemmas, tags, unit_indices, word_start, word_end, span_start=0, span_end=None,
+                     join=True):
+        """
+        Transforms the words at positions [word_start, word_end) of a document into lines, each surrounded by its context.
+        Context is drawn only from the words at positions [span_start, span_end).
+        :param words: list of (possibly subword-separated) words of the document
+        :param lemmas: list of lemmas of the document
+        :param tags: list of tags of the document
+        :param unit_indices: output of index_document for the words of the document
+        :param word_start: position of the first word to transform
+        :param word_end: position after the last word to transform
+        :param span_start: position of the first word available as context
+        :param span_end: position after the last word available as context (defaults to the end of the document)
+        :param join: whether to join the units of every line with spaces
+        :return: tuple(output_source_lines, output_target_lines), lines are lists of units if join is False
+        """
+        left_units, right_units = unit_indices
+
+        if span_end is None:
+            span_end = len(words)
 
         source_lines = []
         target_lines = []
 
         # this section calculated the source and target lines for each word in the sentence
-        for index, row in sentence_with_context_df.loc[sentence_start_idx:sentence_end_idx + 1].iterrows():
+        for pos in range(word_start, word_end):
             # we want to ignore subword separation for the word for which we calculate context
             # because it is always represent either wholly or on character-level
-            wordform_clean = row["word"].replace(self.subword_separator + " ", "")
-            lemma_clean = row["lemma"].replace(self.subword_separator + " ", "")
+            wordform_clean = words[pos].replace(self.subword_separator + " ", "")
+            lemma_clean = lemmas[pos].replace(self.subword_separator + " ", "")
 
             source_line = []
 
@@ -89,16 +146,15 @@ class Transformer(object):
                 source_line.append(self.example_boundary)
 
             # computes left-hand side context
-            lhs_df = sentence_with_context_df.loc[:index - 1]
-            left_context = self.compute_context(lhs_df)
+            left_context = self.slice_context(left_units, pos, span_start)
 
             # adds tags to lhs if necessary
             # TODO: support for tag_first in context_tags
             if self.context_tags == "left" and left_context:
                 start = 0
-                tag_idx = lhs_df.shape[0] - 1
-                while start < len(left_context) and tag_idx >= 0:
-                    tag_el = sentence_with_context_df.iat[tag_idx, 2]
+                tag_idx = pos - 1
+                while start < len(left_context) and tag_idx >= span_start:
+                    tag_el = tags[tag_idx]
                     if self.tag_unit == "word":
                         tag_el = [tag_el]
                     elif self.tag_unit == "char":
@@ -124,26 +180,13 @@ class Transformer(object):
             source_line.append(self.right_context_boundary)
 
             # computes right-hand side context
-            # we have to revert the input and output in order to use the same function for both contexts
-            rhs_sentence = sentence_with_context_df.loc[:index + 1:-1]
-
-            # special preprocessing when breaking up words into subwords
-            if self.subword_mode_flag:
-                rhs_sentence = rhs_sentence.applymap(lambda x: x[::-1] if type(x) is str else x)
-
-            right_context = self.compute_context(rhs_sentence)[::-1]
-
-            # special postprocessing when breaking up words into subwords
-            if self.subword_mode_flag:
-                right_context_buffer = [w[::-1] if w is not self.word_boundary else w for w in right_context]
-                right_context = right_context_buffer
-
-            source_line.extend(right_context)
+            # the right-hand side is indexed from the end of the document, so it comes out reversed
+            source_line.extend(self.slice_context(right_units, len(words) - 1 - pos, len(words) - span_end)[::-1])
 
             if self.example_boundary is not None:
                 source_line.append(self.close_tag)
 
-            source_lines.append(" ".join(source_line))
+            source_lines.append(" ".join(source_line) if join else source_line)
 
             # computes target line
             target_line = []
@@ -152,7 +195,7 @@ class Transformer(object):
                 target_line.append(self.example_boundary)
 
             target_lemma = lemma_clean
-            target_tag = row["tag"]
+            target_tag = tags[pos]
 
             if self.tag_first:
                 if self.tag_unit == 'word':
@@ -178,13 +221,92 @@ class Transformer(object):
             if self.example_boundary is not None:
                 target_line.append(self.close_tag)
 
-            target_lines.append(" ".join(target_line))
+            target_lines.append(" ".join(target_line) if join else target_line)
 
         return source_lines, target_lines
 
+    def index_units(self, words, reverse=False):
+        """
+        Flattens words into interned context units with a word boundary after every word, together with the offsets
+        of the words and prefix sums over the units. The context preceding the i-th word is a suffix of
+        units[:word_offsets[i]], and the context size constraints are resolved on it with a bisect on the prefix sums.
+        The index is meant to be built once per document and shared by all of its words.
+        :param words: list of (possibly subword-separated) words in reading order of the context
+        :param reverse: whether the words are read back to front (i.e. for right-hand side context)
+        :return: tuple(units, boundaries, word_offsets, char_lengths, unit_counts)
+        """
+        units = []
+        boundaries = bytearray()
+        word_offsets = array('l')
+        # char_lengths[k] and unit_counts[k] are the number of characters and non-boundary units in units[:k]
+        char_lengths = array('l', [0])
+        unit_counts = array('l', [0])
+        split_pattern = re.compile(r"\s*{}\s*".format(self.subword_separator))
+        char_length = 0
+        unit_count = 0
+
+        for word in words:
+            word_offsets.append(len(units))
+
+            if reverse and self.subword_mode_flag:
+                # in subword mode, right-hand side words are split back to front and their units are reversed again
+                # afterwards, so they are compared to the word boundary while reversed
+                seen_subwords = split_pattern.split(word[::-1])
+                subwords = [subword[::-1] for subword in seen_subwords]
+            else:
+                seen_subwords = subwords = split_pattern.split(word)
+
+            for seen_subword, subword in zip(seen_subwords, subwords):
+                char_length += len(subword)
+                unit_count += seen_subword != self.word_boundary
+                char_lengths.append(char_length)
+                unit_counts.append(unit_count)
+                units.append(sys.intern(subword))
+                boundaries.append(False)
+
+            char_lengths.append(char_length)
+            unit_counts.append(unit_count)
+            units.append(self.word_boundary)
+            boundaries.append(True)
+
+        word_offsets.append(len(units))
+        return units, boundaries, word_offsets, char_lengths, unit_counts
+
+    def slice_context(self, unit_index, word_idx, span_start=0):
+        """
+        Computes context for a word from a unit index. Equivalent to calling compute_context on the words between
+        span_start and the word.
+        :param unit_index: output of index_units
+        :param word_idx: position of the word in the index
+        :param span_start: position of the first word that may be part of the context
+        :return: a list of context units
+        """
+        units, boundaries, word_offsets, char_lengths, unit_counts = unit_index
+        lo = word_offsets[span_start]
+        end = word_offsets[word_idx]
+
+        if self.context_char_size is not None:
+            # the longest suffix of units whose characters fit into the desired number of characters
+            start = bisect_left(char_lengths, char_lengths[end] - self.context_char_size, lo, end)
+        else:
+            # the shortest suffix of units holding the desired number of units (or everything if there are not enough)
+            target_count = unit_counts[end] - self.context_size
+            start = bisect(unit_counts, target_count, lo, end) - 1
+            if start < lo or unit_counts[start] != target_count:
+                start = lo
+
+        # trims extraneous word boundary symbols from the output
+        if start < end and boundaries[end - 1]:
+            end -= 1
+        if start < end and boundaries[start]:
+            start += 1
+
+        return units[start:end]
+
     def compute_context(self, context_df):
         """
-        Computes context for a word based on constraints.
+        Computes context for a word based on constraints. Reference implementation of index_units/slice_context,
+        which process_sentence uses instead because it avoids recomputing the context of every word from scratch.
         :param context_df: dataframe representing left- or right-hand side of a sentence right before or after a
         word for which we want to compute context
         :return: a list of context units
@@ -229,11 +351,310 @@ class Transformer(object):
         return context_units
 
 
-def main(argv):
-    import argparse
-    from io import StringIO
+def read_dataset(input, usecols, chunk_size=None):
+    """
+    Reads and preprocesses a dataset partition, keeping the blank rows that separate its sentences.
+    :param input: file path or stream of the partition (or path of a partition compiled by compile_ud)
+    :param usecols: indices of the word, lemma and tag columns in the partition
+    :param chunk_size: if set, the partition is streamed in chunks of that many rows instead of being read at once
+    :return: generator of preprocessed dataframes (columns: word, lemma, tag)
+    """
+    if is_compiled(input):
+        # already preprocessed
+        dataset_df = load_compiled(input)
+        for start in range(0, dataset_df.shape[0], chunk_size or max(dataset_df.shape[0], 1)):
+            yield dataset_df.iloc[start:start + chunk_size if chunk_size else None].reset_index(drop=True)
+        return
+
+    if chunk_size is None:
+        yield preprocess_dataset_for_train(read_chunk(input, usecols)).reset_index(drop=True)
+        return
+
+    # chunks are cut on lines rather than by pandas, which fails on a chunk made only of blank lines
+    input_file = open(input, encoding='utf-8') if isinstance(input, str) else input
+    try:
+        while True:
+            lines = list(islice(input_file, chunk_size))
+            if not lines:
+                break
+            if any(line.split('#', 1)[0].strip() for line in lines):
+                chunk_df = read_chunk(StringIO("".join(lines)), usecols)
+            else:
+                # blank lines are sentence boundaries, lines holding only a comment are dropped as pandas drops them
+                chunk_df = pd.DataFrame(np.nan, index=range(sum(not line.strip() for line in lines)), columns=cols,
+                                        dtype=object)
+            yield preprocess_dataset_for_train(chunk_df).reset_index(drop=True)
+    finally:
+        if input_file is not input:
+            input_file.close()
+
+
+def read_chunk(input, usecols):
+    """
+    :param input: file path or stream of (a chunk of) a dataset partition
+    :param usecols: indices of the word, lemma and tag columns in the partition
+    :return: dataframe (columns: word, lemma, tag) with an all NaN row for every blank line
+    """
+    # every value is read as a string, so that a chunk holding only numerals doesn't turn 19.30 into 19.3
+    return pd.read_csv(input, sep='\s+', names=cols, usecols=usecols, skip_blank_lines=False, comment='#',
+                       quoting=3, dtype=str)[cols]
+
+
+def split_sentences(chunk_dfs):
+    """
+    Splits a stream of dataset chunks into sentences. Sentences may span several chunks. Rows after the last
+    blank row are not part of any complete sentence and are dropped.
+    :param chunk_dfs: iterable of preprocessed dataframes, where blank rows (all NaN) end sentences
+    :return: generator of sentence dataframes (possibly empty, if blank rows follow each other)
+    """
+    pending_df = None
+
+    for chunk_df in chunk_dfs:
+        if pending_df is not None and not pending_df.empty:
+            chunk_df = pd.concat([pending_df, chunk_df], ignore_index=True)
+
+        sentence_start = 0
+        for sentence_end in chunk_df.index[pd.isna(chunk_df).all(axis=1)]:
+            yield chunk_df.iloc[sentence_start:sentence_end]
+            sentence_start = sentence_end + 1
 
-    # argument parsing
+        pending_df = chunk_df.iloc[sentence_start:]
+
+
+def transform_document(transformer, sentence_dfs, context_span, first=0, last=None, document_end=True):
+    """
+    Transforms all sentences of a document (or of a shard of it), indexing the units of the whole document once.
+    :param transformer: Transformer instance
+    :param sentence_dfs: list of sentence dataframes in document order
+    :param context_span: maximum number of sentences on each side of a sentence to draw context from
+    :param first: index of the first sentence to transform, the sentences before it only serve as context
+    :param last: index after the last sentence to transform, the sentences after it only serve as context
+    :param document_end: whether the last of sentence_dfs is the last sentence of the document
+    :return: generator of tuple(output_source_lines, output_target_lines), one per transformed sentence
+    """
+    if last is None:
+        last = len(sentence_dfs)
+
+    document_df = pd.concat(sentence_dfs) if sentence_dfs else pd.DataFrame(columns=cols)
+    words = document_df["word"].tolist()
+    lemmas = document_df["lemma"].tolist()
+    tags = document_df["tag"].tolist()
+
+    # the k-th sentence spans document positions [sentence_bounds[k], sentence_bounds[k + 1])
+    sentence_bounds = [0] + list(accumulate(sentence_df.shape[0] for sentence_df in sentence_dfs))
+
+    # units are indexed once for the whole document and shared by the contexts of all words
+    unit_indices = transformer.index_document(words)
+
+    # the last sentence of the document is never used as right-hand side context
+    context_end = len(sentence_dfs) - 1 if document_end else len(sentence_dfs)
+
+    for sentence_idx in range(first, last):
+        # adds additional context according to CONTEXT_SPAN
+        span_start = sentence_bounds[max(sentence_idx - context_span, 0)]
+        span_end = sentence_bounds[max(min(sentence_idx + 1 + context_span, context_end), sentence_idx + 1)]
+
+        yield transformer.process_span(words, lemmas, tags, unit_indices, sentence_bounds[sentence_idx],
+                                       sentence_bounds[sentence_idx + 1], span_start, span_end)
+
+
+def transform_stream(transformer, sentence_dfs, context_span, join=True):
+    """
+    Transforms a stream of sentences, keeping only a ring buffer of context_span sentences on the left and
+    context_span + 1 sentences on the right of the sentence being transformed. Output is identical to that of
+    transform_document.
+    :param transformer: Transformer instance
+    :param sentence_dfs: iterable of sentence dataframes in document order
+    :param context_span: maximum number of sentences on each side of a sentence to draw context from
+    :param join: whether to join the units of every line with spaces (see Transformer.process_span)
+    :return: generator of tuple(output_source_lines, output_target_lines), one per sentence
+    """
+    window = deque()
+    # position of the next sentence to transform in the window
+    current = 0
+
+    def transform_current(exhausted):
+        # the sentence after the right-hand side context must already be in the window unless the stream is exhausted,
+        # because the last sentence of the document is never used as context
+        rc_end = min(current + 1 + context_span, len(window) - 1) if exhausted else current + 1 + context_span
+        span = list(islice(window, 0, max(rc_end, current + 1)))
+        words = [word for sentence in span for word in sentence[0]]
+        lemmas = [lemma for sentence in span for lemma in sentence[1]]
+        tags = [tag for sentence in span for tag in sentence[2]]
+        word_start = sum(len(sentence[0]) for sentence in span[:current])
+        word_end = word_start + len(span[current][0])
+        return transformer.process_span(words, lemmas, tags, transformer.index_document(words), word_start, word_end,
+                                        join=join)
+
+    def advance():
+        # drops the leftmost sentence once it is out of the context span of the next sentence to transform
+        if current < context_span:
+            return current + 1
+        window.popleft()
+        return current
+
+    for sentence_df in sentence_dfs:
+        window.append((sentence_df["word"].tolist(), sentence_df["lemma"].tolist(), sentence_df["tag"].tolist()))
+
+        if len(window) > current + 1 + context_span:
+            yield transform_current(exhausted=False)
+            current = advance()
+
+    while current < len(window):
+        yield transform_current(exhausted=True)
+        current = advance()
+
+
+def batch(iterable, batch_size):
+    """
+    :param iterable:
+    :param batch_size: number of items per batch
+    :return: generator of lists of batch_size items (the last one may be shorter)
+    """
+    iterator = iter(iterable)
+    while True:
+        items = list(islice(iterator, batch_size))
+        if not items:
+            return
+        yield items
+
+
+def shard_sentences(sentence_dfs, context_span, shard_size):
+    """
+    Splits a stream of sentences into contiguous shards that can be transformed independently. Every shard carries
+    up to context_span halo sentences on each side, which are only used as context.
+    :param sentence_dfs: iterable of sentence dataframes in document order
+    :param context_span: maximum number of sentences on each side of a sentence to draw context from
+    :param shard_size: number of sentences to transform per shard
+    :return: generator of tuple(shard_sentence_dfs, first, last, document_end) (see transform_document)
+    """
+    buffer = []
+    # number of left halo sentences in the buffer
+    first = 0
+
+    for sentence_df in sentence_dfs:
+        buffer.append(sentence_df)
+
+        # a sentence after the right halo proves that the shard does not end the document
+        if len(buffer) > first + shard_size + context_span:
+            yield buffer[:first + shard_size + context_span], first, first + shard_size, False
+            drop = max(first + shard_size - context_span, 0)
+            buffer = buffer[drop:]
+            first = first + shard_size - drop
+
+    if len(buffer) > first:
+        yield buffer, first, len(buffer), True
+
+
+def transform_shard(shard):
+    """
+    Transforms a shard of sentences in a worker process
+    :param shard: tuple(transformer, context_span, shard_sentence_dfs, first, last, document_end)
+    :return: list of tuple(output_source_lines, output_target_lines), one per transformed sentence
+    """
+    transformer, context_span, sentence_dfs, first, last, document_end = shard
+    return list(transform_document(transformer, sentence_dfs, context_span, first, last, document_end))
+
+
+def split_points(lengths, sentence_size):
+    """
+    Chooses the words that start a new line, splitting a line only when the next word doesn't fit in it
+    :param lengths: number of target units of every word of a sentence
+    :param sentence_size: maximum number of target units of a line (including its opening tag)
+    :return: list of indices of the first words of lines
+    """
+    starts = [0]
+    size = 1
+    for i, length in enumerate(lengths):
+        size += length
+        # a word which doesn't fit in a line on its own gets a line of its own
+        if size > sentence_size and i > starts[-1]:
+            starts.append(i)
+            size = 1 + length
+    return starts
+
+
+def balanced_split_points(lengths, sentence_size):
+    """
+    Chooses the words that start a new line, so that a sentence is split into as few lines as with split_points
+    but the longest of them is as short as possible
+    :param lengths: number of target units of every word of a sentence
+    :param sentence_size: maximum number of target units of a line (including its opening tag)
+    :return: list of indices of the first words of lines
+    """
+    num_lines = len(split_points(lengths, sentence_size))
+    low, high = 1, sentence_size
+    # the number of lines only grows as the maximum size shrinks
+    while low < high:
+        size = (low + high) // 2
+        if len(split_points(lengths, size)) <= num_lines:
+            high = size
+        else:
+            low = size + 1
+    return split_points(lengths, low)
+
+
+def split_sentence_to_sentence(sentence_df, args):
+    """
+    Transforms a sentence into source and target lines of whole sentences, split into several lines if the target
+    sentence is longer than args.sentence_size.
+    :param sentence_df: Input sentence dataframe, each row is a word (columns: word, lemma, tag)
+    :param args: parsed arguments of main
+    :return: list of tuple(output_source_line_split, output_target_line_split)
+    """
+    pos_close_tag = args.example_boundary.find('<') + 1
+    open_tag = args.example_boundary
+    close_tag = open_tag[:pos_close_tag] + '/' + open_tag[pos_close_tag:]
+    subword_separator = re.compile(r"\s*{}\s*".format(re.escape(args.subword_separator)))
+
+    # units of every word, ending with a word boundary
+    source_words = []
+    target_words = []
+
+    for word, lemma, tag in zip(sentence_df["word"].tolist(), sentence_df["lemma"].tolist(), sentence_df["tag"].tolist()):
+        source_words.append(subword_separator.split(word) + [args.word_boundary])
+
+        lemma = subword_separator.split(lemma)
+        tag = [tag] if args.tag_unit == "word" else list(tag)
+
+        if args.tag_first:
+            target_words.append(tag + [args.tag_boundary] + lemma + [args.word_boundary])
+        else:
+            target_words.append(lemma + [args.tag_boundary] + tag + [args.word_boundary])
+
+    # if the target translation overflows (target sentence is guaranteed to be longer in size)
+    # sanity check: awk 'NF > 50 { print NR, NF }' dev_source | wc -l
+    if hasattr(args, 'sentence_size'):
+        lengths = [len(target_word) for target_word in target_words]
+        if args.sentence_split == 'balanced':
+            starts = balanced_split_points(lengths, args.sentence_size)
+        else:
+            starts = split_points(lengths, args.sentence_size)
+    else:
+        starts = [0]
+
+    output_splits = []
+
+    for start, end in zip(starts, starts[1:] + [len(target_words)]):
+        output_source_line_split = [open_tag]
+        output_target_line_split = [open_tag]
+        for source_word, target_word in zip(source_words[start:end], target_words[start:end]):
+            output_source_line_split.extend(source_word)
+            output_target_line_split.extend(target_word)
+
+        # the closing tag replaces the boundary of the last word
+        if end > start:
+            output_source_line_split.pop()
+            output_target_line_split.pop()
+        output_source_line_split.append(close_tag)
+        output_target_line_split.append(close_tag)
+
+        output_splits.append((output_source_line_split, output_target_line_split))
+
+    return output_splits
+
+
+def build_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description="adapts an UD dataset to context-sensitive lemmatization")
@@ -252,6 +673,38 @@ def main(argv):
     io_group.add_argument('--debug', dest='debug', help="debug mode prints target/source file to stdout"
                                                         " instead of writing to the file system", action='store_true')
     io_group.add_argument('--overwrite', dest='overwrite', action='store_true')
+    io_group.add_argument("--compression", help="compression of the output files (default: %(default)s)",
+                          choices=list(COMPRESSION_SUFFIXES), type=str, default=None)
+    io_group.add_argument("--buffer_size", help="size in bytes of the output buffers, which are flushed whenever they are "
+                                                "full (default: %(default)s)", type=int, default=DEFAULT_BUFFER_SIZE)
+    io_group.add_argument('--streaming', dest='streaming', help="read the input in chunks and transform it sentence by "
+                                                                "sentence instead of loading it at once", action='store_true')
+    io_group.add_argument("--workers", help="number of processes that transform shards of sentences in parallel "
+                                            "(only in word_and_context mode, default: %(default)s)", type=int, default=1)
+    io_group.add_argument("--shard_size", help="number of sentences per shard when using several workers "
+                                               "(default: %(default)s)", type=int, default=500)
+    io_group.add_argument("--chunk_size", help="number of rows to read at once in streaming mode (default: %(default)s)",
+                          type=int, default=100000)
+    io_group.add_argument('--sort_by_length', dest='sort_by_length', action='store_true',
+                          help="write the examples ordered by their number of source units (and the original position "
+                               "of every example to [source file].order, which postprocess_nematus --order restores)")
+    io_group.add_argument("--length_bucket_width", help="examples whose lengths fall in the same bucket of that many units "
+                                                        "keep their original order (default: %(default)s)",
+                          type=int, default=1)
+    io_group.add_argument('--dictionaries', dest='dictionaries', action='store_true',
+                          help="count the source and target units and write their Nematus dictionaries "
+                               "(e.g. training_source.json) instead of running nematus/data/build_dictionary.py")
+    io_group.add_argument('--compact', dest='compact', action='store_true',
+                          help="write the sentences once with a (sentence, word, window) record per example to "
+                               "[source file].compact.npz instead of the source and target files "
+                               "(only in word_and_context mode, python -m data.compact_ud expands them)")
+    io_group.add_argument('--incremental', dest='incremental', action='store_true',
+                          help="record the digest and the output lines of every sentence in [source file].manifest and "
+                               "only transform again the sentences (and their context span neighbours) that changed "
+                               "since the manifest was written, copying the lines of the others")
+    io_group.add_argument("--cache_dir", help="directory of a cache of transformed partitions keyed by the content of the input "
+                                              "and the arguments, hits are linked to the output instead of being transformed again",
+                          type=str, default=None)
     io_group.add_argument("--print_file", help="which file to output (source/target) in debug mode", choices=['source', 'target'],
                         type=str, default=defaults["PRINT_FILE"])
 
@@ -271,6 +724,9 @@ def main(argv):
                            type=int, default=defaults["CHAR_N_GRAM"])
     repr_group.add_argument("--sentence_size", help="maximum size of sentence in sentence_to_sentence mode",
                            type=int, default=argparse.SUPPRESS)
+    repr_group.add_argument("--sentence_split", help="how to choose where to split sentences longer than --sentence_size: "
+                                                     "greedily or so that the lines are of similar size (default: %(default)s)",
+                            choices=['greedy', 'balanced'], type=str, default='greedy')
     repr_group.add_argument('--tag_first', action='store_true', help="if true tags will be printed before "
                                                                      "words in source and target files")
 
@@ -292,6 +748,9 @@ def main(argv):
     bpe_group.add_argument("--bpe_operations", help="number of BPE merge operations to be learned "
                                                  "(corresponds to number of symbols/char-n-grams/codes)",
                         type=int, default=defaults["BPE_OPERATIONS"])
+    bpe_group.add_argument('--bpe_memo', dest='bpe_memo', action='store_true',
+                           help="persist the segmentation of every type next to the BPE codes (as bpe_codes.memo) "
+                                "and reuse it in later transformations with the same codes")
     bpe_group.add_argument("--bpe_codes_path",
                         help="full file path to export BPE codes to or to read them from if available",
                         type=str, default=None)
@@ -310,8 +769,56 @@ def main(argv):
     boundary_group.add_argument('--subword_separator', type=str, default=defaults["SUBWORD_SEPARATOR"], metavar='STR',
                         help="separator between non-final BPE subword units (default: '%(default)s'))")
 
-    args = parser.parse_args(argv)
+    return parser
 
+
+def transform_folder_path(args):
+    """
+    Builds the path of the transform folder from the name of the input folder and a subset of the arguments
+    :param args: parsed arguments of main (with a file path as input)
+    :return: full path of the transform folder
+    """
+    input_folders = re.split("/+|\\\\+", args.input)
+    if len(input_folders) < 2:
+        raise ValueError("Can't decide how to name the transformation. Use --output to specify path.")
+    input_folder = input_folders[-2]
+
+    transform_folder = "{}_{}_{}{}{}{}{}{}{}{}{}".format(input_folder, "w" + args.word_unit, "t" + args.tag_unit,
+
+                                                   ("_" + (("{:02d}u".format(args.context_size)) if not hasattr(args, 'context_char_size') else (str(args.context_char_size) + "ch")))
+                                                   if args.mode == 'word_and_context' else "",
+
+                                                   ("_" + ("c" + args.context_unit)) if args.mode == "word_and_context" else "",
+
+                                                   "_n{}".format(args.char_n_gram_mode)
+                                                   if ((args.mode == 'word_and_context' and args.context_unit == "char")
+                                                       or (args.mode == 'sentence_to_sentence' and args.word_unit == 'char')) else "",
+
+                                                   "_n{}".format(args.bpe_operations)
+                                                   if ((args.mode == 'word_and_context' and args.context_unit == "bpe")
+                                                       or (args.mode == 'sentence_to_sentence' and args.word_unit == 'bpe')) else "",
+
+                                                   "_ct" if args.context_tags == 'left' else "",
+
+                                                   "_tf" if args.tag_first else "",
+
+                                                   "_cs{}".format(args.context_span) if args.mode == 'word_and_context' else "",
+
+                                                   ".{}".format(args.transform_appendix) if args.transform_appendix else "")
+
+    if args.output is None or not args.output or '' in args.output:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input', args.mode, transform_folder)
+    else:
+        return os.path.join(args.output[0], transform_folder)
+
+
+def resolve_output(args):
+    """
+    Determines the input and the output paths of a transformation (replacing a missing input with stdin), creates
+    the transform folder and truncates the output files if necessary
+    :param args: parsed arguments of main
+    :return: tuple(full_transform_folder_path, output_source_path, output_target_path), None where not applicable
+    """
     # determining input
     if args.input is None:
         if args.output is None:
@@ -323,96 +830,161 @@ def main(argv):
         if len(input_folders) < 2:
             raise ValueError("Can't decide how to name the transformation. Use --output to specify path.")
         else:
-            input_folder = input_folders[-2]
             input_filename = input_folders[-1].split(".")[0]
 
     # determining output
+    full_transform_folder_path = output_source_path = output_target_path = None
+
     if not args.debug:
         if args.output is None or (type(args.output) is list and len(args.output) == 1):
-            transform_folder = "{}_{}_{}{}{}{}{}{}{}{}{}".format(input_folder, "w" + args.word_unit, "t" + args.tag_unit,
-
-                                                           ("_" + (("{:02d}u".format(args.context_size)) if not hasattr(args, 'context_char_size') else (str(args.context_char_size) + "ch")))
-                                                           if args.mode == 'word_and_context' else "",
-
-                                                           ("_" + ("c" + args.context_unit)) if args.mode == "word_and_context" else "",
-
-                                                           "_n{}".format(args.char_n_gram_mode)
-                                                           if ((args.mode == 'word_and_context' and args.context_unit == "char")
-                                                               or (args.mode == 'sentence_to_sentence' and args.word_unit == 'char')) else "",
-
-                                                           "_n{}".format(args.bpe_operations)
-                                                           if ((args.mode == 'word_and_context' and args.context_unit == "bpe")
-                                                               or (args.mode == 'sentence_to_sentence' and args.word_unit == 'bpe')) else "",
-
-                                                           "_ct" if args.context_tags == 'left' else "",
-
-                                                           "_tf" if args.tag_first else "",
-
-                                                           "_cs{}".format(args.context_span) if args.mode == 'word_and_context' else "",
-
-                                                           ".{}".format(args.transform_appendix) if args.transform_appendix else "")
-
-            if args.output is None or not args.output or '' in args.output:
-                full_transform_folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input', args.mode, transform_folder)
-            else:
-                full_transform_folder_path = os.path.join(args.output[0], transform_folder)
+            full_transform_folder_path = transform_folder_path(args)
 
             os.makedirs(full_transform_folder_path, exist_ok=True)
 
-            output_source_path = os.path.join(full_transform_folder_path, '{}_source'.format(input_filename))
-            output_target_path = os.path.join(full_transform_folder_path, '{}_target'.format(input_filename))
+            output_source_path = compressed_path(os.path.join(full_transform_folder_path, '{}_source'.format(input_filename)),
+                                                 args.compression)
+            output_target_path = compressed_path(os.path.join(full_transform_folder_path, '{}_target'.format(input_filename)),
+                                                 args.compression)
 
             print(full_transform_folder_path)
 
-            if not args.overwrite and (os.path.isfile(output_source_path) or os.path.isfile(output_target_path)):
-                raise ValueError("Output files for {} already exist in {}. Pass --overwrite or delete them."
-                                 .format(input_filename, full_transform_folder_path))
+            output_paths = [compact_path(output_source_path)] if args.compact \
+                else [output_source_path, output_target_path]
 
-            # truncate output files or create them anew
-            open(output_source_path, 'w').close()
-            open(output_target_path, 'w').close()
+            # incremental transformations replace the output files once they are done
+            if not args.incremental:
+                if not args.overwrite and any(os.path.isfile(output_path) for output_path in output_paths):
+                    raise ValueError("Output files for {} already exist in {}. Pass --overwrite or delete them."
+                                     .format(input_filename, full_transform_folder_path))
+
+                # create output files anew, without truncating the files they may be linked to
+                for output_path in output_paths:
+                    if os.path.lexists(output_path):
+                        os.remove(output_path)
+                    open(output_path, 'w').close()
         else:
             if len(args.output) != 2:
                 raise ValueError("You must specify full target and source output file paths (including file name).")
-            full_transform_folder_path = None
-            output_source_path = args.output[0]
-            output_target_path = args.output[1]
+            output_source_path = compressed_path(args.output[0], args.compression)
+            output_target_path = compressed_path(args.output[1], args.compression)
 
-    print(args, file=sys.stderr)
+    return full_transform_folder_path, output_source_path, output_target_path
 
-    # loading file
-    infile_df = preprocess_dataset_for_train(pd.read_csv(args.input, sep='\s+', names=cols,
-                                                         usecols=[args.word_column_index, args.lemma_column_index, args.tag_column_index],
-                                                         skip_blank_lines=False, comment='#', quoting=3)[cols])
-    infile_df = infile_df.reset_index(drop=True)
+
+def subword_unit(args):
+    """
+    Determines the subword segmentation a transformation needs
+    :param args: parsed arguments of main
+    :return: 'char', 'bpe' or None
+    """
+    if args.mode == 'word_and_context':
+        unit = args.context_unit
+    else:
+        unit = args.word_unit
+    return unit if unit in ('char', 'bpe') else None
+
+
+def resolve_bpe_codes_path(args, full_transform_folder_path):
+    """
+    :param args: parsed arguments of main
+    :param full_transform_folder_path: transform folder to export BPE codes to (if there is no --bpe_codes_path)
+    :return: path of the BPE codes file
+    """
+    if args.bpe_codes_path:
+        return args.bpe_codes_path
+    elif full_transform_folder_path:
+        return os.path.join(full_transform_folder_path, "bpe_codes")
+    else:
+        raise ValueError("Specify transformation output folder or bpe output file path in order to export BPE codes.")
+
+
+# segmentations of types into char n-grams by n-gram size and separator
+char_n_gram_memos = {}
+
+
+def segment_types(df, columns, segment, memo):
+    """
+    Segments every distinct value of some columns once and maps the segmentations back to their cells
+    :param df: dataframe which is modified in place
+    :param columns: names of the columns to segment
+    :param segment: function that segments a list of strings and returns the list of their segmentations
+    :param memo: dictionary of the segmentations of types, which is updated with new ones
+    :return:
+    """
+    values = df[columns].values
+    codes, types = pd.factorize(values.ravel())
+    new_types = [type for type in types if type not in memo]
+    if new_types:
+        memo.update(zip(new_types, segment(new_types)))
+    # code -1 of missing values points to the NaN at the end
+    segmentations = np.empty(len(types) + 1, dtype=object)
+    segmentations[:-1] = [memo[type] for type in types]
+    segmentations[-1] = np.nan
+    df[columns] = segmentations[codes].reshape(values.shape)
+
+
+def load_memo(memo_path, memo_key):
+    """
+    Loads the segmentations of types persisted by save_memo
+    :param memo_path:
+    :param memo_key: identifies the segmentation (e.g. digest of the BPE codes), memos of other segmentations are ignored
+    :return: dictionary of the segmentations of types
+    """
+    if not os.path.isfile(memo_path):
+        return {}
+    with open(memo_path, encoding='utf-8') as memo_file:
+        if memo_file.readline().rstrip('\n') != memo_key:
+            logging.info("Ignoring {} because it was made with other BPE codes".format(memo_path))
+            return {}
+        return dict(line.rstrip('\n').split('\t', 1) for line in memo_file)
+
+
+def save_memo(memo_path, memo_key, memo):
+    """
+    Persists the segmentations of types, replacing the file at once so concurrent jobs don't read partial memos
+    :param memo_path:
+    :param memo_key: identifies the segmentation (e.g. digest of the BPE codes)
+    :param memo: dictionary of the segmentations of types
+    :return:
+    """
+    partial_memo_path = "{}.{}.partial".format(memo_path, os.getpid())
+    with open(partial_memo_path, "w", encoding='utf-8') as memo_file:
+        memo_file.write(memo_key + '\n')
+        memo_file.writelines("{}\t{}\n".format(type, segmentation) for type, segmentation in memo.items())
+    os.replace(partial_memo_path, memo_path)
+
+
+def build_subword_preprocessor(args, full_transform_folder_path, dataset_df=None):
+    """
+    Prepares the subword segmentation of the word (and lemma) columns of a dataset, learning BPE codes if necessary
+    :param args: parsed arguments of main
+    :param full_transform_folder_path: transform folder to export BPE codes to (if there is no --bpe_codes_path)
+    :param dataset_df: the preprocessed dataset to learn BPE codes from (read from args.input if not given)
+    :return: function that segments a preprocessed dataframe in place and returns it
+    """
+    usecols = [args.word_column_index, args.lemma_column_index, args.tag_column_index]
 
     # subword preprocessing of the input file
-    if (args.mode == 'word_and_context' and args.context_unit == 'char') or (args.mode == 'sentence_to_sentence' and args.word_unit == 'char'):
+    if subword_unit(args) == 'char':
         # uses subword-nmt to segment text into chargrams
         from types import SimpleNamespace
-        import numpy as np
         sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'subword-nmt'))
         from subword_nmt.segment_char_ngrams import segment_char_ngrams
 
-        def segment(col):
+        def segment(types):
             subword_nmt_output = StringIO()
-            segment_char_ngrams(SimpleNamespace(input=infile_df[col].dropna().astype(str), vocab={}, n=args.char_n_gram_mode,
-                                output=subword_nmt_output, separator=args.subword_separator))
-            subword_nmt_output.seek(0)
-            infile_df.loc[infile_df[col].notnull(), [col]] = np.array([line.rstrip(' \t\n\r')
-                                                                             for line in subword_nmt_output])[:, np.newaxis]
-            subword_nmt_output.truncate(0)
-
-        segment("word")
-        if args.mode == 'sentence_to_sentence' and args.word_unit == 'char':
-            segment("lemma")
-    elif (args.mode == 'word_and_context' and args.context_unit == 'bpe') or (args.mode == 'sentence_to_sentence' and args.word_unit == 'bpe'):
-        if args.bpe_codes_path:
-            bpe_codes_file_path = args.bpe_codes_path
-        elif full_transform_folder_path:
-            bpe_codes_file_path = os.path.join(full_transform_folder_path, "bpe_codes")
-        else:
-            raise ValueError("Specify transformation output folder or bpe output file path in order to export BPE codes.")
+            segment_char_ngrams(SimpleNamespace(input=map(str, types), vocab={}, n=args.char_n_gram_mode,
+                                                output=subword_nmt_output, separator=args.subword_separator))
+            return [line.rstrip(' \t\n\r') for line in subword_nmt_output.getvalue().splitlines()]
+
+        columns = ["word", "lemma"] if args.mode == 'sentence_to_sentence' else ["word"]
+        memo = char_n_gram_memos.setdefault((args.char_n_gram_mode, args.subword_separator), {})
+
+        def subword_preprocess(df):
+            segment_types(df, columns, segment, memo)
+            return df
+    elif subword_unit(args) == 'bpe':
+        bpe_codes_file_path = resolve_bpe_codes_path(args, full_transform_folder_path)
 
         # BPE processing
         sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'subword-nmt'))
@@ -423,158 +995,233 @@ def main(argv):
             # as advised in subword-nmt's readme, we learn BPE jointly on the sources and targets
             # because they share an alphabet (for the most part)
             from subword_nmt.learn_bpe import learn_bpe
+            if dataset_df is None and args.streaming and args.input is sys.stdin:
+                raise ValueError("BPE codes can't be learned from stdin in streaming mode. Use --bpe_codes_path to pass them.")
             bpe_codes = open(bpe_codes_file_path, "w", encoding='utf-8')
-            learn_bpe(infile_df[["word", "lemma"]].dropna().astype(str).to_string(index=False, header=False).splitlines(),
+            # unless the dataset was already loaded, this is an additional pass over the input file
+            if dataset_df is not None:
+                dataset_dfs = [dataset_df]
+            else:
+                dataset_dfs = read_dataset(args.input, usecols, args.chunk_size if args.streaming else None)
+            learn_bpe((line for chunk_df in dataset_dfs
+                       for line in chunk_df[["word", "lemma"]].dropna().astype(str).to_string(index=False, header=False).splitlines()),
                       bpe_codes, args.bpe_operations)
             bpe_codes.close()
 
         with open(bpe_codes_file_path, encoding='utf-8') as bpe_codes:
             # apply all merge operations, without vocabulary and glossaries
             bpe = BPE(bpe_codes, -1, args.subword_separator, [], [])
-            infile_df.loc[infile_df["word"].notnull(), ["word", "lemma"]] = \
-                infile_df.loc[infile_df["word"].notnull(), ["word", "lemma"]].applymap(bpe.process_line)
 
-    sentence_indices = pd.isna(infile_df).all(axis=1)
-    sentence_end_iterator = (i for i, e in sentence_indices.to_dict().items() if e is True)
+        # segmentations of the types seen so far, shared by all chunks
+        memo_path = bpe_codes_file_path + ".memo" if args.bpe_memo else None
+        memo_key = "{}\t{}".format(file_digest(bpe_codes_file_path).hexdigest(), args.subword_separator)
+        memo = load_memo(memo_path, memo_key) if memo_path else {}
+
+        def subword_preprocess(df):
+            memo_size = len(memo)
+            segment_types(df, ["word", "lemma"], lambda types: [bpe.process_line(type) for type in types], memo)
+            if memo_path and len(memo) > memo_size:
+                save_memo(memo_path, memo_key, memo)
+            return df
+    else:
+        def subword_preprocess(df):
+            return df
+
+    return subword_preprocess
+
+
+def transformer_arguments(args):
+    """
+    :param args: parsed arguments of main
+    :return: keyword arguments of the Transformer of a word_and_context transformation
+    """
+    return {'word_unit': args.word_unit, 'tag_unit': args.tag_unit, 'context_size': args.context_size,
+            'context_char_size': args.context_char_size if hasattr(args, 'context_char_size') else None,
+            'context_tags': args.context_tags, 'tag_first': args.tag_first,
+            'left_context_boundary': args.left_context_boundary, 'tag_boundary': args.tag_boundary,
+            'right_context_boundary': args.right_context_boundary, 'word_boundary': args.word_boundary,
+            'example_boundary': args.example_boundary, 'subword_separator': args.subword_separator}
+
+
+def iterate_examples(argv, batch_size=None):
+    """
+    Transforms a dataset partition like main, but yields the examples instead of writing them to files
+    :param argv: command line arguments of main (--input may also be a stream, output arguments are ignored)
+    :param batch_size: if set, examples are yielded in lists of that many examples (the last one may be shorter)
+    :return: generator of tuple(source_units, target_units) (or of lists of them if batch_size is set)
+    """
+    args = build_parser().parse_args(argv)
+    if args.input is None:
+        args.input = sys.stdin
+
+    usecols = [args.word_column_index, args.lemma_column_index, args.tag_column_index]
+    # without a transform folder, BPE codes can only be read from --bpe_codes_path
+    subword_preprocess = build_subword_preprocessor(args, None)
+    sentence_dfs = split_sentences(subword_preprocess(chunk_df) for chunk_df in
+                                   read_dataset(args.input, usecols, args.chunk_size if args.streaming else None))
 
-    # per-mode specific processing
     if args.mode == 'word_and_context':
-        sentence_dfs = []
-        transformer_args = {'word_unit': args.word_unit, 'tag_unit': args.tag_unit, 'context_size': args.context_size,
-                            'context_char_size': args.context_char_size if hasattr(args, 'context_char_size') else None,
-                            'context_tags': args.context_tags, 'tag_first': args.tag_first,
-                            'left_context_boundary': args.left_context_boundary, 'tag_boundary': args.tag_boundary,
-                            'right_context_boundary': args.right_context_boundary, 'word_boundary': args.word_boundary,
-                            'example_boundary': args.example_boundary, 'subword_separator': args.subword_separator}
+        return Transformer(**transformer_arguments(args)).examples(sentence_dfs, args.context_span, batch_size)
+
+    examples = (output_split for sentence_df in sentence_dfs
+                for output_split in split_sentence_to_sentence(sentence_df, args))
+    return batch(examples, batch_size) if batch_size else examples
+
+
+def open_sink(args, output_source_path, output_target_path):
+    """
+    :param args: parsed arguments of main
+    :param output_source_path:
+    :param output_target_path:
+    :return: OutputSink (SortedOutputSink with --sort_by_length, CompactWriter with --compact), None in debug mode
+    """
+    if args.debug:
+        return None
+    elif args.compact:
+        if args.mode != 'word_and_context' or args.sort_by_length or args.dictionaries:
+            raise ValueError("--compact is only supported in word_and_context mode, "
+                             "without --sort_by_length and --dictionaries.")
+        from data.compact_ud import CompactWriter
+        return CompactWriter(compact_path(output_source_path), transformer_arguments(args), args.context_span)
+    elif args.sort_by_length:
+        return SortedOutputSink(output_source_path, output_target_path, compression=args.compression,
+                                buffer_size=args.buffer_size, dictionaries=args.dictionaries,
+                                bucket_width=args.length_bucket_width)
+    else:
+        return OutputSink(output_source_path, output_target_path, compression=args.compression,
+                          buffer_size=args.buffer_size, dictionaries=args.dictionaries)
+
+
+def cached_artifacts(args, full_transform_folder_path, output_source_path, output_target_path):
+    """
+    Determines where a transformation is cached and which of its files are cached
+    :param args: parsed arguments of main
+    :param full_transform_folder_path:
+    :param output_source_path:
+    :param output_target_path:
+    :return: tuple(cache path, dictionary of artifact name and file path), (None, None) without --cache_dir or in
+    debug mode
+    """
+    if not args.cache_dir or args.debug:
+        return None, None
+    if args.input is sys.stdin:
+        raise ValueError("Transformations of stdin can't be cached. Use --input to specify path.")
+    if args.compact:
+        artifact_paths = {"compact": compact_path(output_source_path)}
+    else:
+        artifact_paths = {"source": output_source_path, "target": output_target_path}
+    if args.sort_by_length:
+        artifact_paths["order"] = order_path(output_source_path)
+    if args.dictionaries:
+        artifact_paths["source_dictionary"] = dictionary_path(output_source_path)
+        artifact_paths["target_dictionary"] = dictionary_path(output_target_path)
+    if args.incremental:
+        artifact_paths["manifest"] = manifest_path(output_source_path)
+    bpe_codes_file_path = resolve_bpe_codes_path(args, full_transform_folder_path) \
+        if subword_unit(args) == 'bpe' else None
+    if bpe_codes_file_path is not None and not os.path.isfile(bpe_codes_file_path):
+        # the codes will be learned from the input, so they are cached along with the output
+        artifact_paths["bpe_codes"] = bpe_codes_file_path
+        bpe_codes_file_path = None
+    return os.path.join(args.cache_dir, cache_key(args, bpe_codes_file_path)), artifact_paths
+
+
+def write_transformation(args, sentence_dfs, output_source_path, output_target_path):
+    """
+    Transforms sentences according to the parsed arguments of main into the output files (or prints them in debug
+    mode), incrementally with --incremental
+    :param args: parsed arguments of main
+    :param sentence_dfs: iterable of sentence dataframes
+    :param output_source_path:
+    :param output_target_path:
+    :return:
+    """
+    if args.incremental:
+        transform_incremental(args, list(sentence_dfs), output_source_path, output_target_path)
+        return
+
+    # both output files are held open for the whole run
+    sink = open_sink(args, output_source_path, output_target_path)
+    try:
+        transform(args, sentence_dfs, sink)
+    finally:
+        if sink is not None:
+            sink.close()
 
-        transformer = Transformer(**transformer_args)
 
-        sentence_start = 0
-        for sentence_end in sentence_end_iterator:
-            sentence_dfs.append(infile_df.loc[sentence_start:sentence_end - 1])
-            sentence_start = sentence_end + 1
+def main(argv):
+    args = build_parser().parse_args(argv)
+    full_transform_folder_path, output_source_path, output_target_path = resolve_output(args)
 
-        for sentence_df_idx, sentence_df in enumerate(sentence_dfs):
-            # adds additional context according to CONTEXT_SPAN to sentence below
-            lc_df = pd.DataFrame()
-            rc_df = pd.DataFrame()
+    print(args, file=sys.stderr)
 
-            if args.context_span > 0:
-                lc_df_ls = sentence_dfs[max(sentence_df_idx - args.context_span, 0):sentence_df_idx]
-                if lc_df_ls:
-                    lc_df = pd.concat(lc_df_ls)
+    # sweep_transform_ud runs every configuration through cached_artifacts and write_transformation as well
+    cache_path, artifact_paths = cached_artifacts(args, full_transform_folder_path, output_source_path,
+                                                  output_target_path)
+    if cache_path is not None and restore(cache_path, artifact_paths):
+        logging.info("Transformation restored from {}".format(cache_path))
+        return
 
-                rc_df_ls = sentence_dfs[sentence_df_idx + 1:min(sentence_df_idx + 1 + args.context_span, len(sentence_dfs) - 1)]
-                if rc_df_ls:
-                    rc_df = pd.concat(rc_df_ls)
+    usecols = [args.word_column_index, args.lemma_column_index, args.tag_column_index]
+    subword_preprocess = build_subword_preprocessor(args, full_transform_folder_path)
 
-            output_source_lines, output_target_lines = transformer.process_sentence(sentence_df, lc_df, rc_df)
+    # loading file either at once or as a stream of chunks
+    sentence_dfs = split_sentences(subword_preprocess(chunk_df) for chunk_df in
+                                   read_dataset(args.input, usecols, args.chunk_size if args.streaming else None))
 
-            if not (output_source_lines or output_target_lines):
-                continue
+    write_transformation(args, sentence_dfs, output_source_path, output_target_path)
 
-            if args.debug:
-                if args.print_file == 'source':
-                    print("\n".join(output_source_lines))
-                else:
-                    print("\n".join(output_target_lines))
-            else:
-                with open(output_source_path, 'a+', encoding='utf-8') as outsourcefile, \
-                        open(output_target_path, 'a+', encoding='utf-8') as outtargetfile:
-                    outsourcefile.write("\n".join(output_source_lines) + "\n")
-                    outtargetfile.write("\n".join(output_target_lines) + "\n")
-    elif args.mode == 'sentence_to_sentence':
-        sentence_start = 0
-
-        if args.example_boundary is not None:
-            pos_close_tag = args.example_boundary.find('<') + 1
-            open_tag = args.example_boundary
-            close_tag = open_tag[:pos_close_tag] + '/' + open_tag[pos_close_tag:]
-
-        for sentence_end in sentence_end_iterator:
-            output_source_line = [open_tag]
-            output_target_line = [open_tag]
-
-            last_split_pos = 0
+    if cache_path is not None:
+        store(cache_path, artifact_paths)
 
-            for sentence_idx in range(sentence_start, sentence_end):
-                subwords = re.split("\s*{}\s*".format(args.subword_separator),
-                                    infile_df.at[sentence_idx, "word"])
-                lemma = re.split("\s*{}\s*".format(args.subword_separator),
-                                 infile_df.at[sentence_idx, "lemma"])
-                tag = infile_df.at[sentence_idx, "tag"]
 
-                # inserts a breaking point at the position before this word+tag were inserted in both the source and the target
-                output_source_insertion_point = len(output_source_line)
-                output_target_insertion_point = len(output_target_line)
+def transform(args, sentence_dfs, sink):
+    """
+    Transforms sentences according to the parsed arguments of main and writes them to the sink (or prints them in
+    debug mode).
+    :param args: parsed arguments of main
+    :param sentence_dfs: iterable of sentence dataframes
+    :param sink: OutputSink (or CompactWriter), None in debug mode
+    :return:
+    """
+    # per-mode specific processing
+    if args.mode == 'word_and_context':
+        transformer = Transformer(**transformer_arguments(args))
 
-                output_source_line.extend(subwords)
-                output_source_line.append(args.word_boundary)
+        if args.compact and not args.debug:
+            # examples are expanded when they are read (see compact_ud)
+            for sentence_df in sentence_dfs:
+                sink.write(sentence_df)
+            return
 
-                if not args.tag_first:
-                    output_target_line.extend(lemma)
-                    output_target_line.append(args.tag_boundary)
+        def emit(output_lines):
+            for output_source_lines, output_target_lines in output_lines:
+                if not (output_source_lines or output_target_lines):
+                    continue
 
-                if args.tag_unit == "word":
-                    output_target_line.append(tag)
+                if args.debug:
+                    if args.print_file == 'source':
+                        print("\n".join(output_source_lines))
+                    else:
+                        print("\n".join(output_target_lines))
                 else:
-                    output_target_line.extend(tag)
-
-                if args.tag_first:
-                    output_target_line.append(args.tag_boundary)
-                    output_target_line.extend(lemma)
-
-                output_target_line.append(args.word_boundary)
-
-                # if the target translation overflows (target sentence is guaranteed to be longer in size)
-                # sanity check: awk 'NF > 50 { print NR, NF }' dev_source | wc -l
-                last_split_size = len(output_target_line) - last_split_pos
-                if hasattr(args, 'sentence_size') and last_split_size > args.sentence_size:
-                    output_source_line.insert(output_source_insertion_point, defaults["SENTENCE_SPLIT_TAG"])
-                    output_target_line.insert(output_target_insertion_point, defaults["SENTENCE_SPLIT_TAG"])
-                    # set to 1, for internal slices to account for the opening <w> sentence boundary tag
-                    last_split_pos = output_target_insertion_point
-
-            sentence_start = sentence_end + 1
-
-            output_source_line.pop()
-            output_target_line.pop()
-
-            output_source_line.append(close_tag)
-            output_target_line.append(close_tag)
-
-            assert output_source_line.count(defaults["SENTENCE_SPLIT_TAG"]) == output_target_line.count(defaults["SENTENCE_SPLIT_TAG"]), \
-                "Sentence splits in sentence_to_sentence mode are wrong."
-
-            # split sentences if necessary
-            split_cond = True
-            end_source_line_split_pos = 0
-            end_target_line_split_pos = 0
-
-            while split_cond:
-                try:
-                    start_source_line_pos = end_source_line_split_pos
-                    start_target_line_pos = end_target_line_split_pos
-                    end_source_line_split_pos = output_source_line.index(defaults["SENTENCE_SPLIT_TAG"], end_source_line_split_pos) + 1
-                    end_target_line_split_pos = output_target_line.index(defaults["SENTENCE_SPLIT_TAG"], end_target_line_split_pos) + 1
-                except ValueError:
-                    split_cond = False
-                    end_source_line_split_pos = len(output_source_line) + 1
-                    end_target_line_split_pos = len(output_target_line) + 1
-
-                output_source_line_split = output_source_line[start_source_line_pos:end_source_line_split_pos - 1]
-                output_target_line_split = output_target_line[start_target_line_pos:end_target_line_split_pos - 1]
-
-                if output_source_line_split[-1] == defaults["WORD_BOUNDARY"]:
-                    output_source_line_split[-1] = close_tag
-                if output_source_line_split[0] != open_tag:
-                    output_source_line_split.insert(0, open_tag)
-
-                if output_target_line_split[-1] == defaults["WORD_BOUNDARY"]:
-                    output_target_line_split[-1] = close_tag
-                if output_target_line_split[0] != open_tag:
-                    output_target_line_split.insert(0, open_tag)
-
+                    sink.write(output_source_lines, output_target_lines)
+
+        if args.workers > 1:
+            # shards are transformed in parallel and merged back in their original order
+            from multiprocessing import Pool
+            shards = ((transformer, args.context_span) + shard
+                      for shard in shard_sentences(sentence_dfs, args.context_span, args.shard_size))
+            with Pool(args.workers) as pool:
+                emit(output_lines for shard_output_lines in pool.imap(transform_shard, shards)
+                     for output_lines in shard_output_lines)
+        elif args.streaming:
+            emit(transform_stream(transformer, sentence_dfs, args.context_span))
+        else:
+            emit(transform_document(transformer, list(sentence_dfs), args.context_span))
+    elif args.mode == 'sentence_to_sentence':
+        for sentence_df in sentence_dfs:
+            for output_source_line_split, output_target_line_split in split_sentence_to_sentence(sentence_df, args):
                 if args.debug:
                     if args.print_file == 'source':
                         print(" ".join(output_source_line_split))
@@ -582,10 +1229,117 @@ def main(argv):
                         print(" ".join(output_target_line_split))
                     print("\n")
                 else:
-                    with open(output_source_path, 'a+', encoding='utf-8') as outsourcefile, \
-                            open(output_target_path, 'a+', encoding='utf-8') as outtargetfile:
-                        outsourcefile.write(" ".join(output_source_line_split) + "\n")
-                        outtargetfile.write(" ".join(output_target_line_split) + "\n")
+                    sink.write([" ".join(output_source_line_split)], [" ".join(output_target_line_split)])
+
+
+def transform_sentences(args, sentence_dfs, sentence_indices):
+    """
+    Transforms some sentences of a document according to the parsed arguments of main
+    :param args: parsed arguments of main
+    :param sentence_dfs: list of sentence dataframes in document order
+    :param sentence_indices: sorted indices of the sentences to transform
+    :return: dictionary of sentence index and tuple(output_source_lines, output_target_lines)
+    """
+    output_lines = {}
+
+    if args.mode == 'word_and_context':
+        transformer = Transformer(**transformer_arguments(args))
+        span = args.context_span
+
+        # consecutive sentences are transformed together, with the sentences they draw context from
+        runs = []
+        for sentence_idx in sentence_indices:
+            if runs and runs[-1][1] == sentence_idx:
+                runs[-1][1] += 1
+            else:
+                runs.append([sentence_idx, sentence_idx + 1])
+
+        for first, last in runs:
+            start = max(first - span, 0)
+            end = min(last + span, len(sentence_dfs))
+            run_output_lines = transform_document(transformer, sentence_dfs[start:end], span, first - start,
+                                                  last - start, end == len(sentence_dfs))
+            output_lines.update(zip(range(first, last), run_output_lines))
+    elif args.mode == 'sentence_to_sentence':
+        for sentence_idx in sentence_indices:
+            output_splits = split_sentence_to_sentence(sentence_dfs[sentence_idx], args)
+            output_lines[sentence_idx] = ([" ".join(source_split) for source_split, _ in output_splits],
+                                          [" ".join(target_split) for _, target_split in output_splits])
+
+    return output_lines
+
+
+def transform_incremental(args, sentence_dfs, output_source_path, output_target_path):
+    """
+    Transforms only the sentences whose output may differ from that recorded in the manifest of a previous
+    transformation with the same arguments, i.e. changed sentences and those that draw context from them, and copies
+    the output lines of the others from the previous output files. Without a manifest, all sentences are transformed.
+    :param args: parsed arguments of main
+    :param sentence_dfs: list of sentence dataframes in document order
+    :param output_source_path:
+    :param output_target_path:
+    :return:
+    """
+    if args.debug or args.compact or args.sort_by_length:
+        raise ValueError("--incremental needs source and target files, it can't be used with --debug, --compact "
+                         "or --sort_by_length.")
+
+    output_paths = [output_source_path, output_target_path]
+    manifest_file_path = manifest_path(output_source_path)
+    key = arguments_digest(args).hexdigest()
+    previous_entries = load_manifest(manifest_file_path, key)
+    if previous_entries is not None and not all(os.path.isfile(output_path) for output_path in output_paths):
+        previous_entries = None
+    # the manifest only describes the output files until they are replaced
+    if os.path.lexists(manifest_file_path):
+        os.remove(manifest_file_path)
+
+    context_span = args.context_span if args.mode == 'word_and_context' else 0
+    digests = [sentence_digest(sentence_df) for sentence_df in sentence_dfs]
+    signatures = window_signatures(digests, context_span)
+
+    previous_lines = {}
+    if previous_entries is not None:
+        previous_signatures = window_signatures([digest for digest, _, _ in previous_entries], context_span)
+        for signature, (_, start, count) in zip(previous_signatures, previous_entries):
+            previous_lines.setdefault(signature, (start, count))
+
+    changed = [sentence_idx for sentence_idx, signature in enumerate(signatures) if signature not in previous_lines]
+    logging.info("Transforming {} of {} sentences".format(len(changed), len(sentence_dfs)))
+    output_lines = transform_sentences(args, sentence_dfs, changed)
+
+    # the previous output files are read while the new ones are written
+    previous_paths = [output_path + ".previous" for output_path in output_paths]
+    for output_path, previous_path in zip(output_paths, previous_paths):
+        if os.path.lexists(output_path):
+            os.replace(output_path, previous_path)
+    readers = [LineReader(previous_path, args.compression) for previous_path in previous_paths]
+
+    entries = []
+    line_count = 0
+    sink = open_sink(args, output_source_path, output_target_path)
+    try:
+        for sentence_idx, signature in enumerate(signatures):
+            if sentence_idx in output_lines:
+                output_source_lines, output_target_lines = output_lines[sentence_idx]
+            else:
+                start, count = previous_lines[signature]
+                output_source_lines, output_target_lines = [reader.read(start, count) for reader in readers]
+
+            if output_source_lines or output_target_lines:
+                sink.write(output_source_lines, output_target_lines)
+
+            entries.append((digests[sentence_idx], line_count, len(output_source_lines)))
+            line_count += len(output_source_lines)
+    finally:
+        sink.close()
+        for reader in readers:
+            reader.close()
+
+    for previous_path in previous_paths:
+        if os.path.lexists(previous_path):
+            os.remove(previous_path)
+    save_manifest(manifest_file_path, key, entries)
 
 
 if __name__ == "__main__":
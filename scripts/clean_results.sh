@@ -1,4 +1,4 @@
 #!/bin/bash
 # Author: Bogomil Gospodinov
-rm -rfv models/ data/input/ logs/
+rm -rfv models/ data/input/ data/cache/ logs/
 rm -fv *.out *.log
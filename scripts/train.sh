@@ -27,6 +27,8 @@ SLURM_JOB_ID=${SLURM_JOB_ID:=$datetime_name}
 SLURM_ORIGINAL_JOB_ID=${SLURM_ORIGINAL_JOB_ID}
 skip_resume_training=${skip_resume_training:+1}
 seed=${seed:=0}
+# joint accuracy below which the dev set translation is stopped early (scored live while it is being translated)
+live_score_threshold=${live_score_threshold}
 
 # path to nematus (relative to root dir project)
 nematus=${nematus:=nematus}
@@ -49,8 +51,13 @@ if [[ -z "$SLURM_ORIGINAL_JOB_ID" ]]; then
 	transform_mode=${transform_mode:=word_and_context}
 	context_tags=${context_tags:=none}
 	tag_first=${tag_first:+--tag_first}
+	streaming=${streaming:+--streaming}
+	sort_by_length=${sort_by_length:+--sort_by_length}
+	transform_workers=${transform_workers:=1}
 	bpe_operations=${bpe_operations:=500}
 	output_dir=${TMPDIR:-data/input/}
+	# shared by all jobs, identical partitions are transformed only once
+	transform_cache_dir=${transform_cache_dir:=data/cache/}
 	word_column_index=${word_column_index:=0}
 	lemma_column_index=${lemma_column_index:=1}
 	tag_column_index=${tag_column_index:=2}
@@ -72,6 +79,7 @@ if [[ -z "$SLURM_ORIGINAL_JOB_ID" ]]; then
 	maxlen=${maxlen:=120}
 	translation_maxlen=${translation_maxlen:=50}
 	sentence_size=${sentence_size:=50}
+	sentence_split=${sentence_split:=greedy}
 	valid_burn_in=${valid_burn_in:=10000}
 	valid_freq=${valid_freq:=3000}
 	batch_size=${batch_size:=60}
@@ -92,6 +100,8 @@ if [[ -z "$SLURM_ORIGINAL_JOB_ID" ]]; then
 	for partition in training dev test ; do
 		input_file=${original_dataset}/${partition}.txt
 		echo Transforming ${input_file}
+		# nematus dictionaries are counted while transforming the training set
+		dictionaries=$( [ "$partition" = training ] && printf %s --dictionaries )
 		set -x
 
 		transform_folder_path=$( /usr/bin/time -f %e $PYTHON_INTERPRETER_PATH -m data.transform_ud \
@@ -99,16 +109,22 @@ if [[ -z "$SLURM_ORIGINAL_JOB_ID" ]]; then
 		--output $output_dir \
 		--mode $transform_mode \
 		--sentence_size $sentence_size \
+		--sentence_split $sentence_split \
 		--context_tags $context_tags \
 		--context_span $context_span \
 		--word_unit $word_unit \
 		--tag_unit $tag_unit \
 		$tag_first \
+		$streaming \
+		$sort_by_length \
+		$dictionaries \
+		--workers $transform_workers \
 		--context_unit $context_unit \
 		--bpe_operations $bpe_operations \
 		--context_size $context_size \
 		--char_n_gram_mode $char_n_gram_mode \
 		--transform_appendix $SLURM_JOB_ID \
+		--cache_dir $transform_cache_dir \
 		--word_column_index $word_column_index \
 		--lemma_column_index $lemma_column_index \
 		--tag_column_index $tag_column_index \
@@ -143,7 +159,9 @@ if [[ -z "$SLURM_ORIGINAL_JOB_ID" ]]; then
 	mkdir -p $model_dir/${SLURM_JOB_ID}
 	mkdir -p $model_dir/data
 
-	/usr/bin/time -f %e cp -n $transform_folder_path/* $model_dir/data/
+	# hard link the transformed files (falling back to copies across file systems)
+	/usr/bin/time -f %e cp -nlL $transform_folder_path/* $model_dir/data/ 2> /dev/null \
+		|| /usr/bin/time -f %e cp -nL $transform_folder_path/* $model_dir/data/
 
 	# build dictionaries only if they dont exist
 	if [[ ! -f $model_dir/data/training_source.json && ! -f $model_dir/data/training_target.json ]]; then
@@ -223,27 +241,46 @@ else
 	set +x
 fi
 
-echo Translating dev set
-/usr/bin/time -f %e $PYTHON_INTERPRETER_PATH ${nematus}/nematus/translate.py \
--m ${model_dir}/${SLURM_JOB_ID}/model.npz \
--i ${model_dir}/data/dev_source \
--o ${model_dir}/data/dev_hypothesis.${SLURM_JOB_ID} \
--k 0 -n -p 1 -v
-
 if [ "$transform_mode" = "sentence_to_sentence" ] ; then
 	set -x
 	pred_ground_file=${model_dir}/data/dev_source
 	score_ground_file=${original_dataset}/dev.txt
+	live_score_mode="--sentence_to_sentence $pred_ground_file"
 	set +x
 else
 	set -x
 	pred_ground_file=${original_dataset}/dev.txt
 	score_ground_file=$pred_ground_file
+	live_score_mode=
 	set +x
 fi
 
+# examples transformed with --sort_by_length are put back in their original order
+order=$( [ -f ${model_dir}/data/dev_source.order ] && printf %s "--order ${model_dir}/data/dev_source.order" )
+
+echo Translating dev set
+/usr/bin/time -f %e $PYTHON_INTERPRETER_PATH ${nematus}/nematus/translate.py \
+-m ${model_dir}/${SLURM_JOB_ID}/model.npz \
+-i ${model_dir}/data/dev_source \
+-o ${model_dir}/data/dev_hypothesis.${SLURM_JOB_ID} \
+-k 0 -n -p 1 -v &
+translate_pid=$!
+
+echo Scoring dev hypotheses while translating
+$PYTHON_INTERPRETER_PATH -m analysis.follow_score ${model_dir}/data/dev_hypothesis.${SLURM_JOB_ID} --ground $score_ground_file \
+--pid $translate_pid $live_score_mode $order ${live_score_threshold:+--abort_below $live_score_threshold} \
+> ${model_dir}/data/dev_live_score.${SLURM_JOB_ID}
+if [ $? -eq 3 ] ; then
+	echo Stopping translation of a hopeless run
+	pkill -P $translate_pid
+	kill $translate_pid
+	wait $translate_pid
+	exit 0
+fi
+wait $translate_pid
+
 echo Postprocessing dev predictions
-/usr/bin/time -f %e $PYTHON_INTERPRETER_PATH -m data.postprocess_nematus ${model_dir}/data/dev_hypothesis.${SLURM_JOB_ID} $pred_ground_file --${transform_mode} > ${model_dir}/data/dev_prediction.${SLURM_JOB_ID}
+/usr/bin/time -f %e $PYTHON_INTERPRETER_PATH -m data.postprocess_nematus ${model_dir}/data/dev_hypothesis.${SLURM_JOB_ID} $pred_ground_file --${transform_mode} $order > ${model_dir}/data/dev_prediction.${SLURM_JOB_ID}
 
 echo Calculating score
 /usr/bin/time -f %e $PYTHON_INTERPRETER_PATH -m analysis.score_prediction ${model_dir}/data/dev_prediction.${SLURM_JOB_ID} --ground $score_ground_file > ${model_dir}/data/dev_score.${SLURM_JOB_ID}